@@ -20,7 +20,7 @@
 
 import sys
 import argparse
-from geoslurp.db import Inventory, Credentials
+from geoslurp.db import Inventory, Credentials, runStatsReport
 from geoslurp.db import GeoslurpConnector
 import json
 import logging
@@ -99,6 +99,12 @@ def main():
             sys.exit(1)
 
     #print registered datasets (i.e. tables)
+    if args.info and args.runstats:
+        #report the performance metrics of previous runs
+        for line in runStatsReport(DbConn,item=args.dvfexpr,last=args.runstats):
+            print(line)
+        sys.exit(0)
+
     if args.info:
         slurpInvent=Inventory(DbConn)
         if args.dvfexpr:
@@ -193,7 +199,7 @@ def main():
         sys.exit(0)
     
     
-    if not (args.pull or args.register or args.purge_cache or args.purge_data or args.purge_entry or args.export):
+    if not (args.pull or args.register or args.maintenance or args.purge_cache or args.purge_data or args.purge_entry or args.export):
         sys.exit(0)
     
     if args.pull:
@@ -210,6 +216,11 @@ def main():
             regopts={}
         args.register=True
     
+    if type(args.maintenance) == dict:
+        maintopts=args.maintenance
+    else:
+        maintopts={}
+    
     if dataset is not None:
         #initialize the class
         ds=dataset(DbConn)
@@ -226,17 +237,42 @@ def main():
         if args.purge_entry:
             ds.purgeentry()
 
-        if args.pull:
+        registered=False
+        if args.pipeline and args.pull and args.register:
+            #pull and register at the same time
             try:
-                ds.pull(**pullopts)
+                with ds.recordRun("pipeline"):
+                    ds.pipeline(pullopts,regopts)
+                registered=True
+            except KeyboardInterrupt:
+                ds.halt()
+        elif args.pull:
+            try:
+                with ds.recordRun("pull"):
+                    ds.pull(**pullopts)
             except KeyboardInterrupt:
                 ds.halt()
 
-        if args.register:
+        if args.register and not (args.pipeline and args.pull):
             try:
-                ds.register(**regopts)
+                with ds.recordRun("register"):
+                    ds.register(**regopts)
+                registered=True
             except KeyboardInterrupt:
                 ds.halt()
+        #release the extraction workers which are kept alive during a register
+        ds.closeExtractPool()
+
+        if args.maintenance or (registered and ds.postmaintenance):
+            with ds.recordRun("maintenance"):
+                ds.maintenance(**maintopts)
+        elif registered:
+            #indexes which were dropped/postponed during the load need to be there afterwards
+            ds.buildDeferredIndexes()
+
+        if args.pull or args.register:
+            #keep the cache within its configured quota
+            ds.enforceCacheQuota()
 
         if args.export:
             ds.export(args.export)
@@ -250,7 +286,8 @@ def main():
         df=func(DbConn)
 
         if args.register:
-            df.register(**regopts)
+            with df.recordRun("register"):
+                df.register(**regopts)
         
         if args.purge_entry:
             df.purgeentry()
@@ -263,7 +300,8 @@ def main():
         dv=view(DbConn)
 
         if args.register:
-            dv.register(**regopts)
+            with dv.recordRun("register"):
+                dv.register(**regopts)
         
         if args.purge_entry:
             dv.purgeentry()
@@ -331,6 +369,9 @@ def addCommandLineArgs():
         parser.add_argument('-i','--info',action='store_true',
                             help="Show information about selected datasets")
 
+        parser.add_argument('--runstats',metavar="N",type=int,nargs="?",const=10,default=None,
+                            help="Use with --info: report the performance of the last N (default 10) pull/register runs per dataset (optionally restricted to the selected item)")
+
         parser.add_argument('-l','--list',action='store_true',
                             help="List all datasets which are available to use. When a positional argument is supplied it will be used as a search string")
 
@@ -349,6 +390,10 @@ def addCommandLineArgs():
 
         parser.add_argument("--register", metavar="JSON",action=JsonParseAction, nargs="?",const=False, default=False,
                             help="Register data in the database (possibly pass on options as a JSON dict)")
+        parser.add_argument("--pipeline",action="store_true",
+                            help="Use with --pull and --register: register downloaded files while the remaining files are still being downloaded (when supported by the dataset)")
+        parser.add_argument("--maintenance", metavar="JSON",action=JsonParseAction, nargs="?",const=False, default=False,
+                            help="Run post-load maintenance on the table: rebuild postponed indexes, VACUUM ANALYZE and optionally CLUSTER (e.g. {\"cluster\":\"geom\"}). After a register only the postponed indexes are built, unless the dataset sets postmaintenance")
         parser.add_argument("--export", metavar="OUTPUTFILE",type=str, nargs="?",const="auto", default=False,
                             help="Export the selected tables in a SQLITE or geopackage file. The type of output is determined from the OUTPUTFILE extension (.sql or .gpkg). When no OUTPUTFILE is provided an SQLITE or gpkg file is dumped in the current directory (depending on whether thee table has a geometry columns.")
 
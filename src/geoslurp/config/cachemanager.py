@@ -0,0 +1,191 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#Keeps track of the size and last use of the entries in the geoslurp cache directory and evicts the least recently used entries when a quota is exceeded
+
+import os
+import re
+import shutil
+import sqlite3
+import time
+from geoslurp.config.slurplogger import slurplogger
+
+def parseBytes(quota):
+    """Converts a quota such as 500000, '200M' or '1.5T' into a number of bytes"""
+    if quota is None:
+        return None
+    if isinstance(quota,(int,float)):
+        return int(quota)
+    mtch=re.match(r'^\s*([0-9.]+)\s*([kKmMgGtT]?)i?[bB]?\s*$',quota)
+    if not mtch:
+        raise ValueError(f"Cannot interpret cache quota {quota}")
+    scale={"":1,"k":1024,"m":1024**2,"g":1024**3,"t":1024**4}[mtch.group(2).lower()]
+    return int(float(mtch.group(1))*scale)
+
+def diskUsage(path):
+    """Returns the size in bytes and the latest access or modification time of a file or directory tree"""
+    if not os.path.isdir(path):
+        st=os.stat(path)
+        return st.st_size,max(st.st_atime,st.st_mtime)
+    size=0
+    lastused=os.stat(path).st_mtime
+    for root,dirs,files in os.walk(path):
+        for fl in files:
+            try:
+                st=os.stat(os.path.join(root,fl))
+            except FileNotFoundError:
+                continue
+            size+=st.st_size
+            lastused=max(lastused,st.st_atime,st.st_mtime)
+    return size,lastused
+
+class CacheManager:
+    """Maintains a small sqlite index of the entries in a cache directory
+    The cache is organized as cacheroot/schema/dataset/entry, where an entry is a file or a directory (e.g. an extracted shapefile) which is evicted as a whole
+    :param cacheroot: root of the cache directory
+    :param quota: total allowed size of the cache (bytes or strings like '200G'), None means no limit
+    :param schemaquota: dictionary with quota per schema"""
+    depth=3
+    indexfile=".geoslurp_cacheindex.sqlite"
+    def __init__(self,cacheroot,quota=None,schemaquota=None):
+        self.root=os.path.abspath(os.path.expandvars(cacheroot))
+        self.quota=parseBytes(quota)
+        self.schemaquota={ky:parseBytes(val) for ky,val in (schemaquota or {}).items()}
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self.db=sqlite3.connect(os.path.join(self.root,self.indexfile))
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, schema TEXT, size INTEGER, lastused REAL)")
+        self.db.commit()
+
+    @classmethod
+    def fromSettings(cls,conf,cacheroot):
+        """Creates a cache manager using the 'CacheQuota' setting, which is either a single quota or a dictionary {"default":quota,schema:quota,..}"""
+        try:
+            quota=conf["CacheQuota"]
+        except RuntimeError:
+            quota=None
+        if isinstance(quota,dict):
+            schemaquota=dict(quota)
+            quota=schemaquota.pop("default",None)
+        else:
+            schemaquota=None
+        return cls(cacheroot,quota,schemaquota)
+
+    def enabled(self):
+        return self.quota is not None or bool(self.schemaquota)
+
+    def entryOf(self,path):
+        """Returns the (relative) cache entry which contains path or None when it is outside the cache"""
+        rel=os.path.relpath(os.path.abspath(path),self.root)
+        if rel.startswith(os.pardir) or rel == os.curdir:
+            return None
+        return os.path.join(*rel.split(os.sep)[:self.depth])
+
+    def touch(self,path):
+        """Marks the cache entry which contains path as used"""
+        entry=self.entryOf(path)
+        if entry is None or not os.path.exists(os.path.join(self.root,entry)):
+            return
+        self.db.execute("UPDATE entries SET lastused=? WHERE path=?",(time.time(),entry))
+        self.db.commit()
+
+    def scan(self):
+        """Synchronizes the index with the cache directory"""
+        found={}
+        def walk(reldir,level):
+            for item in os.listdir(os.path.join(self.root,reldir)):
+                if level == 1 and item.startswith('.'):
+                    #e.g. the index itself or other administrative files
+                    continue
+                rel=os.path.join(reldir,item)
+                if level < self.depth and os.path.isdir(os.path.join(self.root,rel)):
+                    walk(rel,level+1)
+                else:
+                    found[rel]=diskUsage(os.path.join(self.root,rel))
+        walk("",1)
+
+        known={path:lastused for path,lastused in self.db.execute("SELECT path,lastused FROM entries")}
+        for path in known:
+            if path not in found:
+                self.db.execute("DELETE FROM entries WHERE path=?",(path,))
+        for path,(size,lastused) in found.items():
+            #keep the last use time from the index when it is more recent than the filesystem times
+            lastused=max(lastused,known.get(path,0))
+            self.db.execute("INSERT OR REPLACE INTO entries (path,schema,size,lastused) VALUES (?,?,?,?)",(path,path.split(os.sep)[0],size,lastused))
+        self.db.commit()
+
+    def usage(self,schema=None):
+        """Returns the number of entries and the total size of the (schema part of the) cache"""
+        if schema:
+            return self.db.execute("SELECT count(*),coalesce(sum(size),0) FROM entries WHERE schema=?",(schema,)).fetchone()
+        return self.db.execute("SELECT count(*),coalesce(sum(size),0) FROM entries").fetchone()
+
+    def forget(self,path):
+        """Removes the entries below path from the index (e.g. after purging)"""
+        rel=os.path.relpath(os.path.abspath(path),self.root)
+        self.db.execute("DELETE FROM entries WHERE path=? OR path LIKE ?",(rel,rel+os.sep+'%'))
+        self.db.commit()
+
+    def evict(self,entry):
+        path=os.path.join(self.root,entry)
+        slurplogger().info(f"Evicting {path} from the cache")
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        self.db.execute("DELETE FROM entries WHERE path=?",(entry,))
+
+    def enforce(self,keep=None):
+        """Evicts least recently used entries until the cache fits within the configured quota
+        :param keep: list of directories which are in use and will not be evicted
+        :returns the number of evicted bytes"""
+        if not self.enabled():
+            return 0
+        self.scan()
+        keep=[os.path.relpath(os.path.abspath(kp),self.root) for kp in (keep or [])]
+        def iskept(entry):
+            return any(entry == kp or entry.startswith(kp+os.sep) or kp.startswith(entry+os.sep) for kp in keep)
+
+        #mark kept entries as used now
+        for kp in keep:
+            self.touch(os.path.join(self.root,kp))
+
+        evicted=0
+        checks=[(schema,quota) for schema,quota in self.schemaquota.items()]
+        checks.append((None,self.quota))
+        for schema,quota in checks:
+            if quota is None:
+                continue
+            nentries,used=self.usage(schema)
+            if used <= quota:
+                continue
+            if schema:
+                lru=self.db.execute("SELECT path,size FROM entries WHERE schema=? ORDER BY lastused",(schema,)).fetchall()
+            else:
+                lru=self.db.execute("SELECT path,size FROM entries ORDER BY lastused").fetchall()
+            for entry,size in lru:
+                if used <= quota:
+                    break
+                if iskept(entry):
+                    continue
+                self.evict(entry)
+                used-=size
+                evicted+=size
+            if used > quota:
+                slurplogger().warning(f"Cache {os.path.join(self.root,schema or '')} still exceeds its quota of {quota} bytes: entries in use can not be evicted")
+        self.db.commit()
+        return evicted
@@ -0,0 +1,56 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#Process wide counters which are used to record the performance of a run
+import logging
+import resource
+from threading import Lock
+
+class RunCounters:
+    """Thread safe counters of the amount of downloaded bytes and written rows"""
+    def __init__(self):
+        self._lock=Lock()
+        self.bytes=0
+        self.rows=0
+
+    def addBytes(self,nbytes):
+        with self._lock:
+            self.bytes+=int(nbytes)
+
+    def addRows(self,nrows):
+        with self._lock:
+            self.rows+=int(nrows)
+
+    def snapshot(self):
+        with self._lock:
+            return {"bytes":self.bytes,"rows":self.rows}
+
+runcounters=RunCounters()
+
+def peakRSS():
+    """Returns the peak resident memory (in bytes) of this process and its (finished) child processes"""
+    #note: ru_maxrss is expressed in kilobytes on linux
+    return 1024*max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+class ErrorCountHandler(logging.Handler):
+    """Logging handler which counts the amount of errors which are logged"""
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count=0
+    
+    def emit(self,record):
+        self.count+=1
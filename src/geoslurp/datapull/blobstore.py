@@ -0,0 +1,188 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#Content addressed store of downloaded files, which are linked into the dataset directories so every upstream file is downloaded and stored only once
+
+import os
+import errno
+import stat
+import fcntl
+import shutil
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from geoslurp.config.slurplogger import slurplog
+from geoslurp.datapull.uri import UriFile
+from geoslurp.datapull.validators import ValidatorStore
+from geoslurp.tools.filetools import sha256File
+
+#ioctl request to clone (reflink) a file on copy-on-write filesystems (linux FICLONE)
+FICLONE=0x40049409
+
+def linkFile(src,dest,hardlink=True):
+    """Links src to dest, using a hardlink, a reflink or (as a last resort) a copy
+    An existing destination is replaced atomically
+    :param hardlink: try a hardlink first, otherwise dest becomes a private (writable) file
+    :returns: False when dest already is the same file as src"""
+    if hardlink and os.path.exists(dest) and os.path.samefile(src,dest):
+        return False
+    tmp=dest+".link"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        if not hardlink:
+            raise OSError(errno.EPERM,"private copy requested")
+        os.link(src,tmp)
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV,errno.EPERM,errno.EMLINK,errno.ENOTSUP):
+            raise
+        #e.g. a different filesystem: try a reflink before copying
+        with open(src,'rb') as fsrc, open(tmp,'wb') as fdest:
+            try:
+                fcntl.ioctl(fdest.fileno(),FICLONE,fsrc.fileno())
+            except OSError:
+                shutil.copyfileobj(fsrc,fdest)
+        shutil.copystat(src,tmp)
+        #the copy does not share its content, so it may be modified
+        os.chmod(tmp,os.stat(tmp).st_mode|stat.S_IWUSR)
+    os.replace(tmp,dest)
+    return True
+
+class BlobStore:
+    """Store of downloaded files, addressed by their sha256 hash
+    Layout of the store:
+        blobs/ab/abcdef..: the (read-only) content of the files
+        urls/ab/<hash of url>/filename: link to the last downloaded version of an url
+        index.sqlite: maps (url,validator) to the hash of the content
+    :param root: root directory of the store"""
+    def __init__(self,root):
+        self.root=root
+        for sub in ["blobs","urls","locks"]:
+            os.makedirs(os.path.join(root,sub),exist_ok=True)
+        self.db=sqlite3.connect(os.path.join(root,"index.sqlite"),check_same_thread=False,timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS blobs (url TEXT, validator TEXT, sha256 TEXT, size INTEGER, PRIMARY KEY (url,validator))")
+        self.db.commit()
+        self.lock=threading.Lock()
+        #ETag/Last-Modified of the urls in the store
+        self.validators=ValidatorStore(os.path.join(root,"index.sqlite"))
+
+    @staticmethod
+    def urlHash(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def blobPath(self,sha):
+        return os.path.join(self.root,"blobs",sha[:2],sha)
+
+    def urlDir(self,url):
+        urlhash=self.urlHash(url)
+        return os.path.join(self.root,"urls",urlhash[:2],urlhash)
+
+    @contextmanager
+    def locked(self,url):
+        """Exclusive lock on an url, which is shared with other processes using the store"""
+        with open(os.path.join(self.root,"locks",self.urlHash(url)+".lock"),'w') as fid:
+            fcntl.flock(fid,fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fid,fcntl.LOCK_UN)
+
+    def validator(self,uri):
+        """Returns the validator which identifies the version of an url (the known modification time or the stored ETag/Last-Modified)"""
+        if uri.lastmod:
+            return uri.lastmod.isoformat()
+        return self.storedValidator(uri.url)
+
+    def storedValidator(self,url):
+        val=self.validators.get(url)
+        if val:
+            return str(val["etag"] or val["lastmodified"] or '')
+        return ''
+
+    def lookup(self,url,validator):
+        """Returns the sha256 of the stored version of an url (or None)"""
+        with self.lock:
+            row=self.db.execute("SELECT sha256 FROM blobs WHERE url=? AND validator=?",(url,validator)).fetchone()
+        if row and os.path.exists(self.blobPath(row[0])):
+            return row[0]
+        return None
+
+    def add(self,url,validator,path):
+        """Moves a downloaded file into the store (path is replaced by a link to the blob) and returns its sha256"""
+        sha=sha256File(path)
+        blob=self.blobPath(sha)
+        if os.path.exists(blob):
+            #identical content is already stored (e.g. downloaded from a mirror)
+            linkFile(blob,path)
+        else:
+            os.makedirs(os.path.dirname(blob),exist_ok=True)
+            linkFile(path,blob)
+            #protect the content against modifications through the (hard) links
+            #note: callers which modify files in place request a private copy instead (writable=True)
+            os.chmod(blob,0o444)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO blobs (url,validator,sha256,size) VALUES (?,?,?,?)",(url,validator,sha,os.path.getsize(blob)))
+            self.db.commit()
+        return sha
+
+    def fetch(self,uri,direc,outfile=None,writable=False,**kwargs):
+        """Download an uri through the store and link the result into a directory
+        :param uri: uri to download (e.g. http or ftp Uri)
+        :param direc: directory to put the file in
+        :param outfile: alternative name of the file
+        :param writable: put a private (reflinked or copied) file in direc which can be modified in place, rather than a read-only hardlink
+        :param kwargs: additional options for the download (e.g. segments)
+        :returns: the local UriFile and whether the file in direc was updated"""
+        with self.locked(uri.url):
+            urldir=self.urlDir(uri.url)
+            sha=self.lookup(uri.url,self.validator(uri))
+            if sha is None:
+                known=uri.lastmod is not None
+                #(conditionally) download the url and add the new version to the store
+                local,upd=uri.download(urldir,check=True,outfile=outfile,validators=self.validators,**kwargs)
+                if not os.path.exists(local.url):
+                    #failed download
+                    return local,False
+                #note: the download sets the modification time of the uri when it was unknown
+                validator=uri.lastmod.isoformat() if known else self.storedValidator(uri.url)
+                sha=self.add(uri.url,validator,local.url)
+                rel=os.path.relpath(local.url,urldir)
+            else:
+                slurplog.info("Found %s in the blob store"%(uri.url))
+                codecs={ky:kwargs[ky] for ky in ["gzip","gunzip","compress","decompress"] if ky in kwargs}
+                rel=os.path.relpath(uri.outputFile(urldir,outfile=outfile,**codecs),urldir)
+
+        dest=os.path.join(direc,rel)
+        os.makedirs(os.path.dirname(dest),exist_ok=True)
+        blob=self.blobPath(sha)
+        if not writable:
+            updated=linkFile(blob,dest)
+        elif os.path.exists(dest) and not os.path.samefile(blob,dest) and os.path.getmtime(dest) >= os.path.getmtime(blob):
+            #a private copy which is at least as new as the stored version (possibly modified in place)
+            updated=False
+        else:
+            updated=linkFile(blob,dest,hardlink=False)
+        return UriFile(dest),updated
+
+_blobstores={}
+
+def blobStore(root):
+    """Returns the (per process shared) blob store with a certain root directory"""
+    if root not in _blobstores:
+        _blobstores[root]=BlobStore(root)
+    return _blobstores[root]
@@ -16,11 +16,27 @@
 # Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2021
 import cdsapi
 from geoslurp.config.slurplogger import slurplogger
+from geoslurp.datapull.scheduler import hostScheduler
 import time
+import heapq
+import itertools
 from copy import copy
 import numpy as np
 import os
 from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+
+class CdsJob:
+    """Book keeping of a submitted CDS request which is polled with a growing interval
+    :param req: cdsapi request (result) object
+    :param fout: output file of the request
+    :param interval: initial poll interval in seconds"""
+    def __init__(self,req,fout,interval):
+        self.req=req
+        self.fout=fout
+        self.state=req.reply["state"]
+        self.interval=interval
+        self.nextpoll=time.monotonic()+interval
 class Cds:
     def __init__(self,resource,jobqueue={},auth=None):
         #start a client (which allows queing jobs in the bacjground)
@@ -35,14 +51,22 @@ class Cds:
 
         self.resource=resource
         self.jobqueue=jobqueue
+        #used to coordinate the connections with the host scheduler
+        self.url=getattr(self.client,"url","cds.climate.copernicus.eu")
 
         self.requests=[] 
 
     def queueRequest(self,fout,requestDict):
-        
+        req=self.submit(fout,requestDict)
+        if req is not None:
+            self.requests.append((req,fout,req.reply["state"]))
+
+    def submit(self,fout,requestDict):
+        """Submit a request (or pick up a previously submitted job of the same output file)
+        :returns: the cdsapi request or None when the output file already exists"""
         if os.path.exists(fout):
             slurplogger().info(f"Already downloaded file {fout}, skipping request")
-            return
+            return None
             
         req_id=None
         #possibly get the request id from a previously queued job
@@ -72,8 +96,7 @@ class Cds:
             req_id=req.reply["request_id"]
             #add an entry to the inventory
             self.jobqueue[fout]=req_id
-        
-        self.requests.append((req,fout,req.reply["state"]))
+        return req
     
     def loadRequests(self):
         """Load previous requests from job queue"""
@@ -136,14 +159,7 @@ class Cds:
 
                 elif state in ("failed",):
                     nFailed+=1
-                    slurplogger().error(f'Message: {reply["error"].get("message")}')
-                    slurplogger().error(f'Reason: {reply["error"].get("reason")}')
-                    for n in (
-                        reply.get("error", {}).get("context", {}).get("traceback", "").split("\n")
-                    ):
-                        if n.strip() == "":
-                            break
-                        slurplogger().error("  %s", n)
+                    self.logFailure(reply)
                     raise Exception(
                         f'reply["error"].get("message")  reply["error"].get("reason")'
                     )
@@ -152,3 +168,133 @@ class Cds:
                     self.requests[i]=(req,fout,state)
 
             slurplogger().info(f"Successful downloads: {nDownloaded}/{len(self.requests)}, failure: {nFailed}")
+
+    @staticmethod
+    def logFailure(reply):
+        slurplogger().error(f'Message: {reply["error"].get("message")}')
+        slurplogger().error(f'Reason: {reply["error"].get("reason")}')
+        for n in (
+            reply.get("error", {}).get("context", {}).get("traceback", "").split("\n")
+        ):
+            if n.strip() == "":
+                break
+            slurplogger().error("  %s", n)
+
+    def fetchResult(self,req,fout):
+        """Download the result of a completed request (through a temporary file so interrupted downloads are not mistaken for results)"""
+        slurplogger().info(f"Downloading CDS request for {fout}")
+        tmpf=fout+".part"
+        hostScheduler().run(self.url,req.download,tmpf)
+        os.replace(tmpf,fout)
+
+    def process(self,requests,maxreq=10,maxdownload=4,minpoll=5,maxpoll=300,onupdate=None):
+        """Submit requests and download their results while keeping at most maxreq jobs queued at the CDS
+        Every job is polled with its own interval, which grows while its state doesn't change.
+        Results are downloaded concurrently while other jobs are still running
+        :param requests: iterable of (outputfile,requestdict) in the order of submission
+        :param maxreq: maximum number of jobs which are queued or running at the CDS
+        :param maxdownload: maximum number of concurrent result downloads
+        :param minpoll: initial poll interval of a job in seconds
+        :param maxpoll: maximum poll interval of a job in seconds
+        :param onupdate: function which is called with the jobqueue after it changed (e.g. to store it in the inventory)
+        :returns: the number of downloaded and failed requests"""
+        pending=iter(requests)
+        exhausted=False
+        #polled jobs as (time of next poll,sequence,job)
+        polls=[]
+        seq=itertools.count()
+        downloads={}
+        nDownloaded=0
+        nFailed=0
+
+        def changed():
+            if onupdate is not None:
+                onupdate(self.jobqueue)
+
+        def forget(job):
+            if job.fout in self.jobqueue:
+                del self.jobqueue[job.fout]
+                changed()
+
+        with ThreadPoolExecutor(max_workers=maxdownload) as executor:
+            try:
+                while True:
+                    #top up the queue at the CDS
+                    nsubmitted=0
+                    while not exhausted and len(polls) < maxreq:
+                        item=next(pending,None)
+                        if item is None:
+                            exhausted=True
+                            break
+                        fout,reqdict=item
+                        req=self.submit(fout,reqdict)
+                        if req is None:
+                            continue
+                        job=CdsJob(req,fout,minpoll)
+                        heapq.heappush(polls,(job.nextpoll,next(seq),job))
+                        nsubmitted+=1
+                    if nsubmitted > 0:
+                        changed()
+
+                    if not polls and not downloads:
+                        #note: the top up only stops early when the requests are exhausted
+                        break
+
+                    #wait for the first poll or a finished download
+                    timeout=max(0,polls[0][0]-time.monotonic()) if polls else None
+                    if downloads:
+                        done,notdone=wait(downloads,timeout=timeout,return_when=FIRST_COMPLETED)
+                    else:
+                        time.sleep(timeout)
+                        done=[]
+
+                    for fut in done:
+                        job=downloads.pop(fut)
+                        try:
+                            fut.result()
+                            nDownloaded+=1
+                        except HTTPError:
+                            #resource may be gone in the meanwhile
+                            nFailed+=1
+                            slurplogger().error(f'Resource is not available anymore for {job.fout}')
+                        forget(job)
+
+                    #poll the jobs which are due
+                    while polls and polls[0][0] <= time.monotonic():
+                        t,n,job=heapq.heappop(polls)
+                        try:
+                            hostScheduler().run(self.url,job.req.update)
+                        except Exception as exc:
+                            slurplogger().warning(f"Polling CDS request for {job.fout} failed ({exc}), will try again")
+                            job.interval=min(maxpoll,2*job.interval)
+                            job.nextpoll=time.monotonic()+job.interval
+                            heapq.heappush(polls,(job.nextpoll,next(seq),job))
+                            continue
+                        reply=job.req.reply
+                        state=reply["state"]
+                        if state != job.state:
+                            slurplogger().info(f"Request ID: {reply['request_id']}, changed state from {job.state} to:{state}")
+                            job.state=state
+                            job.interval=minpoll
+                        else:
+                            #back off while nothing happens
+                            job.interval=min(maxpoll,1.5*job.interval)
+
+                        if state == "completed":
+                            #the job leaves the CDS queue, so another request can be submitted
+                            downloads[executor.submit(self.fetchResult,job.req,job.fout)]=job
+                        elif state == "failed":
+                            nFailed+=1
+                            self.logFailure(reply)
+                            forget(job)
+                        else:
+                            job.nextpoll=time.monotonic()+job.interval
+                            heapq.heappush(polls,(job.nextpoll,next(seq),job))
+
+                    slurplogger().info(f"CDS jobs: {len(polls)} queued, {len(downloads)} downloading, {nDownloaded} downloaded, {nFailed} failed")
+            finally:
+                #don't start downloads which are not running yet (the job ids are kept so they can be picked up again)
+                for fut in downloads:
+                    fut.cancel()
+
+        return nDownloaded,nFailed
@@ -17,11 +17,15 @@
 
 
 from abc import ABC, abstractmethod
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
 from copy import deepcopy
 import os
+from geoslurp.datapull.scheduler import hostScheduler
 class CrawlerBase(ABC):
     rooturl=None
+    downloadbackend="threads"
+    validators=None
+    cachelistings=True #use the persistent listing cache
     def __init__(self,url):
         self.rooturl=url
 
@@ -30,27 +34,63 @@ class CrawlerBase(ABC):
         """Generator which returns uri's to requested datasets"""
         pass
 
-    def parallelDownload(self,outdir,check=False,maxconn=8,gzip=False,continueonError=False):
+    def parallelDownload(self,outdir,check=False,maxconn=8,gzip=False,continueonError=False,backend=None,validators=None):
         """
         Download uris in parallel
         :param direc: directory to download to
         :param check: Only download when newer or non-existent (default to False)
         :param maxconn: amount of parallel downloads to execute
         :param continueOnError (bool): keep trying
+        :param backend: 'threads' (a curl handle per file in a thread pool) or 'curlmulti' (persistent connections in a single CurlMulti engine)
+        :param validators: ValidatorStore to download with conditional requests (defaults to the one of the crawler)
         """
         """Download/Update files in a given directory (returns a list of updated files)
         Note the download is executed in parallel"""
 
+        return [uri for uri,upd in self.streamDownload(outdir,check=check,maxconn=maxconn,gzip=gzip,continueonError=continueonError,backend=backend,validators=validators) if upd]
 
-        updated=[]
-        futures=[]
-        with ThreadPoolExecutor(max_workers=maxconn) as connectionPool:
-            for uri in self.uris():
-                # print("add ",uri.url)
-                futures.append(connectionPool.submit(deepcopy(uri).download,direc=outdir,check=check,gzip=gzip,continueonError=continueonError))
+    def streamDownload(self,outdir,check=False,maxconn=8,gzip=False,continueonError=False,backend=None,validators=None):
+        """Download uris in parallel while they are being crawled (generator)
+        At most 2*maxconn uris are taken from the crawler ahead of the consumer, so a slow consumer also slows down the crawling and downloading
+        :param outdir: directory to download to
+        (see parallelDownload for the other arguments)
+        :returns: yields tuples of (local UriFile, updated) in the order in which the downloads complete
+        """
+        if backend is None:
+            backend=self.downloadbackend
+
+        if validators is None:
+            validators=self.validators
 
-        for future in futures:
-            if future.result()[1]:
-                updated.append(future.result()[0])
+        if self.rooturl:
+            #the connections per host are capped by the host scheduler
+            hostScheduler().requestConcurrency(self.rooturl,maxconn)
 
-        return updated
+        if backend == "curlmulti":
+            from geoslurp.datapull.curlmulti import CurlMultiEngine
+            with CurlMultiEngine(maxconn=maxconn) as engine:
+                yield from engine.download(self.uris(),outdir,check=check,gzip=gzip,continueonError=continueonError,validators=validators)
+            return
+        elif backend != "threads":
+            raise RuntimeError(f"Unknown download backend {backend}")
+
+        uriiter=self.uris()
+        inflight=set()
+        with ThreadPoolExecutor(max_workers=maxconn) as connectionPool:
+            try:
+                while True:
+                    #top up the downloads in flight
+                    while len(inflight) < 2*maxconn:
+                        uri=next(uriiter,None)
+                        if uri is None:
+                            break
+                        inflight.add(connectionPool.submit(deepcopy(uri).download,direc=outdir,check=check,gzip=gzip,continueonError=continueonError,validators=validators))
+                    if not inflight:
+                        break
+                    done,inflight=wait(inflight,return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            finally:
+                #don't start the remaining downloads when the consumer stops early
+                for future in inflight:
+                    future.cancel()
@@ -0,0 +1,236 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+import pycurl
+import os
+import time
+import heapq
+import itertools
+from collections import deque
+from geoslurp.config.slurplogger import slurplog
+from geoslurp.datapull.uri import UriFile,curlSetup,openOutput,abortOutput,finishOutput
+from geoslurp.datapull.streamcodecs import resolveCodecs
+from geoslurp.datapull.scheduler import hostScheduler,CircuitOpen,retryCurlErrors,retryHTTPCodes
+
+class CurlMultiEngine:
+    """Download engine which runs many transfers concurrently in a single thread using pycurl.CurlMulti
+    Connections (and DNS lookups and TLS sessions) are kept alive and reused for subsequent transfers to the same host,
+    and HTTP/2 streams are multiplexed over a single connection when the server supports it
+    :param maxconn: maximum number of transfers in flight
+    :param maxperhost: maximum number of connections per host (defaults to maxconn)
+    :param http2: try to use HTTP/2 (falls back to HTTP/1.1)
+    Transfers respect the connection caps of the process wide host scheduler and transient failures are retried with backoff
+    """
+    def __init__(self,maxconn=8,maxperhost=None,http2=True):
+        self.maxconn=maxconn
+        self.maxperhost=maxperhost if maxperhost else maxconn
+        self.http2=http2
+        self.share=pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE,pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE,pycurl.LOCK_DATA_SSL_SESSION)
+        if hasattr(pycurl,"LOCK_DATA_CONNECT"):
+            #share the connection cache as well (libcurl >= 7.57)
+            self.share.setopt(pycurl.SH_SHARE,pycurl.LOCK_DATA_CONNECT)
+
+        self.multi=pycurl.CurlMulti()
+        self.multi.setopt(pycurl.M_MAX_TOTAL_CONNECTIONS,maxconn)
+        self.multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS,self.maxperhost)
+        if http2 and hasattr(pycurl,"PIPE_MULTIPLEX"):
+            self.multi.setopt(pycurl.M_PIPELINING,pycurl.PIPE_MULTIPLEX)
+        #easy handles which can be reused
+        self.idle=[]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_val,exc_tb):
+        self.close()
+
+    def close(self):
+        for crl in self.idle:
+            crl.close()
+        self.idle=[]
+        self.multi.close()
+        self.share.close()
+
+    def handle(self):
+        """Returns a fresh or reused easy handle attached to the shared caches"""
+        if self.idle:
+            crl=self.idle.pop()
+            #note: a reset keeps the connections alive
+            crl.reset()
+        else:
+            crl=pycurl.Curl()
+        crl.setopt(pycurl.SHARE,self.share)
+        if self.http2 and hasattr(pycurl,"CURL_HTTP_VERSION_2TLS"):
+            crl.setopt(pycurl.HTTP_VERSION,pycurl.CURL_HTTP_VERSION_2TLS)
+            #rather wait for a connection which can be multiplexed than open a new one
+            crl.setopt(pycurl.PIPEWAIT,1)
+        return crl
+
+    def download(self,uris,direc,check=False,gzip=False,gunzip=False,outfile=None,continueonError=False,restdict=None,compress=None,decompress=None,validators=None):
+        """Download uris into a directory (generator)
+        :param uris: iterable with uris (consumed lazily so at most maxconn transfers are in flight)
+        :param direc: directory to download to
+        :param check: only download when newer or non-existent
+        :param gzip/gunzip/compress/decompress: (de)compress the data on the fly (see UriBase.download)
+        :param outfile: explicit output file name (only sensible for a single uri)
+        :param continueonError (bool): don't raise an exception when a download fails
+        :param validators: ValidatorStore to make the transfers conditional requests (unchanged files are not transferred)
+        :returns: yields tuples of (local UriFile, updated) in the order in which the transfers complete
+        """
+        compress,decompress=resolveCodecs(gzip,gunzip,compress,decompress)
+        sched=hostScheduler()
+        pending=iter(uris)
+        exhausted=False
+        #uris waiting for a free connection slot of their host
+        deferred=deque()
+        #failed transfers waiting to be retried as (time,sequence,attempt,uri)
+        retrylist=[]
+        seq=itertools.count()
+        inflight={}
+        def nextUri():
+            if retrylist and retrylist[0][0] <= time.monotonic():
+                t,n,attempt,uri=heapq.heappop(retrylist)
+                return uri,attempt
+            if deferred:
+                return deferred.popleft(),0
+            return next(pending,None),0
+
+        try:
+            while True:
+                #top up the transfers in flight
+                while len(inflight) < self.maxconn:
+                    if exhausted and not deferred and not (retrylist and retrylist[0][0] <= time.monotonic()):
+                        break
+                    uri,attempt=nextUri()
+                    if uri is None:
+                        exhausted=True
+                        continue
+                    outf=uri.outputFile(direc,compress=compress,decompress=decompress,outfile=outfile)
+                    uriout=UriFile(url=outf)
+                    if attempt == 0 and check and uri.isCurrent(uriout):
+                        slurplog.info("Already Downloaded, skipping %s"%(uriout.url))
+                        yield uriout,False
+                        continue
+                    try:
+                        sched.requestConcurrency(uri.url,self.maxperhost)
+                        #only wait for a slot of the host when nothing else is in flight
+                        slot=sched.acquire(uri.url,blocking=not inflight)
+                    except CircuitOpen:
+                        slurplog.info("Download failed, skipping %s"%(uriout.url))
+                        if not continueonError:
+                            raise
+                        yield uriout,False
+                        continue
+                    if slot is None:
+                        if attempt == 0:
+                            deferred.appendleft(uri)
+                        else:
+                            heapq.heappush(retrylist,(0,next(seq),attempt,uri))
+                        break
+                    slurplog.info("Downloading %s"%(uriout.url))
+                    fid,tmpfile=openOutput(outf,compress=compress,decompress=decompress)
+                    crl=self.handle()
+                    collector=curlSetup(crl,uri.url,fid,auth=uri.auth,restdict=restdict,headers=uri.headers,cookiefile=uri.cookiefile,checkssl=uri.checkssl,validators=validators,conditional=os.path.exists(outf))
+                    inflight[crl]=(uri,uriout,fid,tmpfile,collector,slot,attempt)
+                    self.multi.add_handle(crl)
+
+                if not inflight:
+                    if exhausted and not deferred and not retrylist:
+                        break
+                    if retrylist:
+                        #wait for the first retry
+                        time.sleep(max(0,retrylist[0][0]-time.monotonic()))
+                    continue
+
+                for crl,errno,errmsg in self.perform():
+                    uri,uriout,fid,tmpfile,collector,slot,attempt=inflight.pop(crl)
+                    self.multi.remove_handle(crl)
+                    sched.release(slot)
+                    if errmsg is None and crl.getinfo(pycurl.RESPONSE_CODE) in retryHTTPCodes:
+                        errmsg=f"HTTP status {crl.getinfo(pycurl.RESPONSE_CODE)}"
+                        transient=True
+                    else:
+                        transient=errno in retryCurlErrors
+                    if errmsg is None and validators is not None and os.path.exists(uriout.url) and validators.notModified(crl):
+                        sched.success(uri.url)
+                        abortOutput(fid,tmpfile)
+                        self.idle.append(crl)
+                        slurplog.info("Not modified, skipping %s"%(uriout.url))
+                        yield uriout,False
+                        continue
+                    if errmsg is None:
+                        try:
+                            modtime=finishOutput(crl,uriout.url,fid,tmpfile,mtime=uri.lastmod)
+                        except RuntimeError as exc:
+                            #e.g. a truncated compressed stream
+                            errmsg=str(exc)
+                            transient=True
+                    if errmsg is None:
+                        sched.success(uri.url)
+                        if validators is not None:
+                            validators.record(uri.url,crl,collector)
+                        if not uri.lastmod:
+                            uri.lastmod=modtime
+                        uriout.lastmod=uri.lastmod
+                        self.idle.append(crl)
+                        yield uriout,True
+                        continue
+
+                    abortOutput(fid,tmpfile)
+                    self.idle.append(crl)
+                    if transient:
+                        sched.failure(uri.url)
+                        if attempt < sched.policy(uri.url).retries:
+                            dt=sched.retryDelay(uri.url,attempt)
+                            slurplog.info("Download of %s failed (%s), retry %d in %.1f seconds"%(uriout.url,errmsg,attempt+1,dt))
+                            heapq.heappush(retrylist,(time.monotonic()+dt,next(seq),attempt+1,uri))
+                            continue
+                    else:
+                        sched.success(uri.url)
+                    slurplog.info("Download failed, skipping %s"%(uriout.url))
+                    if not continueonError:
+                        raise pycurl.error(errmsg)
+                    yield uriout,False
+        finally:
+            #clean up transfers which are still in flight (e.g. after an error or when the generator is closed early)
+            for crl,(uri,uriout,fid,tmpfile,collector,slot,attempt) in inflight.items():
+                self.multi.remove_handle(crl)
+                sched.release(slot)
+                abortOutput(fid,tmpfile)
+                crl.close()
+
+    def perform(self):
+        """Drives the transfers until at least one completes
+        :returns: list of (handle,errorcode,errormessage) of the completed transfers, errorcode and errormessage are None on success"""
+        while True:
+            while True:
+                ret,nhandles=self.multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            done=[]
+            while True:
+                nqueued,succeeded,failed=self.multi.info_read()
+                done.extend((crl,None,None) for crl in succeeded)
+                done.extend((crl,errno,f"{errno}: {errmsg}") for crl,errno,errmsg in failed)
+                if nqueued == 0:
+                    break
+            if done:
+                return done
+            #wait for activity on the sockets
+            self.multi.select(1.0)
@@ -17,8 +17,17 @@
 import re
 from datetime import datetime
 import os
+import posixpath
+import ftplib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
+from geoslurp.config.slurplogger import slurplog
 from geoslurp.datapull import UriBase
 from geoslurp.datapull import CrawlerBase
+from geoslurp.datapull.listingcache import listingCache
+from geoslurp.datapull.scheduler import hostScheduler
 
 class Uri(UriBase):
     def __init__(self,url,lastmod=None,subdirs='',auth=None):
@@ -26,65 +35,252 @@ class Uri(UriBase):
         if not bool(re.match('^ftps?://',url)):
             raise Exception("URL does not seem to be a valid ftp(s) address")
 
+regexdate=re.compile('((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +[0-9]{1,2} +[0-9]{4})')
+regexthisyear=re.compile('((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +[0-9]{1,2} +[0-9]{2}:[0-9]{2})')
+regexdir=re.compile('^d[\-r][\-w][\-x]')
+
+def parseListLine(ln):
+    """Parses a line of (unix style) LIST output
+    :returns: name, modification time (or None) and whether the entry is a directory"""
+    t=None
+    #try to parse the date from the buffer line
+    match=regexdate.search(ln)
+    if match:
+        t=datetime.strptime(match.group(1),'%b %d %Y')
+    else:
+        #try to see if the date contains HH:MM (this year)
+        match=regexthisyear.search(ln)
+        if match:
+            t=datetime.strptime(match.group(1),'%b %d %H:%M')
+            if t.month <= datetime.now().month:
+                t=t.replace(year=datetime.now().year)
+            else:
+                #last year
+                t=t.replace(year=datetime.now().year-1)
+    name=ln.split()[-1]
+    return name,t,bool(regexdir.match(ln))
+
+class FtpSessionPool:
+    """Pool of logged in ftp control connections to a single host
+    Listings use MLSD when the server supports it and fall back to LIST (with MDTM for missing dates) otherwise
+    :param url: ftp(s) url of the server
+    :param auth: credentials (anonymous login when None)
+    :param nsessions: maximum number of concurrent sessions"""
+    def __init__(self,url,auth=None,nsessions=1,timeout=60):
+        parsed=urlparse(url)
+        self.url=url
+        self.host=parsed.hostname
+        self.port=parsed.port if parsed.port else 21
+        self.tls=parsed.scheme == "ftps" or bool(getattr(auth,"ftptls",False))
+        self.auth=auth
+        self.timeout=timeout
+        self.nsessions=nsessions
+        self.slots=threading.Semaphore(nsessions)
+        self.lock=threading.Lock()
+        self.idle=[]
+        #whether the server supports MLSD (None: unknown yet)
+        self.mlsdsupport=None
+
+    def connect(self):
+        if self.tls:
+            ftp=ftplib.FTP_TLS(timeout=self.timeout)
+        else:
+            ftp=ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host,self.port)
+        if self.auth and getattr(self.auth,"user",None):
+            ftp.login(self.auth.user,self.auth.passw)
+        else:
+            ftp.login()
+        if self.tls:
+            #also encrypt the data connections
+            ftp.prot_p()
+        return ftp
+
+    @contextmanager
+    def session(self):
+        """Check out a (reused) control connection"""
+        with self.slots:
+            with self.lock:
+                ftp=self.idle.pop() if self.idle else None
+            if ftp is None:
+                ftp=self.connect()
+            try:
+                yield ftp
+            except ftplib.error_perm:
+                #the connection itself is still fine
+                with self.lock:
+                    self.idle.append(ftp)
+                raise
+            except:
+                #drop the (possibly broken) connection
+                try:
+                    ftp.close()
+                except Exception:
+                    pass
+                raise
+            else:
+                with self.lock:
+                    self.idle.append(ftp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_val,exc_tb):
+        self.close()
+
+    def close(self):
+        """Log out the idle sessions (new sessions are opened when needed)"""
+        with self.lock:
+            for ftp in self.idle:
+                try:
+                    ftp.quit()
+                except Exception:
+                    ftp.close()
+            self.idle=[]
+
+    def listdir(self,path):
+        """Returns a list of (name,modification time,isdir) of the entries in a directory"""
+        #transient failures (e.g. dropped connections) are retried on a new connection
+        return hostScheduler().run(self.url,self.listdirOnce,path)
+
+    def listdirOnce(self,path):
+        with self.session() as ftp:
+            if self.mlsdsupport is not False:
+                try:
+                    listing=self.mlsd(ftp,path)
+                    self.mlsdsupport=True
+                    return listing
+                except ftplib.error_perm as exc:
+                    #only an unknown (500) or unimplemented (502) command means that MLSD is not supported (e.g. not a missing directory)
+                    if self.mlsdsupport is not None or str(exc)[:3] not in ("500","502"):
+                        raise
+                    slurplog.info("ftp server %s does not support MLSD, falling back to LIST"%(self.host))
+                    self.mlsdsupport=False
+            return self.list(ftp,path)
+
+    @staticmethod
+    def mlsd(ftp,path):
+        listing=[]
+        for name,facts in ftp.mlsd(path,facts=["type","modify"]):
+            typ=facts.get("type","file").lower()
+            if typ in ["cdir","pdir"]:
+                continue
+            t=datetime.strptime(facts["modify"][:14],"%Y%m%d%H%M%S") if "modify" in facts else None
+            listing.append((name,t,typ == "dir"))
+        return listing
+
+    @staticmethod
+    def list(ftp,path):
+        lines=[]
+        ftp.retrlines("LIST "+path,lines.append)
+        listing=[]
+        for ln in lines:
+            if not ln.strip() or ln.startswith("total"):
+                continue
+            name,t,isdir=parseListLine(ln)
+            if t is None and not isdir:
+                #ask for the modification time over the same control connection
+                try:
+                    resp=ftp.sendcmd("MDTM "+posixpath.join(path,name))
+                    t=datetime.strptime(resp.split()[1][:14],"%Y%m%d%H%M%S")
+                except (ftplib.error_perm,ValueError,IndexError):
+                    pass
+            listing.append((name,t,isdir))
+        return listing
+
 class Crawler(CrawlerBase):
-    """Crawler for ftp directories"""
-    def __init__(self,url,pattern='.*',followpattern='.*',auth=None):
+    """Crawler for ftp directories
+    :param nsessions: amount of ftp sessions which are used to walk the directory tree concurrently"""
+    def __init__(self,url,pattern='.*',followpattern='.*',auth=None,validators=None,nsessions=1):
         if url[-1] != '/':
             url+='/'
         super().__init__(url)
         self.pattern=pattern
         self.followpattern=followpattern
         self.auth=auth
+        #when downloading with a validator store, unknown modification times are resolved by the conditional download itself
+        self.validators=validators
+        #persistent control connections (opened when needed)
+        self.pool=FtpSessionPool(url,auth,nsessions)
 
-    def ls(self,subdirs=''):
-        """List directories and files (generator)"""
-        regexdate=re.compile(b'((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +[0-9]{1,2} +[0-9]{4})')
+    def ls(self,subdirs='',dirmtime=None):
+        """List directories and files (generator)
+        :param dirmtime: modification time of the directory (a cached listing is reused when it is unchanged)"""
+        listing,live=self.listing(subdirs,dirmtime)
+        yield from listing
 
-        regexthisyear=re.compile(b'((Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) +[0-9]{1,2} +[0-9]{2}:[0-9]{2})')
-        regexdir=re.compile(b'^d[\-r][\-w][\-x]')
+    def listing(self,subdirs='',dirmtime=None):
+        """Returns the (name,modification time) entries of a directory and whether they were listed by the server
+        :param dirmtime: modification time of the directory from a live listing of its parent (a cached listing is reused when it is unchanged)
+        Note: the modification times of a cached listing don't reflect changes deeper in the tree, so they should not be used as dirmtime of the subdirectories"""
         url=os.path.join(self.rooturl,subdirs)
         if url[-1] != '/':
             url+='/'
+        if not self.cachelistings:
+            return list(self.lsremote(url)),True
+        cached=listingCache().getJson("ftp",url,dirmtime=dirmtime)
+        if cached is not None:
+            return [(name,datetime.fromisoformat(t) if t else None) for name,t in cached],False
+        listing=list(self.lsremote(url))
+        listingCache().putJson("ftp",url,[(name,t.isoformat() if t else None) for name,t in listing],dirmtime=dirmtime)
+        return listing,True
 
-        buf=Uri(url,auth=self.auth).buffer()
-
-        #import pdb;pdb.set_trace() 
-        for ln in buf.getvalue().splitlines():
-            t=None
-            #try to parse the date from the buffer line
-            match=regexdate.search(ln)
-            if match:
-                t=datetime.strptime(match.group(1).decode('utf-8'),'%b %d %Y')
-            else:
-                #try to see if the date contains HH:MM (this year)
-                match=regexthisyear.search(ln)
-                if match:
-                    t=datetime.strptime(match.group(1).decode('utf-8'),'%b %d %H:%M')
-                    if t.month <= datetime.now().month:
-                        t=t.replace(year=datetime.now().year)
-                    else:
-                        #last year
-                        t=t.replace(year=datetime.now().year-1)
-            name=ln.decode('utf-8').split()[-1]
-            if regexdir.match(ln):
+    def lsremote(self,url):
+        """List directories and files from the server (directories get a trailing /)"""
+        for name,t,isdir in self.pool.listdir(urlparse(url).path):
+            if isdir:
                 #append /
                 name+='/'
-
             yield name,t
 
-    def uris(self, check=False,subdirs=''):
+    def uri(self,subdirs,name,t):
+        uri=Uri(os.path.join(self.rooturl,subdirs,name),lastmod=t,subdirs=subdirs,auth=self.auth)
+        if uri.lastmod == None and self.validators is None:
+            #one can try to get this information through the header informatio too (slower and not always working)
+            uri.updateModTime()
+        return uri
+
+    def uris(self, check=False,subdirs='',dirmtime=None):
         """Generate a list files in a directory and return a list of uri"""
-        for name,t in self.ls(subdirs):
+        if subdirs:
+            yield from self.urisSerial(check,subdirs,dirmtime)
+            return
+        #log out of the ftp sessions when the walk is finished
+        with self.pool:
+            if self.pool.nsessions > 1:
+                yield from self.urisConcurrent()
+            else:
+                yield from self.urisSerial(check)
+
+    def urisSerial(self,check=False,subdirs='',dirmtime=None):
+        listing,live=self.listing(subdirs,dirmtime)
+        for name,t in listing:
             #only apply the pattern to the last column
             if re.search(self.pattern,name):
-                uri=Uri(os.path.join(self.rooturl,subdirs,name),lastmod=t,subdirs=subdirs,auth=self.auth)
-
-                if uri.lastmod == None:
-                    #one can try to get this information through the header informatio too (slower and not always working)
-                    uri.updateModTime()
-                yield uri
+                yield self.uri(subdirs,name,t)
              #check whether we need to enter this subdirectory
             if name[-1] == '/' and re.search(self.followpattern,name):
 
                 #also recursively enter this subdirectory if requested
-                yield from self.uris(check,os.path.join(subdirs,name))
+                yield from self.urisSerial(check,os.path.join(subdirs,name),t if live else None)
+
+    def urisConcurrent(self):
+        """Walk the directory tree with concurrent ftp sessions (uris are returned in the order in which directories are listed)"""
+        def lsdir(subdirs,t):
+            #note: missing modification times are also resolved in the worker threads
+            listing,live=self.listing(subdirs,t)
+            return [(name,t,self.uri(subdirs,name,t) if re.search(self.pattern,name) else None) for name,t in listing],live
+
+        with ThreadPoolExecutor(max_workers=self.pool.nsessions) as executor:
+            pending={executor.submit(lsdir,'',None):''}
+            while pending:
+                done,notdone=wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    subdirs=pending.pop(future)
+                    entries,live=future.result()
+                    for name,t,uri in entries:
+                        if uri is not None:
+                            yield uri
+                        if name[-1] == '/' and re.search(self.followpattern,name):
+                            subdir=os.path.join(subdirs,name)
+                            pending[executor.submit(lsdir,subdir,t if live else None)]=subdir
@@ -19,6 +19,9 @@ import os
 import json
 from geoslurp.datapull import CrawlerBase
 from geoslurp.datapull.http import Uri as http
+from geoslurp.datapull.uri import curlDownload
+from io import BytesIO
+from geoslurp.datapull.listingcache import listingCache
 import yaml
 from geoslurp.config.slurplogger import  slurplogger
 
@@ -29,6 +32,9 @@ class GithubFilter():
         for ky,regex in regexdict.items():
             self.regexes[ky]=re.compile(regex)
 
+    def patterns(self):
+        return {ky:regex.pattern for ky,regex in self.regexes.items()}
+
     def isValid(self,elem):
         """Returns True if all of the regex criteria match the elem"""
         valid=True
@@ -40,26 +46,89 @@ class GithubFilter():
 
 
 class Crawler(CrawlerBase):
-    """Crawls a github repository fixed to a certain commit"""
-    def __init__(self, reponame,commitsha=None,filter=GithubFilter(),followfilt=GithubFilter({"type":"tree"}),oauthtoken=None):
+    """Crawls a github repository fixed to a certain commit
+    :param commitsha: commit to crawl, when not provided the commit of ref is looked up
+    :param ref: branch or tag which is resolved to a commit when no commitsha is given (defaults to the default branch of the repository)"""
+    apiurl="https://api.github.com/repos/"
+    refttl=3600 #time in seconds a resolved branch/tag is reused
+    treettl=10*365*24*3600 #the tree of a commit does not change
+    def __init__(self, reponame,commitsha=None,filter=GithubFilter(),followfilt=GithubFilter({"type":"tree"}),oauthtoken=None,ref=None):
+        self.repo=reponame
+        self.token=oauthtoken
+        self.ref=ref
+        self.commitsha=commitsha
         #construct the catalog url
         if commitsha:
-            catalogurl="https://api.github.com/repos/"+reponame+"/git/trees/"+commitsha
+            catalogurl=self.apiurl+reponame+"/git/trees/"+commitsha
         else:
-            catalogurl="https://api.github.com/repos/"+reponame+"/git/trees"
+            catalogurl=None
         super().__init__(catalogurl)
         self.filter=filter
         self.followFilter=followfilt
-        self.repo=reponame
-        self.token=oauthtoken
 
-    def getSubTree(self,url):
+    def headers(self,extra=None):
+        headers=list(extra or [])
         if self.token:
             #add the api token to the header
-            headers=[f"Authorization: token {self.token}"]
-        else:
-            headers=None
-        return json.loads(http(url,headers=headers).buffer().getvalue())
+            headers.append(f"Authorization: token {self.token}")
+        return headers if headers else None
+
+    def request(self,kind,url,headers=None,ttl=None):
+        """Retrieves the body of a github api request (through the listing cache when enabled)"""
+        if self.cachelistings:
+            return listingCache().fetch(kind,url,headers=headers,ttl=ttl)
+        buf=BytesIO()
+        curlDownload(url,buf,headers=headers)
+        return buf.getvalue()
+
+    def apiError(self,kind,url,body):
+        """Raises an error for a failed api request (a cached error document is discarded)"""
+        if self.cachelistings:
+            listingCache().discard(kind,url)
+        try:
+            msg=json.loads(body)["message"]
+        except (ValueError,KeyError,TypeError):
+            msg=body[:200]
+        raise RuntimeError(f"Github api request {url} failed: {msg}")
+
+    def getJson(self,url,ttl=None,kind="github"):
+        body=self.request(kind,url,headers=self.headers(),ttl=ttl)
+        try:
+            doc=json.loads(body)
+        except ValueError:
+            self.apiError(kind,url,body)
+        if isinstance(doc,dict) and "message" in doc and "documentation_url" in doc:
+            #github returns an error document (e.g. not found or rate limited)
+            self.apiError(kind,url,body)
+        return doc
+
+    def defaultBranch(self):
+        """Returns the default branch of the repository"""
+        url=self.apiurl+self.repo
+        repoinfo=self.getJson(url,ttl=self.refttl,kind="github-ref")
+        if "default_branch" not in repoinfo:
+            self.apiError("github-ref",url,json.dumps(repoinfo))
+        return repoinfo["default_branch"]
+
+    def commitSha(self):
+        """Returns the commit sha of the crawler (resolving the branch or tag with a small request when needed)"""
+        if self.commitsha is None:
+            if self.ref is None:
+                self.ref=self.defaultBranch()
+            url=self.apiurl+self.repo+"/commits/"+self.ref
+            #the sha media type returns the bare commit sha
+            body=self.request("github-ref",url,headers=self.headers(["Accept: application/vnd.github.sha"]),ttl=self.refttl)
+            sha=body.decode('utf-8').strip()
+            if not re.fullmatch("[0-9a-f]{40}|[0-9a-f]{64}",sha):
+                #an error document instead of a sha
+                self.apiError("github-ref",url,body)
+            self.commitsha=sha
+            self.rooturl=self.apiurl+self.repo+"/git/trees/"+self.commitsha
+        return self.commitsha
+
+    def getSubTree(self,url):
+        #trees are addressed by their sha, so they can be cached (practically) forever
+        return self.getJson(url,ttl=self.treettl)
 
     def uris(self,depth=10):
         """Construct Uris from tree nodes"""
@@ -69,10 +138,43 @@ class Crawler(CrawlerBase):
         # for elem in self.treeitems(depth=depth):
         #     print(os.path.join(elem["dirpath"],elem['path']),elem['url'])
 
+    def treeitems(self,depth=10):
+        """generator which lists all elements in a git tree (with a single recursive tree request)"""
+        self.commitSha()
+        tree=self.getSubTree(self.rooturl+"?recursive=1")
+        if tree.get("truncated",False):
+            #too large for a single listing: walk through the subtrees
+            slurplogger().info("Recursive github tree listing is truncated, listing subtrees instead")
+            yield from self.walkTree(depth=depth)
+            return
+
+        #index the directories so the follow filter can be applied to the parents of an element
+        dirs={elem["path"]:elem for elem in tree["tree"] if elem["type"] == "tree"}
+        def followed(path):
+            #check whether all parent directories would have been entered
+            parts=path.split("/")
+            for i in range(1,len(parts)):
+                parent=dict(dirs.get("/".join(parts[:i]),{"type":"tree"}),path=parts[i-1])
+                if not self.followFilter.isValid(parent):
+                    return False
+            return True
+
+        for elem in tree["tree"]:
+            parts=elem["path"].split("/")
+            if len(parts) > depth:
+                continue
+            treelem=dict(elem,path=parts[-1])
+            if self.filter.isValid(treelem) and followed(elem["path"]):
+                yield self.rawItem(treelem,os.path.join(self.repo,*parts[:-1]))
 
+    def rawItem(self,treelem,dirpath):
+        treelem["dirpath"]=dirpath
+        #modify url to link to a arw github file
+        treelem['url']="https://github.com/"+self.repo+"/raw/"+(self.ref if self.ref else "master")+treelem['dirpath'].replace(self.repo,"")+"/"+treelem["path"]
+        return treelem
 
-    def treeitems(self,rootelem=None,depth=10,dirpath=None):
-        """ generator which recursively list all elements in a git tree"""
+    def walkTree(self,rootelem=None,depth=10,dirpath=None):
+        """ generator which recursively list all elements in a git tree (one request per subtree)"""
 
 
         if depth == 0:
@@ -90,35 +192,34 @@ class Crawler(CrawlerBase):
         for treelem in rootelem['tree']:
 
             if self.filter.isValid(treelem):
-                treelem["dirpath"]=dirpath
-                #modify url to link to a arw github file
-
-                treelem['url']="https://github.com/"+self.repo+"/raw/master"+treelem['dirpath'].replace(self.repo,"")+"/"+treelem["path"]
-                yield treelem
+                yield self.rawItem(treelem,dirpath)
                 continue
 
             if self.followFilter.isValid(treelem):
                 #recurse through subtree
                 subtree=self.getSubTree(treelem["url"])
-                yield from self.treeitems(subtree,depth,os.path.join(dirpath,treelem["path"]))
+                yield from self.walkTree(subtree,depth,os.path.join(dirpath,treelem["path"]))
 
-def cachedGithubCatalogue(reponame,cachedir=".",commitsha=None,gfilter=GithubFilter(),gfollowfilter=GithubFilter({"type":"tree"}),depth=2,ghtoken=None):
-    """Caches the result of a github result for later reuse"""
+def cachedGithubCatalogue(reponame,cachedir=".",commitsha=None,gfilter=GithubFilter(),gfollowfilter=GithubFilter({"type":"tree"}),depth=2,ghtoken=None,ref=None):
+    """Caches the result of a github result for later reuse
+    The cached catalogue is reused as long as the commit (and the crawl settings) are unchanged"""
 
     cachedCatalog=os.path.join(cachedir,reponame.replace("/","_")+".yaml")
+    crwl=Crawler(reponame,commitsha=commitsha,
+                   filter=gfilter,
+                   followfilt=gfollowfilter,
+                   oauthtoken=ghtoken,ref=ref)
+    #note: this only requires a (cached) request when no commitsha is given
+    commitsha=crwl.commitSha()
+    query={"filter":gfilter.patterns(),"followfilter":gfollowfilter.patterns(),"depth":depth}
+
     catalog={}
     if os.path.exists(cachedCatalog):
-        #check whether the commit sha agrees when explicitly specified
-        if commitsha:
-            #read catalog from yaml file
-            with open(cachedCatalog, 'r') as fid:
-                catalog=yaml.safe_load(fid)
-            # import pdb;pdb.set_trace() 
-            if catalog["commitsha"] != commitsha:
-                #trigger a new download
-                catalog={}
-        else:
-            #always download a newer version
+        #read catalog from yaml file
+        with open(cachedCatalog, 'r') as fid:
+            catalog=yaml.safe_load(fid)
+        if catalog.get("commitsha") != commitsha or catalog.get("query",query) != query:
+            #trigger a new download
             catalog={}
 
     if catalog:
@@ -126,14 +227,8 @@ def cachedGithubCatalogue(reponame,cachedir=".",commitsha=None,gfilter=GithubFil
     else:
         slurplogger().info("downloading github catalogue to cache %s"%(cachedCatalog))
         #retrieve from github and store for later use
-        crwl=Crawler(reponame,commitsha=commitsha,
-                       filter=gfilter,
-                       followfilt=gfollowfilter,
-                       oauthtoken=ghtoken)
-
         catalog={"Description":"Cached github crawler results","rooturl":crwl.rooturl
-                ,"commitsha":commitsha,"datasets":[]}
-        # import pdb;pdb.set_trace()
+                ,"commitsha":commitsha,"query":query,"datasets":[]}
         for item in crwl.treeitems(depth=depth):
             catalog["datasets"].append({"path":os.path.join(item["dirpath"],item["path"]),"url":item["url"]})
         
@@ -142,4 +237,3 @@ def cachedGithubCatalogue(reponame,cachedir=".",commitsha=None,gfilter=GithubFil
             yaml.dump(catalog,fid,default_flow_style=False)
     
     return catalog
-
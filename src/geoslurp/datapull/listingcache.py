@@ -0,0 +1,149 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#Persistent cache of remote directory listings and catalogs which is shared by the crawlers
+
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from io import BytesIO
+from geoslurp.config.slurplogger import slurplog
+from geoslurp.datapull.uri import curlDownload
+from geoslurp.datapull.validators import ValidatorStore,NotModified
+
+class TeeWriter:
+    """Writes downloaded bytes to a buffer and passes them on to a sink (e.g. an incremental parser)"""
+    def __init__(self,buf,sink):
+        self.buf=buf
+        self.sink=sink
+
+    def write(self,data):
+        self.buf.write(data)
+        self.sink.write(data)
+
+class ListingCache:
+    """Sqlite cache of listings keyed by the type of crawler and the url
+    :param path: sqlite file to store the listings in
+    :param ttl: time in seconds after which a listing needs to be refetched or revalidated
+    :param maxage: maximum age in seconds of a listing which is reused because the modification time of its directory is unchanged (defaults to the ttl)
+    Note: reusing listings based on directory modification times assumes that files are replaced by renaming (as mirroring tools do)"""
+    def __init__(self,path,ttl=12*3600,maxage=None):
+        self.path=path
+        self.ttl=ttl
+        self.maxage=maxage
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+        self.db=sqlite3.connect(path,check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS listings (kind TEXT, url TEXT, fetched REAL, dirmtime TEXT, listing BLOB, PRIMARY KEY (kind,url))")
+        self.db.commit()
+        self.lock=threading.Lock()
+        #validators (ETag/Last-Modified) of http listings
+        self.validators=ValidatorStore(path)
+
+    def lookup(self,kind,url):
+        """Returns the stored listing (bytes), the time it was fetched and the directory modification time (or None)"""
+        with self.lock:
+            return self.db.execute("SELECT listing,fetched,dirmtime FROM listings WHERE kind=? AND url=?",(kind,url)).fetchone()
+
+    def get(self,kind,url,dirmtime=None,ttl=None):
+        """Returns a valid listing from the cache or None
+        When a directory modification time is given, a listing is valid when it equals the stored one (and the listing is younger than maxage),
+        otherwise a listing is valid when it is younger than the ttl
+        Note: the modification time of a directory only changes with its direct entries, so it must be obtained from the server (not from a cached listing of the parent)"""
+        entry=self.lookup(kind,url)
+        if entry is None:
+            return None
+        listing,fetched,storedmtime=entry
+        age=time.time()-fetched
+        if ttl is None:
+            ttl=self.ttl
+        if dirmtime is not None:
+            if str(dirmtime) == storedmtime and age < (ttl if self.maxage is None else self.maxage):
+                #unchanged directory
+                return listing
+            #the directory changed (or its listing is too old)
+            return None
+        if age < ttl:
+            return listing
+        return None
+
+    def put(self,kind,url,listing,dirmtime=None):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO listings (kind,url,fetched,dirmtime,listing) VALUES (?,?,?,?,?)",(kind,url,time.time(),None if dirmtime is None else str(dirmtime),listing))
+            self.db.commit()
+
+    def touch(self,kind,url):
+        """Marks a listing as freshly validated"""
+        with self.lock:
+            self.db.execute("UPDATE listings SET fetched=? WHERE kind=? AND url=?",(time.time(),kind,url))
+            self.db.commit()
+
+    def discard(self,kind,url):
+        """Removes a listing (e.g. an error document) from the cache"""
+        with self.lock:
+            self.db.execute("DELETE FROM listings WHERE kind=? AND url=?",(kind,url))
+            self.db.commit()
+
+    def getJson(self,kind,url,dirmtime=None,ttl=None):
+        listing=self.get(kind,url,dirmtime,ttl)
+        if listing is None:
+            return None
+        return json.loads(listing)
+
+    def putJson(self,kind,url,listing,dirmtime=None):
+        self.put(kind,url,json.dumps(listing,default=str).encode('utf-8'),dirmtime)
+
+    def fetch(self,kind,url,auth=None,headers=None,customRequest=None,upfid=None,sink=None,ttl=None):
+        """Retrieve a (http) listing document through the cache
+        Expired listings are revalidated with a conditional request
+        :param sink: optional file-like object which receives the bytes (while they are downloaded)
+        :returns: the listing document as bytes"""
+        listing=self.get(kind,url,ttl=ttl)
+        if listing is None:
+            entry=self.lookup(kind,url)
+            buf=BytesIO()
+            writer=buf if sink is None else TeeWriter(buf,sink)
+            try:
+                curlDownload(url,writer,auth=auth,headers=headers,customRequest=customRequest,upfid=upfid,validators=self.validators,conditional=entry is not None)
+                listing=buf.getvalue()
+                self.put(kind,url,listing)
+                return listing
+            except NotModified:
+                slurplog.info("Listing %s unchanged"%(url))
+                self.touch(kind,url)
+                listing=entry[0]
+        if sink is not None:
+            sink.write(listing)
+        return listing
+
+_listingcache=None
+
+def listingCache(path=None,ttl=None):
+    """Returns the process wide listing cache (the default is stored in the temporary directory)
+    :param path: (re)configure the cache to use this sqlite file
+    :param ttl: (re)configure the time to live of the listings"""
+    global _listingcache
+    if path is None and _listingcache is None:
+        path=os.path.join(tempfile.gettempdir(),"geoslurp_cache",".listings.sqlite")
+    if path is not None and (_listingcache is None or _listingcache.path != path):
+        _listingcache=ListingCache(path)
+    if ttl is not None:
+        _listingcache.ttl=ttl
+    return _listingcache
@@ -18,16 +18,20 @@
 from geoslurp.datapull import CrawlerBase
 from geoslurp.datapull import UriBase,UriFile
 from geoslurp.tools.Bounds import BtdBox
-from geoslurp.tools.netcdftools import stackNcFiles
+from geoslurp.tools.netcdftools import concatNcFiles
 from geoslurp.config.slurplogger import slurplogger
 from dateutil.parser import parse as isoParser
 import os
 from motu_utils.motu_api import execute_request
-from datetime import datetime
+from geoslurp.datapull.scheduler import hostScheduler
+from datetime import datetime,timedelta
 from lxml import etree as XMLTree
 from collections import namedtuple
 from netCDF4 import num2date
 import copy
+import math
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 
 class MotuOpts():
@@ -121,7 +125,7 @@ class Uri(UriBase):
         self.opts.out_name=self.opts.out_name.replace('.nc','_descr.xml')
         # import pdb;pdb.set_trace()
         try:
-            execute_request(self.opts)
+            hostScheduler().run(self.opts.motu,execute_request,self.opts)
         except Exception as e:
             slurplogger().error("failed to request info on query")
             raise(e)
@@ -172,7 +176,7 @@ class Uri(UriBase):
         oldd=self.opts.out_dir
         self.opts.out_dir=self.opts.cache
         try:
-            execute_request(self.opts)
+            hostScheduler().run(self.opts.motu,execute_request,self.opts)
         except Exception as e:
             slurplogger().error("failed to request size: %s",e)
             raise(e)
@@ -211,7 +215,7 @@ class Uri(UriBase):
 
         slurplogger().info("Downloading %s"%(fout))
         try:
-            execute_request(self.opts)
+            hostScheduler().run(self.opts.motu,execute_request,self.opts)
         except Exception as e:
             slurplogger().error("failed to download file %s",e)
             raise(e)
@@ -219,14 +223,56 @@ class Uri(UriBase):
 
 
 class MotuRecursive():
-    """Class which recursively downloads netcdf files within the 1GB limit using motu and patches them together"""
+    """Class which downloads netcdf files within the size limit of motu, by splitting the request in tiles which are downloaded concurrently and merged"""
     keepfiles=False
-    def __init__(self,mopts,keepfiles=False):
+    #fraction of the maximum allowed size which a tile aims for
+    fill=0.8
+    #minimum time span of a tile (requests are split in latitude bands as well when more tiles are needed)
+    mintimespan=timedelta(days=1)
+    def __init__(self,mopts,keepfiles=False,maxconn=4):
+        """
+        :param mopts: motu options of the request
+        :param keepfiles: keep the downloaded tiles
+        :param maxconn: maximum number of tiles which are downloaded concurrently"""
         self.mopts=mopts
         self.keepfiles=keepfiles
-
-    def download(self):
-        """Download file"""
+        self.maxconn=maxconn
+        #planned tiles (time tiles consisting of latitude bands) when the request is too large
+        self.tiles=[]
+
+    def tile(self,btdbox,suffix):
+        """Returns a recursive motu request for a part of the bounding box"""
+        mopts=copy.deepcopy(self.mopts)
+        mopts.syncbtdbox(btdbox)
+        mopts.out_name=self.mopts.out_name.replace('.nc',f'_{suffix}.nc')
+        mopts.out_dir=mopts.cache
+        return MotuRecursive(mopts,keepfiles=self.keepfiles,maxconn=self.maxconn)
+
+    def plan(self,kb,maxkb):
+        """Plans tiles which are expected to fit within the size limit
+        :returns: list of time tiles, each consisting of a list of latitude bands"""
+        ntiles=math.ceil(kb/(self.fill*maxkb))
+        bbox=self.mopts.btdbox
+        nt=max(1,min(ntiles,int((bbox.te-bbox.ts)/self.mintimespan)))
+        nlat=math.ceil(ntiles/nt)
+        dt=(bbox.te-bbox.ts)/nt
+        dlat=(bbox.n-bbox.s)/nlat
+        tiles=[]
+        for it in range(nt):
+            bands=[]
+            for ilat in range(nlat):
+                box=copy.deepcopy(bbox)
+                box.ts=bbox.ts+it*dt
+                box.te=bbox.te if it == nt-1 else bbox.ts+(it+1)*dt
+                box.s=bbox.s+ilat*dlat
+                box.n=bbox.n if ilat == nlat-1 else bbox.s+(ilat+1)*dlat
+                bands.append(self.tile(box,f"t{it:03d}" if nlat == 1 else f"t{it:03d}_lat{ilat:02d}"))
+            tiles.append(bands)
+        return tiles
+
+    def fetch(self,executor):
+        """Request info and size and download the file, or plan and submit tiles when it is too large (runs in a worker thread)
+        :returns: tuple of (state,uri,updated) with state being 'current', 'downloaded' or 'split'"""
         muri=Uri(self.mopts)
 
         #check if download is needed
@@ -236,41 +282,63 @@ class MotuRecursive():
             if muri.lastmod <= uristacked.lastmod:
                 slurplogger().info("Already downloaded %s"%(uristacked.url))
                 #quick return when there is no need to merge/download
-                return uristacked,False
+                return 'current',uristacked,False
 
         #check if download is allowed
         kb,maxkb=muri.updateSize()
-        if kb > maxkb:
-            #split up request and try again
-
-            #create 2 bounding boxes split on time
-            Abbox,Bbbox=muri.opts.btdbox.timeSplit()
-
-            AmotuRec=MotuRecursive(copy.deepcopy(self.mopts))
-            AmotuRec.mopts.syncbtdbox(Abbox)
-            AmotuRec.mopts.out_name=self.mopts.out_name.replace('.nc','_A.nc')
-            AmotuRec.mopts.out_dir=AmotuRec.mopts.cache
-
-            BmotuRec=MotuRecursive(copy.deepcopy(self.mopts))
-            BmotuRec.mopts.syncbtdbox(Bbbox)
-            BmotuRec.mopts.out_name=self.mopts.out_name.replace('.nc','_B.nc')
-            BmotuRec.mopts.out_dir=BmotuRec.mopts.cache
-
-            Auri,Aupd=AmotuRec.download()
-            Buri,Bupd=BmotuRec.download()
-
-            #possible improvement here split a dataset at an unlimited dimensions and append the second one to the first one
-            #patch files together (if updated)
-            if Aupd or Bupd or not os.path.exists(self.mopts.fullname()):
-                uristacked,upd=stackNcFiles(self.mopts.fullname(),Auri.url,Buri.url,'time')
-                if not self.keepfiles:
-                    #remove the partial files
-                    os.remove(AmotuRec.mopts.fullname())
-                    os.remove(BmotuRec.mopts.fullname())
-            else:
-                uristacked=UriFile(self.mopts.fullname())
-                upd=False
-            return uristacked, True
-        else:
-            return muri.download(self.mopts.out_dir,check=True)
-
+        if kb <= maxkb:
+            uri,upd=muri.download(self.mopts.out_dir,check=True)
+            return 'downloaded',uri,upd
+
+        #split up the request in tiles which are downloaded concurrently (tiles which are still too large split themselves)
+        self.tiles=self.plan(kb,maxkb)
+        slurplogger().info("Splitting motu request for %s in %d time tiles of %d latitude bands"%(self.mopts.fullname(),len(self.tiles),len(self.tiles[0])))
+        for band in itertools.chain.from_iterable(self.tiles):
+            band.submit(executor)
+        return 'split',None,True
+
+    def submit(self,executor):
+        """Submit the (http) requests of this download to an executor"""
+        self.future=executor.submit(self.fetch,executor)
+
+    def merge(self):
+        """Wait for the submitted download and merge its tiles
+        Note: netCDF4 is not thread safe, so all merging happens in the calling thread (while the remaining tiles are being downloaded)"""
+        state,uri,upd=self.future.result()
+        if state != 'split':
+            return uri,upd
+
+        def timeTiles():
+            #yield the time tiles in order, as soon as they are available
+            for bands in self.tiles:
+                bandfiles=[band.merge()[0].url for band in bands]
+                if len(bandfiles) == 1:
+                    yield bandfiles[0]
+                else:
+                    ncout=bandfiles[0].replace('_lat00.nc','.nc')
+                    concatNcFiles(ncout,bandfiles,'latitude',remove=not self.keepfiles,dedupe=True)
+                    yield ncout
+
+        return concatNcFiles(self.mopts.fullname(),timeTiles(),'time',remove=not self.keepfiles,dedupe=True)
+
+    def cancel(self):
+        """Cancel the requests which have not started yet"""
+        self.future.cancel()
+        for band in itertools.chain.from_iterable(self.tiles):
+            band.cancel()
+
+    def download(self,executor=None):
+        """Download file
+        :param executor: executor to submit the requests to (default creates one with maxconn workers)"""
+        if executor is not None:
+            self.submit(executor)
+            return self.merge()
+
+        with ThreadPoolExecutor(max_workers=self.maxconn) as executor:
+            self.submit(executor)
+            try:
+                return self.merge()
+            except Exception:
+                #don't start requests of tiles which are no longer needed
+                self.cancel()
+                raise
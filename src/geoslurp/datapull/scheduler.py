@@ -0,0 +1,279 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#Process wide scheduler which coordinates the connections to remote hosts: connection caps, byte rate limits, retries with backoff and a circuit breaker per host
+
+import time
+import random
+import ftplib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import pycurl
+from geoslurp.config.slurplogger import slurplog
+from geoslurp.config.cachemanager import parseBytes
+
+class CircuitOpen(Exception):
+    """Raised when a host is temporarily avoided after too many consecutive failures"""
+    pass
+
+class TransientHTTPError(Exception):
+    """Raised when a server responds with a status code which indicates a temporary problem (e.g. 429 or 503)"""
+    def __init__(self,url,code):
+        super().__init__(f"HTTP status {code} from {url}")
+        self.code=code
+
+#curl errors which are worth retrying
+retryCurlErrors={pycurl.E_COULDNT_RESOLVE_HOST,pycurl.E_COULDNT_CONNECT,pycurl.E_PARTIAL_FILE,pycurl.E_OPERATION_TIMEDOUT,
+        pycurl.E_SSL_CONNECT_ERROR,pycurl.E_GOT_NOTHING,pycurl.E_SEND_ERROR,pycurl.E_RECV_ERROR}
+
+#http status codes which are worth retrying
+retryHTTPCodes={408,429,500,502,503,504}
+
+def isTransient(exc):
+    """Returns True when an exception indicates a temporary (network or server) problem"""
+    if isinstance(exc,pycurl.error):
+        return exc.args[0] in retryCurlErrors
+    if isinstance(exc,(TransientHTTPError,ftplib.error_temp,EOFError,ConnectionError,TimeoutError)):
+        return True
+    #e.g. paramiko.SSHException, without depending on paramiko here
+    return type(exc).__name__ in ["SSHException","SSHTimeout"]
+
+def hostOf(url):
+    """Returns the host of an url (or the argument itself when it has none)"""
+    host=urlparse(url).hostname
+    return host if host else url
+
+class HostPolicy:
+    """Limits and retry behaviour of connections to a host
+    :param maxconn: maximum number of concurrent connections (this also caps datasets which request more parallel transfers)
+    :param maxrate: maximum amount of bytes per second (e.g. 500000 or '2M'), None means no limit
+    :param retries: number of retries of a failed transfer
+    :param backoff: base delay in seconds, which doubles with every retry
+    :param maxbackoff: maximum delay between retries
+    :param failthreshold: amount of consecutive failures after which the host is avoided
+    :param cooldown: time in seconds the host is avoided"""
+    def __init__(self,maxconn=6,maxrate=None,retries=3,backoff=2.0,maxbackoff=120,failthreshold=8,cooldown=300):
+        self.maxconn=maxconn
+        self.maxrate=parseBytes(maxrate)
+        self.retries=retries
+        self.backoff=backoff
+        self.maxbackoff=maxbackoff
+        self.failthreshold=failthreshold
+        self.cooldown=cooldown
+
+    def copy(self,**kwargs):
+        opts=dict(vars(self))
+        opts.update(kwargs)
+        return HostPolicy(**opts)
+
+    def delay(self,attempt):
+        """Jittered exponential backoff: a random delay between half and the full exponential delay"""
+        dt=min(self.maxbackoff,self.backoff*2**attempt)
+        return dt/2+random.uniform(0,dt/2)
+
+class TokenBucket:
+    """Thread safe token bucket which limits the amount of bytes per second"""
+    def __init__(self,rate):
+        self.rate=rate
+        self.tokens=rate
+        self.last=time.monotonic()
+        self.lock=threading.Lock()
+
+    def consume(self,nbytes):
+        with self.lock:
+            now=time.monotonic()
+            self.tokens=min(self.rate,self.tokens+(now-self.last)*self.rate)
+            self.last=now
+            self.tokens-=nbytes
+            wait=-self.tokens/self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+class HostState:
+    def __init__(self,policy):
+        self.policy=policy
+        self.slots=threading.BoundedSemaphore(policy.maxconn)
+        self.bucket=TokenBucket(policy.maxrate) if policy.maxrate else None
+        self.failures=0
+        self.openuntil=0
+        #protects failures and openuntil, which are updated from several transfer threads
+        self.lock=threading.Lock()
+
+class HostScheduler:
+    """Coordinates all connections of this process to remote hosts
+    Policies are configured per host, with a default for the hosts which are not explicitly configured"""
+    def __init__(self,default=None):
+        self.default=default if default else HostPolicy()
+        self.policies={}
+        self.states={}
+        self.lock=threading.Lock()
+        #settings which were applied last
+        self.limits=None
+        #hosts for which a capped concurrency has been reported
+        self.capped=set()
+
+    def configure(self,host=None,**kwargs):
+        """Sets the policy of a host (or the default policy when host is None)"""
+        with self.lock:
+            if host is None or host == "default":
+                self.default=self.default.copy(**kwargs)
+                #apply the new default to the hosts which are not explicitly configured
+                self.states={hst:st for hst,st in self.states.items() if hst in self.policies}
+                self.capped.clear()
+            else:
+                self.policies[host]=self.policies.get(host,self.default).copy(**kwargs)
+                self.states.pop(host,None)
+                self.capped.discard(host)
+
+    def fromSettings(self,conf):
+        """Configures the policies from the 'HostLimits' setting, e.g. {"default":{"maxconn":4},"podaac.jpl.nasa.gov":{"maxconn":2,"maxrate":"5M"}}"""
+        try:
+            limits=conf["HostLimits"]
+        except RuntimeError:
+            return
+        if limits == self.limits:
+            #don't reset the state of the hosts when nothing changed
+            return
+        self.limits=limits
+        if "default" in limits:
+            self.configure(None,**limits["default"])
+        for host,opts in limits.items():
+            if host != "default":
+                self.configure(host,**opts)
+
+    def state(self,url):
+        host=hostOf(url)
+        with self.lock:
+            if host not in self.states:
+                self.states[host]=HostState(self.policies.get(host,self.default))
+            return self.states[host]
+
+    def policy(self,url):
+        return self.state(url).policy
+
+    def requestConcurrency(self,url,nconn):
+        """Reports (once per host) when a requested amount of concurrent connections exceeds the maxconn of the host policy
+        :returns: the amount of connections which can actually be used"""
+        host=hostOf(url)
+        maxconn=self.policy(url).maxconn
+        if nconn > maxconn:
+            with self.lock:
+                report=host not in self.capped
+                self.capped.add(host)
+            if report:
+                slurplog.info("Limiting %s to %d concurrent connections (%d requested), configure HostLimits to allow more"%(host,maxconn,nconn))
+            return maxconn
+        return nconn
+
+    def checkCircuit(self,url,state):
+        with state.lock:
+            isopen=time.monotonic() < state.openuntil
+            failures=state.failures
+        if isopen:
+            raise CircuitOpen(f"Host {hostOf(url)} is temporarily avoided after {failures} consecutive failures")
+
+    def acquire(self,url,blocking=True):
+        """Claims a connection slot for the host of an url
+        :returns: the host state (to be passed to release) or None when not blocking and no slot is free"""
+        state=self.state(url)
+        self.checkCircuit(url,state)
+        if not state.slots.acquire(blocking):
+            return None
+        return state
+
+    def release(self,state):
+        state.slots.release()
+
+    @contextmanager
+    def slot(self,url):
+        """Context manager which holds a connection slot for the host of an url"""
+        state=self.acquire(url)
+        try:
+            yield state
+        finally:
+            self.release(state)
+
+    def success(self,url):
+        state=self.state(url)
+        with state.lock:
+            state.failures=0
+
+    def failure(self,url):
+        """Records a transient failure and opens the circuit of the host when the failure threshold is reached"""
+        state=self.state(url)
+        with state.lock:
+            state.failures+=1
+            opencircuit=state.failures >= state.policy.failthreshold and time.monotonic() >= state.openuntil
+            if opencircuit:
+                state.openuntil=time.monotonic()+state.policy.cooldown
+        if opencircuit:
+            slurplog.warning("Too many failures for %s, avoiding host for %d seconds"%(hostOf(url),state.policy.cooldown))
+
+    def throttle(self,url,nbytes):
+        """Blocks when transferring nbytes would exceed the byte rate limit of the host"""
+        bucket=self.state(url).bucket
+        if bucket:
+            bucket.consume(nbytes)
+
+    def transferRate(self,url):
+        """Returns the maximum byte rate of a single transfer (the host rate shared by its connections) or None"""
+        policy=self.policy(url)
+        if not policy.maxrate:
+            return None
+        return max(1,policy.maxrate//policy.maxconn)
+
+    def retryDelay(self,url,attempt):
+        return self.policy(url).delay(attempt)
+
+    def run(self,url,func,*args,retries=None,**kwargs):
+        """Calls func(*args,**kwargs) while holding a connection slot of the host of url
+        Transient failures are retried with a jittered exponential backoff
+        :param retries: override the number of retries of the host policy (e.g. 0 when func can't be repeated)"""
+        if retries is None:
+            retries=self.policy(url).retries
+        attempt=0
+        while True:
+            with self.slot(url):
+                try:
+                    result=func(*args,**kwargs)
+                    self.success(url)
+                    return result
+                except Exception as exc:
+                    if not isTransient(exc):
+                        #the host responded
+                        self.success(url)
+                        raise
+                    self.failure(url)
+                    if attempt >= retries:
+                        raise
+                    err=exc
+            dt=self.retryDelay(url,attempt)
+            attempt+=1
+            slurplog.info("Transfer from %s failed (%s), retry %d/%d in %.1f seconds"%(hostOf(url),err,attempt,retries,dt))
+            time.sleep(dt)
+
+_hostscheduler=None
+_hostschedulerlock=threading.Lock()
+
+def hostScheduler():
+    """Returns the process wide host scheduler"""
+    global _hostscheduler
+    with _hostschedulerlock:
+        if _hostscheduler is None:
+            _hostscheduler=HostScheduler()
+        return _hostscheduler
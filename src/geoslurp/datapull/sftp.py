@@ -18,12 +18,33 @@
 import re
 from datetime import datetime
 import os
+import stat
+import posixpath
+import threading
+from contextlib import contextmanager
 from geoslurp.datapull import UriFile,setFtime
+from geoslurp.datapull.uri import tmpFileName
 from geoslurp.datapull import CrawlerBase
+from geoslurp.datapull.listingcache import listingCache
+from geoslurp.datapull.scheduler import hostScheduler,CircuitOpen
 from geoslurp.config.slurplogger import slurplog
+from geoslurp.config.runcounters import runcounters
 import paramiko
 
 
+def parseSftpUrl(url):
+    """Splits an url of the form sftp://servername[:port]/possible/sub/dir/ in server, port and subdirectory"""
+    if not bool(re.match('^sftp://',url)):
+        raise Exception("sftp url does not seem to be a valid secure-ftp address")
+    server,subdir=re.sub(':[0-9]+','',url[7:]).split("/",1)
+    pmatch=re.search(":([0-9]+)",url)
+    if pmatch is None:
+        port=22
+    else:
+        port=int(pmatch.group(1))
+    return server,port,subdir
+
+
 def sshconnect(auth,url=None):
     """Connect to a ssh server and returns a initialized paramiko sshclient object"""
     if url is None:
@@ -32,18 +53,8 @@ def sshconnect(auth,url=None):
     if url[-1] != '/':
         url+='/'
 
-    # Extract server name directory and port from url
-    if not bool(re.match('^sftp://',url)):
-        raise Exception("sftp url does not seem to be a valid secure-ftp address")
-
-
     #url has the format: sftp://servername[:port]/possible/sub/dir/
-    server,subdir=re.sub(':[0-9]+','',url[7:]).split("/",1)
-    pmatch=re.search(":([0-9]+)",url)
-    if pmatch is None:
-        port=22
-    else:
-        port=int(pmatch.group(1))
+    server,port,subdir=parseSftpUrl(url)
 
     user = auth.user
     password = auth.passw
@@ -59,25 +70,159 @@ def sshconnect(auth,url=None):
     return sftp
 
 
+class SftpPool:
+    """Pool of ssh/sftp sessions to a server
+    :param url: sftp url of the root directory (relative to the login directory)
+    :param auth: credentials (user and passw)
+    :param nsessions: maximum number of concurrent sessions"""
+    def __init__(self,url,auth,nsessions=4):
+        if url[-1] != '/':
+            url+='/'
+        self.url=url
+        self.server,self.port,self.subdir=parseSftpUrl(url)
+        self.auth=auth
+        self.nsessions=nsessions
+        self.slots=threading.Semaphore(nsessions)
+        self.lock=threading.Lock()
+        self.idle=[]
+        self.root=None
+
+    def __deepcopy__(self,memo):
+        #copies of uris share the pool
+        return self
+
+    def connect(self):
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect(self.server,self.port,self.auth.user,self.auth.passw,look_for_keys=False,allow_agent=False)
+        sftp=ssh_client.open_sftp()
+        if self.root is None:
+            #absolute path of the root directory
+            self.root=sftp.normalize(self.subdir if self.subdir else '.')
+        #keep the client alive together with the sftp channel
+        sftp.sshclient=ssh_client
+        return sftp
+
+    @contextmanager
+    def session(self):
+        """Check out a (reused) sftp session"""
+        with self.slots:
+            with self.lock:
+                sftp=self.idle.pop() if self.idle else None
+            if sftp is None:
+                sftp=self.connect()
+            try:
+                yield sftp
+            except Exception as exc:
+                if isinstance(exc,OSError) and exc.errno and not isinstance(exc,ConnectionError):
+                    #e.g. a missing file: the session itself is still fine
+                    with self.lock:
+                        self.idle.append(sftp)
+                else:
+                    self.discard(sftp)
+                raise
+            else:
+                with self.lock:
+                    self.idle.append(sftp)
+
+    def discard(self,sftp):
+        try:
+            sftp.close()
+            sftp.sshclient.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            for sftp in self.idle:
+                self.discard(sftp)
+            self.idle=[]
+
+    def rootPath(self,subdirs=''):
+        """Returns the absolute remote path of a subdirectory of the root"""
+        if self.root is None:
+            with self.session():
+                pass
+        return posixpath.join(self.root,subdirs) if subdirs else self.root
+
+    def listdir(self,subdirs=''):
+        """Returns (name,modification time,isdir) of the entries in a directory, using a single round trip for the attributes"""
+        path=self.rootPath(subdirs)
+        def lsdir():
+            with self.session() as sftp:
+                return [(attr.filename,datetime.fromtimestamp(attr.st_mtime),stat.S_ISDIR(attr.st_mode)) for attr in sftp.listdir_attr(path)]
+        return hostScheduler().run(self.url,lsdir)
+
+    def mtime(self,subdirs=''):
+        """Returns the modification time of a directory (as a timestamp)"""
+        path=self.rootPath(subdirs)
+        def dirstat():
+            with self.session() as sftp:
+                return sftp.stat(path).st_mtime
+        return hostScheduler().run(self.url,dirstat)
+
+    def get(self,rpath,outf):
+        """Downloads a remote file (the reads are pipelined by paramiko's prefetching) and returns its attributes"""
+        sched=hostScheduler()
+        def transfer():
+            received=[0]
+            def progress(nbytes,total):
+                #apply the byte rate limit of the host
+                sched.throttle(self.url,nbytes-received[0])
+                received[0]=nbytes
+            with self.session() as sftp:
+                attr=sftp.stat(rpath)
+                getAtomic(sftp,rpath,outf,progress)
+            return attr
+        return sched.run(self.url,transfer)
+
+
+def getAtomic(sftp,rpath,outf,callback=None):
+    """Downloads a remote file into a temporary file which replaces outf when complete"""
+    tmpfile=tmpFileName(outf)
+    try:
+        sftp.get(rpath,tmpfile,callback=callback)
+    except:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    os.rename(tmpfile,outf)
+
+
 class UriSftp:
-    def __init__(self,url,lastmod=None,subdirs='',auth=None,sftpcon=None):
-        #extract filename from url
-        self.rpath=os.path.basename(url)
-        if sftpcon:
-            self.sftpconnection=sftpcon
+    """Remote file on a sftp server
+    :param sftpcon: existing sftp connection (the file is then relative to its working directory)
+    :param pool: SftpPool to download through (url is then the full sftp url and rpath the absolute remote path)"""
+    def __init__(self,url,lastmod=None,subdirs='',auth=None,sftpcon=None,host=None,pool=None,rpath=None):
+        self.pool=pool
+        self.sftpconnection=None
+        if pool:
+            self.rpath=rpath
         else:
-            self.sftpconnection=sshconnect(url=os.path.dirname(url),auth=auth)
+            #extract filename from url
+            self.rpath=os.path.basename(url)
+            if sftpcon:
+                self.sftpconnection=sftpcon
+            else:
+                self.sftpconnection=sshconnect(url=os.path.dirname(url),auth=auth)
         self.lastmod=lastmod
         self.subdirs=subdirs
         self.url=url
+        #url of the server which is used to schedule the transfers
+        if host:
+            self.host=host
+        else:
+            self.host=pool.url if pool else url
 
 
-    def download(self,direc,check=False,outfile=None,continueonError=False,restdict=None):
+    def download(self,direc,check=False,gzip=False,outfile=None,continueonError=False,restdict=None,validators=None):
         """Download file into directory and possibly check the modification time
         :param check : check whether the file needs updating
-        :param gzip: additionally gzips the file (adds .gz to file name)
         :param continueonError (bool): don't raise an exception when a download error occurrs
+        Note: gzip and validators are accepted for compatibility with parallelDownload but are not supported
         """
+        if gzip:
+            raise RuntimeError("Gzipping sftp downloads is not supported")
         
         #setup the output uri
         if outfile:
@@ -100,41 +245,81 @@ class UriSftp:
                 return uri,False
         slurplog.info("Downloading %s"%(uri.url))
 
-        stat=self.sftpconnection.stat(self.rpath)
-        mtime=datetime.fromtimestamp(stat.st_mtime)
-        self.sftpconnection.get(self.rpath,outf)
+        try:
+            if self.pool:
+                attr=self.pool.get(self.rpath,outf)
+            else:
+                attr=self.sftpconnection.stat(self.rpath)
+                hostScheduler().run(self.host,self.get,outf)
+        except (IOError,paramiko.SSHException,CircuitOpen) as exc:
+            slurplog.info("Download failed, skipping %s"%(uri.url))
+            if not continueonError:
+                raise
+            return uri,False
+        mtime=datetime.fromtimestamp(attr.st_mtime)
+        runcounters.addBytes(attr.st_size)
         #set the modification time to match the server
         setFtime(outf,mtime)
+        uri.lastmod=mtime
         
         return uri,True
 
 
+    def get(self,outf):
+        sched=hostScheduler()
+        received=[0]
+        def progress(nbytes,total):
+            #apply the byte rate limit of the host
+            sched.throttle(self.host,nbytes-received[0])
+            received[0]=nbytes
+        getAtomic(self.sftpconnection,self.rpath,outf,progress)
+
+
 class CrawlerSftp(CrawlerBase):
-    """Crawler for secure-ftp directories"""
-    def __init__(self,url,pattern='.*',auth=None):
+    """Crawler for secure-ftp directories
+    :param nsessions: amount of ssh sessions in the pool (which also limits the amount of parallel downloads)
+    :param followpattern: also descend into subdirectories matching this pattern (files are then downloaded in corresponding subdirectories)"""
+    def __init__(self,url,pattern='.*',auth=None,nsessions=4,followpattern=None):
+        if url[-1] != '/':
+            url+='/'
         super().__init__(url)
-        self.sftpconnection=sshconnect(url=url,auth=auth)
-
+        self.pool=SftpPool(url,auth,nsessions)
         self.pattern=pattern
+        self.followpattern=followpattern
+
+    def parallelDownload(self,outdir,check=False,maxconn=None,gzip=False,continueonError=False,backend=None,validators=None):
+        """Download files in parallel over the sessions of the pool (see CrawlerBase.parallelDownload)"""
+        if maxconn is None:
+            maxconn=self.pool.nsessions
+        if backend not in [None,"threads"]:
+            raise RuntimeError("Sftp downloads only support the 'threads' backend")
+        return super().parallelDownload(outdir,check=check,maxconn=maxconn,gzip=gzip,continueonError=continueonError,backend="threads",validators=validators)
 
     def ls(self,subdirs=''):
-        if bool(subdirs):
-            olddir=self.sftpconnection.getcwd()
-            self.sftpconnection.chdir(subdirs)
-
-        for name in self.sftpconnection.listdir():
-            stat=self.sftpconnection.stat(name)
-            mtime=datetime.fromtimestamp(stat.st_mtime)
-            yield name,mtime
-    
-        if bool(subdirs):
-            #change back to original directory
-            self.sftpconnection.chdir(olddir)
+        """List the entries of a directory as (name,modification time,isdir)"""
+        if self.cachelistings:
+            #reuse the cached listing when the directory is unchanged
+            key=os.path.join(self.rooturl,subdirs)
+            dirmtime=self.pool.mtime(subdirs)
+            cached=listingCache().getJson("sftpattr",key,dirmtime=dirmtime)
+            if cached is None:
+                cached=[(name,mtime.isoformat(),isdir) for name,mtime,isdir in self.lsremote(subdirs)]
+                listingCache().putJson("sftpattr",key,cached,dirmtime=dirmtime)
+            for name,mtime,isdir in cached:
+                yield name,datetime.fromisoformat(mtime),isdir
+        else:
+            yield from self.lsremote(subdirs)
+
+    def lsremote(self,subdirs=''):
+        yield from self.pool.listdir(subdirs)
 
     def uris(self, check=False,subdirs=''):
         # """Generate a list files in a directory and return a list of uri"""
-        for name,t in self.ls(subdirs):
+        for name,t,isdir in self.ls(subdirs):
+            if isdir:
+                if self.followpattern and re.search(self.followpattern,name):
+                    yield from self.uris(check,posixpath.join(subdirs,name))
+                continue
             # #only apply the pattern to the last column
             if re.search(self.pattern,name):
-                yield UriSftp(url=name,sftpcon=self.sftpconnection,lastmod=t)
-
+                yield UriSftp(url=posixpath.join(self.rooturl,subdirs,name),lastmod=t,subdirs=subdirs,pool=self.pool,rpath=posixpath.join(self.pool.rootPath(subdirs),name))
@@ -0,0 +1,113 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#(de)compress data streams on the fly (e.g. while bytes arrive from a download) with constant memory
+
+import zlib
+import bz2
+import lzma
+
+def _zstandard():
+    #optional dependency
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("The zstandard package is needed for (de)compressing zstd streams")
+    return zstandard
+
+#codecs of the form name:(compressorfactory,decompressorfactory,file suffix)
+streamCodecs={
+        "gzip":(lambda:zlib.compressobj(wbits=31),lambda:zlib.decompressobj(wbits=31),".gz"),
+        "bz2":(bz2.BZ2Compressor,bz2.BZ2Decompressor,".bz2"),
+        "xz":(lambda:lzma.LZMACompressor(format=lzma.FORMAT_XZ),lzma.LZMADecompressor,".xz"),
+        "zstd":(lambda:_zstandard().ZstdCompressor().compressobj(),lambda:_zstandard().ZstdDecompressor().decompressobj(),".zst")
+        }
+
+def registerCodec(name,compressor,decompressor,suffix):
+    """Adds a streaming codec
+    :param compressor: factory returning an object with compress(bytes) and flush() methods
+    :param decompressor: factory returning an object with a decompress(bytes) method (and eof/unused_data attributes for multi member streams)
+    :param suffix: file suffix belonging to the codec"""
+    streamCodecs[name]=(compressor,decompressor,suffix)
+
+def codecSuffix(codec):
+    return streamCodecs[codec][2]
+
+def codecFromName(filename):
+    """Returns the codec belonging to the suffix of a file name (or None)"""
+    for name,(comp,decomp,suffix) in streamCodecs.items():
+        if filename.endswith(suffix):
+            return name
+    return None
+
+def resolveCodecs(gzip=False,gunzip=False,compress=None,decompress=None):
+    """Translates the gzip/gunzip flags into codec names and checks them
+    :returns: compress,decompress codec names (or None)"""
+    if gzip:
+        compress="gzip"
+    if gunzip:
+        decompress="gzip"
+    if compress and decompress:
+        raise RuntimeError("cannot compress and decompress at the same time")
+    for codec in [compress,decompress]:
+        if codec and codec not in streamCodecs:
+            raise RuntimeError(f"Unknown stream codec {codec}")
+    return compress,decompress
+
+class CodecWriter:
+    """File-like object which decompresses or compresses written bytes before passing them on to an output file
+    :param fid: open output file (or buffer)
+    :param compress: name of the codec to compress with
+    :param decompress: name of the codec to decompress with (concatenated streams are supported)
+    :param closefid: also close the output file when closing the writer"""
+    def __init__(self,fid,compress=None,decompress=None,closefid=True):
+        self.fid=fid
+        self.closefid=closefid
+        self.decompress=decompress
+        self.encoder=streamCodecs[compress][0]() if compress else None
+        self.decoder=streamCodecs[decompress][1]() if decompress else None
+        #keeps track whether the current decoder is in the middle of a stream
+        self.indecode=False
+
+    def write(self,data):
+        if self.decoder:
+            data=self.decode(data)
+        if self.encoder and data:
+            data=self.encoder.compress(data)
+        if data:
+            self.fid.write(data)
+
+    def decode(self,data):
+        out=[]
+        while data:
+            self.indecode=True
+            out.append(self.decoder.decompress(data))
+            if not getattr(self.decoder,"eof",False):
+                break
+            #start a new decoder for the next member of the stream
+            data=getattr(self.decoder,"unused_data",b'')
+            self.decoder=streamCodecs[self.decompress][1]()
+            self.indecode=False
+        return b''.join(out)
+
+    def close(self):
+        if self.encoder:
+            self.fid.write(self.encoder.flush())
+        if self.closefid:
+            self.fid.close()
+        if self.decoder and self.indecode and hasattr(self.decoder,"eof"):
+            raise RuntimeError(f"Truncated {self.decompress} stream")
@@ -24,6 +24,9 @@ from collections import namedtuple
 from dateutil.parser import parse as isoParser
 
 from geoslurp.datapull import UriBase,CrawlerBase
+from geoslurp.datapull.uri import curlDownload
+from geoslurp.datapull.listingcache import listingCache
+from concurrent.futures import ThreadPoolExecutor
 
 
 class Uri(UriBase):
@@ -136,13 +139,29 @@ def getAttrib(xml,regex):
             return val
     return None
 
+class XMLFeeder:
+    """File-like object which feeds downloaded bytes to an incremental xml parser"""
+    def __init__(self):
+        self.parser=XMLTree.XMLParser()
+
+    def write(self,data):
+        self.parser.feed(data)
+
+    def close(self):
+        """Returns the root element of the parsed document"""
+        return self.parser.close()
+
 class Crawler(CrawlerBase):
-    """A class to work with an Opendap server"""
-    def __init__(self, catalogurl, filter=ThreddsFilter("dataset", attr="urlPath"), followfilter=ThreddsFilter("catalogRef").OR("dataset"),auth=None):
+    """A class to work with an Opendap server
+    :param maxconn: maximum number of subcatalogs which are fetched concurrently"""
+    _pool=None
+    def __init__(self, catalogurl, filter=ThreddsFilter("dataset", attr="urlPath"), followfilter=ThreddsFilter("catalogRef").OR("dataset"),auth=None,maxconn=8):
         super().__init__(url=catalogurl)
+        self.maxconn=maxconn
+        self.lookahead=2*maxconn
         #load the root catalog
         self._catalogurl=catalogurl
-        self._rootxml=self.getCatalog(catalogurl)
+        self._rootxml=self.getCatalog(catalogurl,auth)
         self.services=self.getServices(self._rootxml,self._catalogurl)
         self._filt=filter
         self._followFilt=followfilter
@@ -174,10 +193,14 @@ class Crawler(CrawlerBase):
 
     @staticmethod
     def getCatalog(url,auth=None):
-        """Retrieve a catalogue"""
+        """Retrieve a catalogue (parsed incrementally while it is downloaded)"""
         slurplogger().info("getting Thredds catalog: %s"%(url))
-        buf=http(url,auth=auth).buffer()
-        return XMLTree.fromstring(buf.getvalue())
+        feeder=XMLFeeder()
+        if Crawler.cachelistings:
+            listingCache().fetch("thredds",url,auth=auth,sink=feeder)
+        else:
+            curlDownload(url,feeder,auth=auth)
+        return feeder.close()
 
 
     @staticmethod
@@ -217,7 +240,16 @@ class Crawler(CrawlerBase):
 
     def xmlitems(self, xmlcatalog=None, url=None, depth=10):
         """Generator which returns xml nodes which obey a certain filter
-        Nodes which obey the followFilter will be recursively searched"""
+        Nodes which obey the followFilter will be recursively searched
+        Subcatalogs are prefetched concurrently, while the nodes are returned in the original (depth first) order"""
+        if self._pool is None:
+            #top level call: set up a pool of threads to fetch subcatalogs
+            with ThreadPoolExecutor(max_workers=self.maxconn) as self._pool:
+                try:
+                    yield from self.xmlitems(xmlcatalog,url,depth)
+                finally:
+                    self._pool=None
+            return
 
         if depth == 0:
             # signals a stopiteration
@@ -230,6 +262,10 @@ class Crawler(CrawlerBase):
         if url is None:
             url=self._catalogurl
 
+        #prefetch a limited amount of subcatalogs ahead of the current position
+        prefetch=self.prefetchRefs(xmlcatalog,url)
+        fetched={}
+
         for xelem in xmlcatalog:
 
             if self._filt.isValid(xelem):
@@ -255,8 +291,17 @@ class Crawler(CrawlerBase):
 
                     # We treat CatalogRefs in a special way by retrieving the subcatalog from the thredds server
                     suburl=os.path.dirname(url)+"/"+gethref(xelem)
+                    #top up the prefetched catalogs
+                    while len(fetched) < self.lookahead:
+                        nexturl=next(prefetch,None)
+                        if nexturl is None:
+                            break
+                        if nexturl not in fetched:
+                            fetched[nexturl]=self._pool.submit(self.getCatalog,nexturl,self.auth)
+                    if suburl not in fetched:
+                        fetched[suburl]=self._pool.submit(self.getCatalog,suburl,self.auth)
                     try:
-                        subxml=self.getCatalog(suburl)
+                        subxml=fetched.pop(suburl).result()
                     except:
                         # Just ignore this catalog entry upon exceptions
                         slurplogger().warning("Ignoring failed CatalogRef %s"%(suburl))
@@ -268,6 +313,16 @@ class Crawler(CrawlerBase):
 
                 yield from self.xmlitems(subxml, suburl, depth)
 
+        #don't leave unused prefetches running
+        for future in fetched.values():
+            future.cancel()
+
+    def prefetchRefs(self,xmlcatalog,url):
+        """Generator of the urls of subcatalogs which will be followed (in document order)"""
+        for xelem in xmlcatalog:
+            if xelem.tag.endswith("catalogRef") and self._followFilt and self._followFilt.isValid(xelem) and not self._filt.isValid(xelem):
+                yield os.path.dirname(url)+"/"+gethref(xelem)
+
     def uris(self,depth=10):
         """Generates a list of threddsURI's (makes use of xmlitems())"""
         # urlFilt=ThreddsFilter("dataset", attr="urlPath")
@@ -16,13 +16,18 @@
 # Author Roelof Rietbroek (roelof@geod.uni-bonn.de), 2018
 
 import os
-from datetime import datetime
+from datetime import datetime,timedelta
 import pycurl,re
 import time
+import calendar
+from email.utils import formatdate
 from io  import BytesIO
 from geoslurp.config.slurplogger import slurplog
-import gzip as gz
-from urllib.parse import urlencode
+from geoslurp.config.runcounters import runcounters
+from geoslurp.datapull.streamcodecs import CodecWriter,resolveCodecs,codecSuffix
+from geoslurp.datapull.validators import NotModified
+from geoslurp.datapull.scheduler import hostScheduler,TransientHTTPError,CircuitOpen,retryHTTPCodes
+from urllib.parse import urlencode,urlparse
 
 def findFiles(dir,pattern,since=None):
     """Generator to recursively search adirecctor (returns a generator)"""
@@ -47,50 +52,24 @@ def timeFromStamp(stamp):
     if tinfo == -1:
         dt=datetime.now()
     else:
-        t0=datetime.datetime(1970,1,1,0,0,0)
-        dt=t0+datetime.timedelta(0,tinfo)
+        t0=datetime(1970,1,1,0,0,0)
+        dt=t0+timedelta(0,tinfo)
     return dt
 
 def setFtime(file,modTime=None):
-    """change modification and access time of a file"""
+    """change modification and access time of a file
+    Note: the times of hard linked files (e.g. shared with the blob store) are left untouched, since they would change for all links"""
     if modTime:
+        if os.stat(file).st_nlink > 1:
+            return
         mtime=time.mktime(modTime.timetuple())
         os.utime(file,(mtime,mtime))
 
-def curlDownload(url,fileorfid,mtime=None,gzip=False,gunzip=False,auth=None,restdict=None,headers=None,customRequest=None,upfid=None,cookiefile=None,checkssl=True):
-    """
-    Download  the content of an url to an open file or buffer using pycurl
-    :param url: url to download from
-    :param fileorfid: filename or open file or buffer
-    :param mtime: explicitly set the modification time to this (usefull when modification times are not supported
-    b the server)
-    :param gzip: additionally gzip the file on disk (note this routine does not append .gz to the file name)
-    :param gunzip: automatically gunzip the downloaded file
-    :param auth: supply authentification data (user and passw)
-    :param restdic: a set of (REST) API name-value pairs to be added to the url (provide as a dict)
-    :param headers (array of header values): additionally set header elements
-    :param customRequest: set a custoi request (e.g. for WEBDAV servers)
-    :return: modification time of remote file
-    """
-    
-    if gzip and gunzip:
-        raise RuntimeError("cannot gzip and gunzip at the same time")
-
-    if type(fileorfid) == str:
-        if gunzip:
-            tmpfile=os.path.join(os.path.dirname(fileorfid),"."+os.path.basename(fileorfid)+".tmp.gz")
-        else:
-            tmpfile=os.path.join(os.path.dirname(fileorfid),"."+os.path.basename(fileorfid)+".tmp")
-
-        if gzip:
-            #note this routine does not change the filename!!
-            fid=gz.open(tmpfile,'wb')
-        else:
-            fid=open(tmpfile,'wb')
-    else:
-        fid=fileorfid
-
-    crl=pycurl.Curl()
+def curlSetup(crl,url,fid,auth=None,restdict=None,headers=None,customRequest=None,upfid=None,cookiefile=None,checkssl=True,validators=None,conditional=False):
+    """Sets the options of a pycurl handle which downloads an url to an open file or buffer (see curlDownload for the parameters)
+    :param validators: ValidatorStore to capture the validators of the response in
+    :param conditional: make the request conditional on the stored validators
+    :returns: a collector of the response headers when validators are used"""
     #crl.setopt(pycurl.VERBOSE,1)
     crl.setopt(pycurl.USERAGENT,"curl/7.72.0")
     if not checkssl:
@@ -100,6 +79,10 @@ def curlDownload(url,fileorfid,mtime=None,gzip=False,gunzip=False,auth=None,rest
     crl.setopt(pycurl.URL,url.replace(' ','%20'))
     crl.setopt(pycurl.FOLLOWLOCATION, 1)
     crl.setopt(pycurl.WRITEDATA,fid)
+    #share the byte rate limit of the host
+    rate=hostScheduler().transferRate(url)
+    if rate:
+        crl.setopt(pycurl.MAX_RECV_SPEED_LARGE,rate)
      
     if customRequest:
         crl.setopt(pycurl.CUSTOMREQUEST,customRequest)
@@ -111,6 +94,9 @@ def curlDownload(url,fileorfid,mtime=None,gzip=False,gunzip=False,auth=None,rest
 
         crl.setopt(pycurl.COOKIEJAR, cookiefile)
 
+    if headers:
+        #don't modify the list of the caller
+        headers=list(headers)
 
     if auth:
         if hasattr(auth,"ftptls"):
@@ -122,11 +108,11 @@ def curlDownload(url,fileorfid,mtime=None,gzip=False,gunzip=False,auth=None,rest
         if hasattr(auth,"trusted"):
             if auth.trusted:
                 crl.setopt(pycurl.UNRESTRICTED_AUTH,1)
-        if hasattr(auth,'oauthtoken'):
+        if getattr(auth,'oauthtoken',None):
             #use oauth in a header to authenticate
             oauthhead=f"Authorization: Bearer {auth.oauthtoken}"
             if headers:
-                headers.append(oauthead)
+                headers.append(oauthhead)
             else:
                 headers=[oauthhead]
 
@@ -135,6 +121,10 @@ def curlDownload(url,fileorfid,mtime=None,gzip=False,gunzip=False,auth=None,rest
             #use basic authentication
             crl.setopt(pycurl.USERPWD,auth.user+":"+auth.passw)
 
+    collector=None
+    if validators is not None:
+        headers,collector=validators.prepare(crl,url,headers,conditional)
+
     if headers:
         crl.setopt(pycurl.HTTPHEADER,headers)
     
@@ -145,35 +135,290 @@ def curlDownload(url,fileorfid,mtime=None,gzip=False,gunzip=False,auth=None,rest
         crl.setopt(pycurl.UPLOAD,1)
         crl.setopt(pycurl.READDATA,upfid)
 
-    try:
-        crl.perform()
-    except pycurl.error as pyexc:
-        # possibly remove a partly downloaded file
-        if type(fileorfid) == str:       
-            if os.path.exists(tmpfile):
-                os.remove(tmpfile)
-        raise pyexc
+    return collector
+
+def openOutput(fileorfid,gzip=False,gunzip=False,compress=None,decompress=None):
+    """Opens a temporary output file next to the requested file (or passes through an open file/buffer)
+    The data is (de)compressed on the fly while it is written
+    :returns: the file object to write to and the name of the temporary file (None for buffers)"""
+    compress,decompress=resolveCodecs(gzip,gunzip,compress,decompress)
+
+    if type(fileorfid) != str:
+        if compress or decompress:
+            return CodecWriter(fileorfid,compress=compress,decompress=decompress,closefid=False),None
+        return fileorfid,None
+
+    tmpfile=tmpFileName(fileorfid)
+    fid=open(tmpfile,'wb')
+    if compress or decompress:
+        #note this routine does not change the filename!!
+        fid=CodecWriter(fid,compress=compress,decompress=decompress)
+    return fid,tmpfile
+
+def tmpFileName(file):
+    return os.path.join(os.path.dirname(file),"."+os.path.basename(file)+".tmp")
+
+def openResume(file,mtime=None):
+    """Opens the temporary file of a previously interrupted download for appending
+    The partial file is discarded when it is older than the modification time of the remote file
+    :returns: the open file, the name of the temporary file and the offset to resume from"""
+    tmpfile=tmpFileName(file)
+    offset=0
+    if os.path.exists(tmpfile):
+        if mtime and datetime.fromtimestamp(os.path.getmtime(tmpfile)) < mtime:
+            slurplog.info("Remote file changed since the partial download of %s, starting over"%(file))
+        else:
+            offset=os.path.getsize(tmpfile)
+    if offset > 0:
+        slurplog.info("Resuming download of %s from byte %d"%(file,offset))
+        fid=open(tmpfile,'ab')
+    else:
+        fid=open(tmpfile,'wb')
+    return fid,tmpfile,offset
 
+def abortOutput(fid,tmpfile):
+    """Closes and removes a partly downloaded temporary file"""
+    if tmpfile:
+        try:
+            fid.close()
+        except RuntimeError:
+            #e.g. a truncated compressed stream
+            pass
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+def finishOutput(crl,fileorfid,fid,tmpfile,mtime=None):
+    """Moves a completed temporary file in place and sets its modification time
+    :returns: modification time of the remote file"""
+    runcounters.addBytes(crl.getinfo(pycurl.SIZE_DOWNLOAD))
     modtime=timeFromStamp(crl.getinfo(pycurl.INFO_FILETIME))
     if mtime:
         #force the modification time to that provided
         modtime=mtime
 
-    #close file if input was a filename or unzip data in the output file
-    if type(fileorfid) == str:
-        fid.close()
-        if gunzip:
-            #decompress the temporary gzipped file in the outputfile
-            with open(fileorfid,'wb') as fidout:
-                with gz.open(tmpfile,'rb') as gzid:
-                    fidout.write(gzid.read())
-            #remove the temporary file
+    if tmpfile:
+        try:
+            #note: this also flushes the (de)compressor
+            fid.close()
+        except RuntimeError:
             os.remove(tmpfile)
-        else:
-            # just rename temporary file
-            os.rename(tmpfile,fileorfid)
+            raise
+        # just rename temporary file
+        os.rename(tmpfile,fileorfid)
         setFtime(fileorfid,modtime)
+    elif isinstance(fid,CodecWriter):
+        fid.close()
+
+    return modtime
+
+def curlDownload(url,fileorfid,mtime=None,gzip=False,gunzip=False,auth=None,restdict=None,headers=None,customRequest=None,upfid=None,cookiefile=None,checkssl=True,compress=None,decompress=None,resume=False,validators=None,conditional=None):
+    """
+    Download  the content of an url to an open file or buffer using pycurl
+    :param url: url to download from
+    :param fileorfid: filename or open file or buffer
+    :param mtime: explicitly set the modification time to this (usefull when modification times are not supported
+    b the server)
+    :param gzip: additionally gzip the file on disk (note this routine does not append .gz to the file name)
+    :param gunzip: automatically gunzip the downloaded file
+    :param auth: supply authentification data (user and passw)
+    :param restdic: a set of (REST) API name-value pairs to be added to the url (provide as a dict)
+    :param headers (array of header values): additionally set header elements
+    :param customRequest: set a custoi request (e.g. for WEBDAV servers)
+    :param compress: compress the data on the fly with this codec (e.g. 'gzip','bz2','xz','zstd')
+    :param decompress: decompress the data on the fly with this codec
+    :param resume: keep the partial file of a failed download and resume from there on the next call (only for plain downloads to a file with a known mtime)
+    :param validators: ValidatorStore, when the output file exists the request is made conditional on the stored ETag/Last-Modified
+    (raises NotModified when the remote file is unchanged) and the validators of the response are stored
+    :param conditional: explicitly enable/disable the conditional request (e.g. for buffers)
+    :return: modification time of remote file
+    Note: the transfer is scheduled by the process wide host scheduler, which retries transient failures
+    """
+    retries=None
+    if type(fileorfid) != str:
+        #rewind buffers before a retry (transfers to other writers can't be repeated)
+        try:
+            pos=fileorfid.tell()
+        except (AttributeError,OSError):
+            pos=None
+            retries=0
+    if upfid is not None:
+        uppos=upfid.tell()
+    def transfer():
+        if type(fileorfid) != str and pos is not None:
+            fileorfid.seek(pos)
+            fileorfid.truncate()
+        if upfid is not None:
+            #resend the complete request body
+            upfid.seek(uppos)
+        return curlTransfer(url,fileorfid,mtime,auth=auth,restdict=restdict,headers=headers,customRequest=customRequest,upfid=upfid,cookiefile=cookiefile,checkssl=checkssl,compress=compress,decompress=decompress,resume=resume,validators=validators,conditional=conditional)
+    compress,decompress=resolveCodecs(gzip,gunzip,compress,decompress)
+    return hostScheduler().run(url,transfer,retries=retries)
+
+def curlTransfer(url,fileorfid,mtime=None,auth=None,restdict=None,headers=None,customRequest=None,upfid=None,cookiefile=None,checkssl=True,compress=None,decompress=None,resume=False,validators=None,conditional=None):
+    """Single transfer attempt of curlDownload (without scheduling)"""
+    #only resume when the version of the partial file can be verified (i.e. the remote modification time is known)
+    resume=resume and mtime is not None and type(fileorfid) == str and not (compress or decompress or restdict or customRequest or upfid)
+    offset=0
+    if resume:
+        fid,tmpfile,offset=openResume(fileorfid,mtime)
+    else:
+        fid,tmpfile=openOutput(fileorfid,compress=compress,decompress=decompress)
+
+    conditionalarg=conditional
+    origheaders=headers
+    if conditional is None:
+        conditional=type(fileorfid) == str and os.path.exists(fileorfid)
+    conditional=conditional and validators is not None and offset == 0
+    if offset > 0 and urlparse(url).scheme in ("http","https"):
+        #let the server send the complete file (which fails the resume below) when it changed after mtime
+        headers=list(headers or [])+["If-Range: "+formatdate(calendar.timegm(mtime.timetuple()),usegmt=True)]
+    crl=pycurl.Curl()
+    collector=curlSetup(crl,url,fid,auth=auth,restdict=restdict,headers=headers,customRequest=customRequest,upfid=upfid,cookiefile=cookiefile,checkssl=checkssl,validators=validators,conditional=conditional)
+    if offset > 0:
+        #request the remaining bytes only (HTTP Range or FTP REST)
+        crl.setopt(pycurl.RESUME_FROM_LARGE,offset)
+
+    try:
+        crl.perform()
+    except pycurl.error as pyexc:
+        crl.close()
+        if offset > 0 and pyexc.args[0] in (pycurl.E_RANGE_ERROR,pycurl.E_BAD_DOWNLOAD_RESUME,pycurl.E_FTP_COULDNT_USE_REST):
+            #the server does not support resuming or the remote file changed: start over
+            slurplog.info("Cannot resume download of %s, starting over"%(fileorfid))
+            abortOutput(fid,tmpfile)
+            return curlTransfer(url,fileorfid,mtime,auth=auth,headers=origheaders,cookiefile=cookiefile,checkssl=checkssl,resume=resume,validators=validators,conditional=conditionalarg)
+        if resume:
+            #keep the partial file for a next attempt
+            fid.close()
+        else:
+            # possibly remove a partly downloaded file
+            abortOutput(fid,tmpfile)
+        raise pyexc
+
+    code=crl.getinfo(pycurl.RESPONSE_CODE)
+    if code in retryHTTPCodes:
+        #don't store the error page of an overloaded server
+        crl.close()
+        if offset > 0:
+            fid.close()
+            os.truncate(tmpfile,offset)
+        else:
+            abortOutput(fid,tmpfile)
+        raise TransientHTTPError(url,code)
+    
+    if conditional and validators.notModified(crl):
+        crl.close()
+        abortOutput(fid,tmpfile)
+        raise NotModified(url)
+
+    modtime=finishOutput(crl,fileorfid,fid,tmpfile,mtime=mtime)
+    if validators is not None:
+        validators.record(url,crl,collector)
+    crl.close()
+    return modtime
+
+def remoteSize(url,auth=None,headers=None,cookiefile=None,checkssl=True):
+    """Retrieves the size of a remote file and whether byte ranges can be requested
+    :returns: size in bytes (-1 when unknown) and a boolean indicating support of byte ranges"""
+    hdrs=[]
+    crl=pycurl.Curl()
+    curlSetup(crl,url,BytesIO(),auth=auth,headers=headers,cookiefile=cookiefile,checkssl=checkssl)
+    crl.setopt(pycurl.NOBODY,1)
+    crl.setopt(pycurl.HEADERFUNCTION,lambda ln:hdrs.append(ln.decode('iso-8859-1').lower()))
+    with hostScheduler().slot(url):
+        crl.perform()
+    size=int(crl.getinfo(pycurl.CONTENT_LENGTH_DOWNLOAD))
+    effurl=crl.getinfo(pycurl.EFFECTIVE_URL)
+    crl.close()
+    if effurl.startswith('ftp'):
+        #ftp servers support the REST command
+        ranges=True
+    else:
+        ranges=any(ln.startswith("accept-ranges:") and "bytes" in ln for ln in hdrs)
+    return size,ranges
+
+class SegmentWriter:
+    """Writes a byte range directly at its position in the output file"""
+    def __init__(self,fd,start,end):
+        self.fd=fd
+        self.pos=start
+        self.end=end
+
+    def write(self,data):
+        if self.pos+len(data) > self.end+1:
+            #the server ignored the range request: abort the transfer
+            return 0
+        os.pwrite(self.fd,data,self.pos)
+        self.pos+=len(data)
+
+    def complete(self):
+        return self.pos == self.end+1
+
+def segmentedDownload(url,file,nsegments=4,minsize=64*1024**2,mtime=None,auth=None,headers=None,cookiefile=None,checkssl=True):
+    """
+    Download a large file as parallel byte-range segments, which are written at their offsets in a single preallocated temporary file
+    Falls back to curlDownload (with resume) when the file is small or the server does not support byte ranges
+    :param nsegments: number of parallel segments
+    :param minsize: minimum size of the file in bytes to split it in segments
+    :return: modification time of remote file
+    """
+    size,ranges=remoteSize(url,auth=auth,headers=headers,cookiefile=cookiefile,checkssl=checkssl)
+    if not ranges or size < max(minsize,nsegments):
+        return curlDownload(url,file,mtime,auth=auth,headers=headers,cookiefile=cookiefile,checkssl=checkssl,resume=True)
+
+    slurplog.info("Downloading %s in %d segments"%(file,nsegments))
+    tmpfile=tmpFileName(file)
+    fd=os.open(tmpfile,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0o644)
+    os.ftruncate(fd,size)
+    seglen=-(-size//nsegments)
+    multi=pycurl.CurlMulti()
+    segments=[]
+    for start in range(0,size,seglen):
+        writer=SegmentWriter(fd,start,min(size,start+seglen)-1)
+        crl=pycurl.Curl()
+        curlSetup(crl,url,writer,auth=auth,headers=headers,cookiefile=cookiefile,checkssl=checkssl)
+        crl.setopt(pycurl.RANGE,"%d-%d"%(writer.pos,writer.end))
+        multi.add_handle(crl)
+        segments.append((crl,writer))
+
+    failed=[]
+    nactive=len(segments)
+    #note: the segments of a file share a single connection slot of the host
+    with hostScheduler().slot(url):
+        while nactive > 0:
+            while True:
+                ret,nactive=multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            nqueued,succeeded,errors=multi.info_read()
+            failed.extend(errors)
+            if nactive > 0:
+                multi.select(1.0)
 
+    try:
+        if failed or not all(writer.complete() for crl,writer in segments):
+            msg=failed[0][2] if failed else "incomplete byte range"
+            raise pycurl.error("Segmented download of %s failed: %s"%(url,msg))
+        for crl,writer in segments:
+            runcounters.addBytes(crl.getinfo(pycurl.SIZE_DOWNLOAD))
+        if mtime:
+            modtime=mtime
+        else:
+            modtime=timeFromStamp(segments[0][0].getinfo(pycurl.INFO_FILETIME))
+    except:
+        os.close(fd)
+        os.remove(tmpfile)
+        raise
+    finally:
+        for crl,writer in segments:
+            multi.remove_handle(crl)
+            crl.close()
+        multi.close()
+
+    os.close(fd)
+    #atomically move the assembled file in place
+    os.rename(tmpfile,file)
+    setFtime(file,modtime)
     return modtime
 
 
@@ -184,6 +429,7 @@ class UriBase():
     auth=None #link to a certain authentification alias
     subdirs='' #create these subdrectories when downloading the file
     headers=None 
+    resumable=True #keep partial downloads and resume them on the next attempt (only when the remote modification time is known)
     def __init__(self,url,lastmod=None,auth=None,subdirs='',headers=None,cookiefile=None,checkssl=True):
         self.url=url
         self.lastmod=lastmod
@@ -205,44 +451,64 @@ class UriBase():
         self.lastmod=timeFromStamp(crl.getinfo(pycurl.INFO_FILETIME))
         return self.lastmod
 
-    def download(self,direc,check=False,gzip=False,gunzip=False,outfile=None,continueonError=False,restdict=None):
-        """Download file into directory and possibly check the modification time
-        :param check : check whether the file needs updating
-        :param gzip: additionally gzips the file (adds .gz to file name)
-        :param continueonError (bool): don't raise an exception when a download error occurrs
-        """
-
-        #setup the output uri
+    def outputFile(self,direc,gzip=False,gunzip=False,outfile=None,compress=None,decompress=None):
+        """Returns the name of the file to download to (the directory is created when needed)"""
+        compress,decompress=resolveCodecs(gzip,gunzip,compress,decompress)
         if outfile:
             outf=os.path.join(direc,self.subdirs,outfile)
         else:
-            if gzip:
-                outf=os.path.join(direc,self.subdirs,os.path.basename(self.url))+'.gz'
-            elif gunzip:
-                #strip gz suffix
+            if compress:
+                outf=os.path.join(direc,self.subdirs,os.path.basename(self.url))+codecSuffix(compress)
+            elif decompress:
+                #strip compression suffix
                 outf=os.path.splitext(os.path.join(direc,self.subdirs,os.path.basename(self.url)))[0]
             else:
                 outf=os.path.join(direc,self.subdirs,os.path.basename(self.url))
 
-
-
         #create directory if it does not exist
         if not os.path.exists(os.path.dirname(outf)):
             os.makedirs(os.path.dirname(outf),exist_ok=True)
+        return outf
+
+    def isCurrent(self,uri):
+        """Returns True when the local uri is at least as new as this resource"""
+        return bool(self.lastmod and uri.lastmod and self.lastmod <= uri.lastmod)
+
+    def download(self,direc,check=False,gzip=False,gunzip=False,outfile=None,continueonError=False,restdict=None,engine=None,compress=None,decompress=None,segments=None,validators=None):
+        """Download file into directory and possibly check the modification time
+        :param check : check whether the file needs updating
+        :param gzip: additionally gzips the file (adds .gz to file name)
+        :param gunzip: gunzip the file while downloading (strips the suffix from the file name)
+        :param compress/decompress: same as gzip/gunzip but for other stream codecs ('bz2','xz','zstd')
+        :param continueonError (bool): don't raise an exception when a download error occurrs
+        :param engine: download through a (shared) CurlMultiEngine instead of a separate curl handle
+        :param segments: download large files in this amount of parallel byte-range segments
+        :param validators: ValidatorStore which makes the download a conditional request (skips unchanged files when lastmod is unknown)
+        """
+        compress,decompress=resolveCodecs(gzip,gunzip,compress,decompress)
+        if engine is not None:
+            return next(engine.download([self],direc,check=check,compress=compress,decompress=decompress,outfile=outfile,continueonError=continueonError,restdict=restdict,validators=validators))
+
+        #setup the output uri
+        outf=self.outputFile(direc,compress=compress,decompress=decompress,outfile=outfile)
 
         uri=UriFile(url=outf)
-        if check and self.lastmod and uri.lastmod:
-            if self.lastmod <= uri.lastmod:
-                #no need to download the file
-                slurplog.info("Already Downloaded, skipping %s"%(uri.url))
-                return uri,False
+        if check and self.isCurrent(uri):
+            #no need to download the file
+            slurplog.info("Already Downloaded, skipping %s"%(uri.url))
+            return uri,False
         slurplog.info("Downloading %s"%(uri.url))
         try:
-            if self.lastmod:
-                curlDownload(self.url,uri.url,self.lastmod,gzip=gzip,gunzip=gunzip,auth=self.auth,restdict=restdict,headers=self.headers,cookiefile=self.cookiefile,checkssl=self.checkssl)
+            if segments and not (compress or decompress or restdict):
+                modtime=segmentedDownload(self.url,uri.url,nsegments=segments,mtime=self.lastmod,auth=self.auth,headers=self.headers,cookiefile=self.cookiefile,checkssl=self.checkssl)
             else:
-                self.lastmod=curlDownload(self.url,uri.url,gzip=gzip,gunzip=gunzip,auth=self.auth,restdict=restdict,headers=self.headers,cookiefile=self.cookiefile,checkssl=self.checkssl)
-        except pycurl.error as pyexc:
+                modtime=curlDownload(self.url,uri.url,self.lastmod,compress=compress,decompress=decompress,auth=self.auth,restdict=restdict,headers=self.headers,cookiefile=self.cookiefile,checkssl=self.checkssl,resume=self.resumable,validators=validators)
+            if not self.lastmod:
+                self.lastmod=modtime
+        except NotModified:
+            slurplog.info("Not modified, skipping %s"%(uri.url))
+            return uri,False
+        except (pycurl.error,TransientHTTPError,CircuitOpen) as pyexc:
             slurplog.info("Download failed, skipping %s"%(uri.url))
             if not continueonError:
                 raise pyexc
@@ -0,0 +1,98 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#Store of cache validators (ETag, Last-Modified, Content-Length) which allows downloads to be done as conditional requests
+
+import sqlite3
+import threading
+import pycurl
+
+class NotModified(Exception):
+    """Raised when a conditional download finds that the remote file is unchanged"""
+    pass
+
+class ResponseHeaders:
+    """Collects the headers of the final response (a curl HEADERFUNCTION)"""
+    def __init__(self):
+        self.headers={}
+
+    def __call__(self,line):
+        line=line.decode('iso-8859-1').strip()
+        if line.startswith("HTTP/"):
+            #new response (e.g. after a redirect)
+            self.headers={}
+        elif ':' in line:
+            ky,val=line.split(':',1)
+            self.headers[ky.strip().lower()]=val.strip()
+
+class ValidatorStore:
+    """Persistent (sqlite) store with the validators of downloaded urls
+    :param path: sqlite file to store the validators in"""
+    def __init__(self,path):
+        self.db=sqlite3.connect(path,check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS validators (url TEXT PRIMARY KEY, etag TEXT, lastmodified INTEGER, size INTEGER)")
+        self.db.commit()
+        #the store may be shared between download threads
+        self.lock=threading.Lock()
+
+    def get(self,url):
+        """Returns the stored validators of an url as a dict (or None)"""
+        with self.lock:
+            row=self.db.execute("SELECT etag,lastmodified,size FROM validators WHERE url=?",(url,)).fetchone()
+        if row is None:
+            return None
+        return {"etag":row[0],"lastmodified":row[1],"size":row[2]}
+
+    def update(self,url,etag=None,lastmodified=None,size=None):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO validators (url,etag,lastmodified,size) VALUES (?,?,?,?)",(url,etag,lastmodified,size))
+            self.db.commit()
+
+    def forget(self,url):
+        with self.lock:
+            self.db.execute("DELETE FROM validators WHERE url=?",(url,))
+            self.db.commit()
+
+    def prepare(self,crl,url,headers=None,conditional=True):
+        """Sets up a curl handle to send the stored validators of an url (when conditional) and to capture the new ones
+        :returns: the (extended) request headers and a collector of the response headers"""
+        collector=ResponseHeaders()
+        crl.setopt(pycurl.HEADERFUNCTION,collector)
+        #also retrieves the modification time of ftp files
+        crl.setopt(pycurl.OPT_FILETIME,1)
+        val=self.get(url) if conditional else None
+        if val:
+            if val["etag"]:
+                headers=list(headers or [])+[f"If-None-Match: {val['etag']}"]
+            if val["lastmodified"]:
+                crl.setopt(pycurl.TIMECONDITION,pycurl.TIMECONDITION_IFMODSINCE)
+                crl.setopt(pycurl.TIMEVALUE,val["lastmodified"])
+        return headers,collector
+
+    @staticmethod
+    def notModified(crl):
+        """Returns True when a conditional transfer found the remote file to be unchanged"""
+        if crl.getinfo(pycurl.RESPONSE_CODE) == 304:
+            return True
+        return bool(crl.getinfo(pycurl.CONDITION_UNMET))
+
+    def record(self,url,crl,collector):
+        """Stores the validators of a completed transfer"""
+        filetime=crl.getinfo(pycurl.INFO_FILETIME)
+        self.update(url,etag=collector.headers.get("etag"),
+                lastmodified=filetime if filetime > 0 else None,
+                size=int(crl.getinfo(pycurl.SIZE_DOWNLOAD)))
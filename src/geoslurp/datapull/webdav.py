@@ -21,21 +21,83 @@ import time
 from datetime import datetime
 from geoslurp.datapull import UriBase, UriFile, setFtime,curlDownload
 from geoslurp.datapull import CrawlerBase
+from geoslurp.datapull.listingcache import listingCache
 from geoslurp.config.slurplogger import slurplog
 from dateutil.parser import parse
 from io  import BytesIO
 from lxml import etree as XMLTree
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED
 from dateutil.parser import parse as isoParser
+import pycurl
+from geoslurp.datapull.scheduler import TransientHTTPError,CircuitOpen
+
+propfindBody=(b'<?xml version="1.0"?>'
+    b'<a:propfind xmlns:a="DAV:">'
+    b'<a:prop><a:getlastmodified/><a:resourcetype/></a:prop>'
+    b'</a:propfind>')
+
+class MultiStatusParser:
+    """Incrementally parses a multistatus (PROPFIND) response while it is being downloaded
+    Only (href,isdir,lastmodified) tuples are kept, the parsed xml elements are discarded"""
+    def __init__(self):
+        self.parser=XMLTree.XMLPullParser(events=("start","end"))
+        self.entries=[]
+        self.roottag=None
+        self.invalid=False
+
+    def write(self,data):
+        if self.invalid:
+            return
+        try:
+            self.parser.feed(data)
+            self.drain()
+        except XMLTree.XMLSyntaxError:
+            #not an xml document (e.g. an html error page)
+            self.invalid=True
+
+    def drain(self):
+        for event,elem in self.parser.read_events():
+            if event == "start":
+                if self.roottag is None:
+                    self.roottag=elem.tag
+                continue
+            if elem.tag != '{DAV:}response':
+                continue
+            isdir=elem.find("{DAV:}propstat/{DAV:}prop/{DAV:}resourcetype/{DAV:}collection") is not None
+            self.entries.append((elem.findtext('{DAV:}href'),isdir,elem.findtext('{DAV:}propstat/{DAV:}prop/{DAV:}getlastmodified')))
+            #free the memory of the processed responses
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    def close(self):
+        if not self.invalid:
+            try:
+                self.parser.close()
+                self.drain()
+            except XMLTree.XMLSyntaxError:
+                #e.g. a truncated document
+                self.invalid=True
+        return self.entries
+
+    def refused(self):
+        """Returns True when the server returned an error document instead of a (complete) multistatus (e.g. propfind-finite-depth)"""
+        return self.invalid or self.roottag != '{DAV:}multistatus'
 
 class Crawler(CrawlerBase):
-    """Webdav Crawler (list content of a directory)"""
+    """Webdav Crawler (list content of a directory)
+    :param depth: maximum depth of the directories to list (None for unlimited)
+    :param maxconn: amount of concurrent PROPFIND requests when walking the directories
+    :param infinity: try to retrieve the complete tree in a single 'Depth: infinity' request"""
     pattern=None
-    def __init__(self,rooturl,pattern,auth,depth=1):
+    def __init__(self,rooturl,pattern,auth,depth=1,maxconn=4,infinity=True):
         if not rooturl.endswith('/'):
             rooturl+='/'
         super().__init__(rooturl)
         self.auth=auth
         self.depth=depth
+        self.maxconn=maxconn
+        self.infinity=infinity
         
         # #extract protocol from url
         proto,url=self.rooturl.split('://')
@@ -44,39 +106,84 @@ class Crawler(CrawlerBase):
         self.baseurl=proto+"://"+baseurl
         self.regex=re.compile(pattern)
 
+    def propfind(self,urlin,depth="1"):
+        """Retrieve the listing of a collection with a PROPFIND request
+        The response is parsed while it is being downloaded and only the parsed entries of a multistatus response are cached
+        :param depth: value of the Depth header ('1' or 'infinity')
+        :returns: list of (href,isdir,lastmodified) or None when the server refuses the request"""
+        kind="webdav" if depth == "1" else f"webdav-{depth}"
+        if self.cachelistings:
+            cached=listingCache().getJson(kind,urlin)
+            if cached is not None:
+                return [tuple(entry) for entry in cached]
+
+        parser=MultiStatusParser()
+        headers=[f"Depth: {depth}"]
+        #retrieve the directory listing as xml by making a PROPFIND HTTP request to the webdav server
+        curlDownload(urlin,parser,auth=self.auth,headers=headers,customRequest="PROPFIND",upfid=BytesIO(propfindBody))
+        entries=parser.close()
+        if parser.refused():
+            return None
+        if self.cachelistings:
+            listingCache().putJson(kind,urlin,entries)
+        return entries
+
+    def isSelf(self,href,urlin):
+        return (self.baseurl+href).rstrip('/') == urlin.rstrip('/')
+
+    def relDepth(self,href):
+        """Returns the depth of a href relative to the root url"""
+        rootpath=self.rooturl[len(self.baseurl):]
+        return href.rstrip('/')[len(rootpath):].count('/')+1
+
+    def entry(self,href,lastmod):
+        if lastmod:
+            lastmod=isoParser(lastmod).replace(tzinfo=None)
+        return self.baseurl+href,lastmod
+
     def find(self,urlin,depth):
         """List files in a webdav directory and recursively do this for directories untill the depth is exhausted"""
         if depth == 0:
             return
-        else:
-            depth-=1
-
-        buffer=BytesIO()
-        buffer.write(b'<?xml version="1.0"?>'
-            b'<a:propfind xmlns:a="DAV:">'
-            b'<a:prop><a:getlastmodified/></a:prop>'
-            b'</a:propfind>')
-    
-        #retrieve the directory listing as xml by making a PROPFIND HTTP request tot eh webdav server
-        xmlout=BytesIO()
-        curlDownload(urlin,xmlout,auth=self.auth,headers=["Depth: 1"],customRequest="PROPFIND",upfid=buffer)
-        xmlroot=XMLTree.fromstring(xmlout.getvalue())
-        #walk through the xml tree and gather files with their modification dates
-        for xelem in xmlroot.iterfind('{DAV:}response'):
-
-            url=xelem.find('{DAV:}href').text
-            #is this a directory?
-            isdir=xelem.find("{DAV:}propstat/{DAV:}prop/{DAV:}resourcetype/{DAV:}collection")
-            if isdir is not None and self.baseurl+url != urlin and depth > 0:
-                #call this function recursively
-                yield from self.find(self.baseurl+url,depth)
-
-            if not self.regex.search(url):
-                continue
-            lastmod=xelem.find('{DAV:}propstat/{DAV:}prop/{DAV:}getlastmodified').text
-            mdate=isoParser(lastmod).replace(tzinfo=None)
-            
-            yield self.baseurl+url,mdate
+
+        if self.infinity and (depth is None or depth > 2):
+            try:
+                entries=self.propfind(urlin,"infinity")
+            except (pycurl.error,TransientHTTPError,CircuitOpen) as exc:
+                #e.g. a timeout or server error on the (expensive) infinite depth request
+                slurplog.info(f"Infinite depth listing failed ({exc})")
+                entries=None
+            if entries is not None:
+                for href,isdir,lastmod in entries:
+                    if self.isSelf(href,urlin) or not self.regex.search(href):
+                        continue
+                    if depth is None or self.relDepth(href) <= depth:
+                        yield self.entry(href,lastmod)
+                return
+            slurplog.info("No infinite depth listing available, walking the directories instead")
+
+        yield from self.walk(urlin,depth)
+
+    def walk(self,urlin,depth):
+        """Breadth-first walk through the collections with a bounded amount of concurrent PROPFIND requests"""
+        with ThreadPoolExecutor(max_workers=self.maxconn) as executor:
+            pending={executor.submit(self.propfind,urlin):(urlin,depth)}
+            while pending:
+                done,notdone=wait(pending,return_when=FIRST_COMPLETED)
+                for future in done:
+                    url,remaining=pending.pop(future)
+                    entries=future.result()
+                    if entries is None:
+                        raise RuntimeError(f"PROPFIND request failed for {url}")
+                    if remaining is not None:
+                        remaining-=1
+                    for href,isdir,lastmod in entries:
+                        if self.isSelf(href,url):
+                            continue
+                        if isdir and (remaining is None or remaining > 0):
+                            pending[executor.submit(self.propfind,self.baseurl+href)]=(self.baseurl+href,remaining)
+                        if self.regex.search(href):
+                            yield self.entry(href,lastmod)
 
 
     def uris(self):
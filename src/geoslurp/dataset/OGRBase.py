@@ -24,7 +24,9 @@ from geoslurp.db import tableMapFactory
 import re
 from zipfile import ZipFile
 import os
+from glob import glob
 from tqdm import tqdm
+from geoslurp.datapull.uri import findFiles
 
 class OGRBase(DataSet):
     """Base class which downloads a single OGR layer (e.g. shapefile) and registers it as a postgis table"""
@@ -127,15 +129,43 @@ class OGRBase(DataSet):
         return cols
     
     
+    def sourceFiles(self):
+        """Returns the files which make up the ogr source (e.g. including the sidecar files of a shapefile)"""
+        if os.path.isdir(self.ogrfile):
+            #e.g. a file geodatabase
+            return sorted(findFiles(self.ogrfile,'.*'))
+        base,ext=os.path.splitext(self.ogrfile)
+        if ext.lower() == '.shp':
+            return sorted(glob(base+'.*'))
+        return [self.ogrfile]
+
     def register(self):
         """Update/populate a database table (creates one if it doesn't exist)
         This function reads a shapefile and puts it in a single table.
         :param ogrfile: gdal dataset (e.g. shapefile)
         :param forceGType (optional): a geometry type to be used as the "geom" column
         :returns nothing (but sets the internal qlalchemy table)
+        Note: with incremental set, the register is skipped when none of the source files changed.
+        The features can't be related to a single source file (e.g. the sidecar files of a shapefile), so any change reloads the complete table
         """
-        # currently we can only cope with updating the entire table as a whole
-        self.db.dropTable(self.name,self.schema)
+        manifest=None
+        if self.incremental:
+            changed,removed,manifest=self.manifestChanges(self.sourceFiles())
+            if self.hasManifest() and not changed and not removed:
+                slurplogger().info(f"Source of {self.schema}.{self.name} is unchanged, skipping register")
+                return
+        
+        #identifies the input so an interrupted register can be resumed
+        inputhash=self.sourceHash(self.sourceFiles(),self.layerregex,self.targetsrid,manifest=manifest)
+        
+        # the features have no relation to the source file so we update the entire table as a whole
+        if self.resumeOffset(inputhash) > 0:
+            #keep the partially loaded table
+            self._shadow=self.shadowload
+        elif self.shadowload:
+            self.beginShadowLoad()
+        else:
+            self.db.dropTable(self.name,self.schema)
 
         slurplogger().info("Filling POSTGIS table %s.%s with data from %s" % (self.schema, self.name, self.ogrfile))
         
@@ -151,37 +181,37 @@ class OGRBase(DataSet):
 
         else:
             shpf=gdal.OpenEx(self.ogrfile,0)
-        count=0
-        for ithlayer in range(shpf.GetLayerCount()):
-            shpflayer=shpf.GetLayer(ithlayer)
-            if self.layerregex:
-                if not re.search(self.layerregex,shpflayer.GetName()):
-                    continue
-            sourceprj = shpflayer.GetSpatialRef()
-            if sourceprj.IsSame(self.targetprj):
-                transform=None
-            else:
-                transform = osr.CoordinateTransformation(sourceprj, self.targetprj)
-            # print(sourceprj)
-
-            # print(self.targetprj)
-            
-            # print(sourceprj.IsSame(self.targetprj))
-            for feat in tqdm(shpflayer,desc="Processing features"):
-                count+=1
-                if self.table == None:
-                    cols=self.columnsFromOgrFeat(feat)
-                    self.createTable(cols)
-                values=self.valuesFromOgrFeat(feat,transform)
-                try:
-                    self.addEntry(values)
-                except Exception as e:
-                    slurplogger().warning(e)
-                    breakpoint()
-                    pass
-                #commit every X times
-                
-
+        
+        def features():
+            for ithlayer in range(shpf.GetLayerCount()):
+                shpflayer=shpf.GetLayer(ithlayer)
+                if self.layerregex:
+                    if not re.search(self.layerregex,shpflayer.GetName()):
+                        continue
+                sourceprj = shpflayer.GetSpatialRef()
+                if sourceprj.IsSame(self.targetprj):
+                    transform=None
+                else:
+                    transform = osr.CoordinateTransformation(sourceprj, self.targetprj)
+                for feat in shpflayer:
+                    yield feat,transform
+
+        #checkpoint the progress so an interrupted register can be resumed
+        for feat,transform in tqdm(self.resumable(features(),inputhash=inputhash,key=lambda ft:str(ft[0].GetFID())),desc="Processing features"):
+            if self.table == None:
+                cols=self.columnsFromOgrFeat(feat)
+                self.createTable(cols)
+            values=self.valuesFromOgrFeat(feat,transform)
+            try:
+                self.addEntry(values)
+            except Exception as e:
+                slurplogger().error(f"Failed to add feature {feat.GetFID()} to {self.schema}.{self.name}: {e}")
+                raise
+
+        if self.shadowload:
+            self.finishShadowLoad()
+        if self.incremental:
+            self.updateManifest(manifest)
         #also update entry in the inventory table
         self.updateInvent()
 
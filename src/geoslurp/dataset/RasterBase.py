@@ -69,8 +69,34 @@ class RasterBase(DataSet):
     def register(self):
         """Checks the directory for updated raster files and updates them in the database"""
         #find all relevant files
-        newfiles=[UriFile(file) for file in findFiles(self.srcdir,self.rastregex)]
-        self.dropTable()
+        files=sorted(findFiles(self.srcdir,self.rastregex))
+        if self.incremental:
+            changed,removed,manifest=self.manifestChanges(files)
+        
+        if self.incremental and self.hasManifest() and not changed and not removed:
+            slurplogger().info(f"Raster files of {self.schema}.{self.name} are unchanged, skipping register")
+            return
+        elif self.incremental and self.hasManifest() and not self.tiles:
+            #only replace the rasters from changed and removed files
+            if self.table == None:
+                self.createTable(self.columns())
+            #the raster constraints will be recomputed after the update
+            self._ses.execute(
+                text("select DropRasterConstraints('%s'::name,'%s'::name,'rast'::name)"%(self.schema,self.name))
+            )
+            if self.stripuri:
+                stale=[self.conf.generalize_path(file) for file in changed+removed]
+            else:
+                stale=changed+removed
+            self._ses.execute(self.table.__table__.delete().where(self.table.uri.in_(stale)))
+            newfiles=[UriFile(file) for file in changed]
+        else:
+            newfiles=[UriFile(file) for file in files]
+            if self.shadowload:
+                self.beginShadowLoad()
+            else:
+                self.dropTable()
+        
         if self.tiles:
             #expand a single raster in tiles
             if len(newfiles) != 1:
@@ -96,40 +122,45 @@ class RasterBase(DataSet):
             trans.commit()
         else:
 
-            for uri in newfiles:
-                meta=self.rastExtract(uri)
-                if not meta:
-                    #don't register empty entries
-                    continue
-
+            for meta in self.extractParallel(newfiles,self.rastExtract):
                 if self.table == None:
                     #create the table when it does not exist
                     self.createTable(self.columns())
 
                 self.addEntry(meta)
-            self._ses.commit()
+            self.flushIngest()
 
+        #table which has been loaded (possibly a shadow table)
+        tblname=self.table.__table__.name
         #fix the srid
         if self.srid:
             self._ses.execute(
-                text("select UpdateRasterSRID('%s'::name,'%s'::name,'rast'::name,%d)"%(self.schema,self.name,self.srid))
+                text("select UpdateRasterSRID('%s'::name,'%s'::name,'rast'::name,%d)"%(self.schema,tblname,self.srid))
             )
 
         #add/compute raster constraints
         self._ses.execute(
-            text("select AddRasterConstraints('%s'::name,'%s'::name,'rast'::name)"%(self.schema,self.name))
+            text("select AddRasterConstraints('%s'::name,'%s'::name,'rast'::name)"%(self.schema,tblname))
         )
         if self.regularblocking:
             self._ses.execute(
-                text("select AddRasterConstraints('%s'::name,'%s'::name,'rast'::name,'regular_blocking')"%(self.schema,self.name))
+                text("select AddRasterConstraints('%s'::name,'%s'::name,'rast'::name,'regular_blocking')"%(self.schema,tblname))
             )
+        self._ses.commit()
+
+        if self._shadow:
+            self.finishShadowLoad()
 
         #create overviews
         if self.overviews:
             for factor in self.overviews:
+                #overviews need to be recomputed from the complete table
+                self._ses.execute(text("DROP TABLE IF EXISTS %s.o_%d_%s"%(self.schema,factor,self.name)))
                 self._ses.execute(text("select ST_CreateOverview('%s.%s'::regclass, 'rast', %d, 'Lanczos')"%(self.schema,self.name,factor)))
 
         self._ses.commit()
+        if self.incremental:
+            self.updateManifest(manifest)
         self.updateInvent()
 
     def rastExtract(self,uri):
@@ -152,7 +183,7 @@ class RasterBase(DataSet):
             #read the entire thing directly from gdal format
             with open(uri.url,'rb') as fid:
                 fbytes=fid.read()
-                return {"rast":func.ST_FromGDALRaster(fbytes,srid=self.srid)}
+                return {"rast":func.ST_FromGDALRaster(fbytes,srid=self.srid),"uri":uri.url}
 
     def rastFromRio(self,uri):
         
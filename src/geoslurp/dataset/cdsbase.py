@@ -72,7 +72,10 @@ class CDSBase(DataSet):
     def addRequest(self,name,requestdict,priority=0):
         self.reqdicts[name]=(priority,requestdict)
 
-    def pull(self,maxreq=10):
+    def pull(self,maxreq=10,maxdownload=4):
+        """Submit the CDS requests and download their results
+        :param maxreq: maximum number of requests which are queued at the CDS at the same time
+        :param maxdownload: maximum number of results which are downloaded concurrently"""
         dout=self.dataDir()
         if self.cdsalias is None:
             auth=None
@@ -80,52 +83,31 @@ class CDSBase(DataSet):
             #get url and api key from the database user
             auth=self.conf.authCred(self.cdsalias,qryfields=["apikey","url"])
         
-        cdsQueue=Cds(self.resource,self._dbinvent.data["cds_jobs"],auth=auth)
-        #add requests to the CDS queue
-        #Not it is expected that the derived class adds these requestdictionaries in one way or the other (default will be empty)
+        cdsQueue=Cds(self.resource,dict(self._dbinvent.data["cds_jobs"]),auth=auth)
+        #Note it is expected that the derived class adds these requestdictionaries in one way or the other (default will be empty)
         #sort requests by priority
         reqsorted=sorted(self.reqdicts.items(),key=lambda item:item[1][0])
-        #only submit maxreq at once
-        nreq=0
-        for name,(priority,reqdict) in reqsorted:
-
-            fout=os.path.join(dout,self.resource+"_"+name+self.app)
-            cdsQueue.queueRequest(fout,reqdict)
-            nreq+=1
-            if nreq > maxreq:
-                #do an intermediate download before submitting more requests
-                #Sync the possibly updated queueinfo to the database
-                self._dbinvent.data["cds_jobs"]=cdsQueue.jobqueue
-                self._ses.commit()
-        
-                #wait for tasks to finish and download results to files
-                cdsQueue.downloadQueue()
-                cdsQueue.clearRequests()
-                nreq=0
-
-        #download outstanding jobs
-        self._dbinvent.data["cds_jobs"]=cdsQueue.jobqueue
-        self._ses.commit()
+        requests=((os.path.join(dout,self.resource+"_"+name+self.app),reqdict) for name,(priority,reqdict) in reqsorted)
 
-        #wait for tasks to finish and download results to files
-        cdsQueue.downloadQueue()
+        def syncJobs(jobqueue):
+            #Sync the updated queueinfo to the database (so jobs can be picked up again after an interruption)
+            self._dbinvent.data["cds_jobs"]=dict(jobqueue)
+            self._ses.commit()
 
-        cdsQueue.clearRequests()
+        #submit requests while results of earlier requests are downloaded
+        nDownloaded,nFailed=cdsQueue.process(requests,maxreq=maxreq,maxdownload=maxdownload,onupdate=syncJobs)
+        syncJobs(cdsQueue.jobqueue)
+        if nFailed > 0:
+            slurplogger().error(f"{nFailed} CDS requests failed, {nDownloaded} results were downloaded")
 
     def register(self):
         if not self.table:
             #create a new table on the fly
             self.createTable(self.columns)
         
-        #create a list of files which need to be (re)registered
-        newfiles=self.retainnewUris([UriFile(file) for file in findFiles(self.dataDir(),f".*\{self.app}$")])
-        for uri in newfiles:
-            meta=self.metaExtractor(uri)
-            if not meta:
-                #don't register empty entries
-                continue
-            slurplogger().info(f"Adding metadata from {uri.url}")
-            self.addEntry(meta)
+        #stream batches of files which need to be (re)registered
+        for newfiles in self.iterNewUris(UriFile(file) for file in findFiles(self.dataDir(),f".*\{self.app}$")):
+            self.registerParallel(newfiles,self.metaExtractor)
         self._dbinvent.data["Description"]=self.description
         self.updateInvent()
 
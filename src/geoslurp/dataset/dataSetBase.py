@@ -20,16 +20,36 @@ import os
 from geoslurp.config.slurplogger import slurplogger
 import shutil
 import re
-from geoslurp.db import Inventory,Settings
+from geoslurp.db import Inventory,Settings,RunRecorder
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime,timedelta
-from sqlalchemy import Table,Column,Integer,String
+from sqlalchemy import Table,Column,Integer,String,MetaData,text
+from sqlalchemy.schema import CreateIndex
+from geoalchemy2.types import _GISType,Raster
 from sqlalchemy.dialects.postgresql import TIMESTAMP,insert
 from geoslurp.datapull import UriFile
+from geoslurp.datapull.validators import ValidatorStore
+from geoslurp.datapull.listingcache import listingCache
+from geoslurp.datapull.scheduler import hostScheduler
+from geoslurp.datapull.blobstore import blobStore
 from sqlalchemy import and_
 from geoslurp.db.settings import getCreateDir
 from geoslurp.db import tableMapFactory
 from geoslurp.db.exporter import exportQuery
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import queue
+from collections import deque
+import inspect
+import time
+from tqdm import tqdm
+from geoslurp.db.ingest import ingestEngine,CopyIngest
+from geoslurp.tools.filetools import sha256File
+import hashlib
+import json
+from itertools import islice
 
 def rmfilterdir(ddir,filter='*'):
     """Remove directories and files based on a certain regex filter"""
@@ -54,6 +74,20 @@ def rmfilterdir(ddir,filter='*'):
                     slurplogger().info("Removing %s"%(file))
                     os.remove(file)
 
+#dataset which is available in forked extraction workers
+_extractds=None
+
+def _initExtractWorker():
+    #a forked worker must not reuse the database connections of the parent process
+    if _extractds is not None and _extractds.db is not None:
+        _extractds.db.dbeng.dispose(close=False)
+
+def _extractWorker(extractor,uri):
+    if type(extractor) == str:
+        #method of the dataset (the dataset itself is not picklable)
+        extractor=getattr(_extractds,extractor)
+    return extractor(uri)
+
 class DataSet(ABC):
     """Abstract Base class which hold a dataset (corresponding to a database table"""
     table=None
@@ -64,6 +98,25 @@ class DataSet(ABC):
     updatefreq=None
     commitperN=500
     stripuri=False
+    #engine used by addEntry/bulkInsert: 'orm', 'copy' (COPY text format) or 'copybinary' (COPY binary format)
+    ingest='orm'
+    _ingester=None
+    incremental=False #only (re)register new or changed source files (see manifestChanges), datasets loaded from a single source (e.g. OGRBase, PandasBase) skip the register when it is unchanged and reload the table otherwise
+    manifesthash=False #also compare source files by their sha256 content hash
+    shadowload=False #load (dynamic) tables in a shadow table which replaces the live table when complete
+    extractworkers=1 #number of worker processes used by extractParallel (None uses all cpus), only raise this for datasets whose extracted rows are cheap to pickle
+    extractqueue=4 #number of pending extractions per worker
+    deferindexes=False #drop/postpone (non-constraint) indexes during bulk loads and rebuild them afterwards
+    clusteron=None #column (e.g. geom or time) whose index is used to CLUSTER the table during maintenance
+    postmaintenance=False #also run the (VACUUM ANALYZE) maintenance stage after every register (command line), e.g. for datasets which are always fully reloaded
+    checkpointN=100 #commit rows together with a checkpoint every so many items (see resumable)
+    pipelinequeue=64 #maximum number of downloaded files waiting to be registered in a pipelined run
+    _checkpoint=None
+    _validators=None
+    _blobstore=None
+    _shadow=False
+    _extractpool=None
+    _pipelining=False
 
     @classmethod
     def stname(cls):
@@ -79,6 +132,10 @@ class DataSet(ABC):
 
         self.name=self.tname()
         self.db=dbcon
+        #durations of the maintenance steps
+        self._maintenancetimings={}
+        #keep the listings of the crawlers in the geoslurp cache
+        listingCache(os.path.join(self.db.cache,".listings.sqlite"))
 
         #Initiate a session for keeping track of the inventory entry
         self._ses=self.db.Session()
@@ -101,6 +158,8 @@ class DataSet(ABC):
             self.exists=False
         #load user settings
         self.conf=Settings(self.db)
+        #apply the configured connection and rate limits per host
+        hostScheduler().fromSettings(self.conf)
         
         #possibly create the table when explictily provided
         # the table creation will be postponed when no explicit table is provided
@@ -109,7 +168,9 @@ class DataSet(ABC):
 
 
     def updateInvent(self,updateTime=True):
-        
+        #make sure all pending rows are written
+        self.flushIngest()
+        self.buildDeferredIndexes()
         if updateTime:
             self._dbinvent.lastupdate=datetime.now()
         self._dbinvent.updatefreq=self.updatefreq
@@ -127,6 +188,10 @@ class DataSet(ABC):
     # def info(self):
         # return self._dbinvent
 
+    def recordRun(self,phase):
+        """Returns a context manager which records performance metrics of a run (e.g. pull or register) in admin.runstats"""
+        return RunRecorder(self.db,self.schema,self.name,"dataset",phase)
+
     def isExpired(self):
         """Checks whether the table data is expired relative to to the updatefrequency"""
         if not self._dbinvent.updatefreq:
@@ -163,6 +228,36 @@ class DataSet(ABC):
     def setCacheDir(self,cdir):
         self._dbinvent.cache=cdir
         self.updateInvent(False)
+
+    def validatorStore(self):
+        """Returns the store with the download validators (ETag/Last-Modified) of this dataset"""
+        if self._validators is None:
+            self._validators=ValidatorStore(os.path.join(self.cacheDir(),".validators.sqlite"))
+        return self._validators
+    
+
+    def blobStore(self):
+        """Returns the content addressed store of downloads which is shared between datasets or None when it is not enabled
+        The store is enabled with the 'BlobStore' setting, which is either true (the store is then kept in the dataroot) or a directory"""
+        if self._blobstore is None:
+            try:
+                setting=self.conf["BlobStore"]
+            except RuntimeError:
+                setting=False
+            if not setting:
+                return None
+            root=setting if isinstance(setting,str) else os.path.join(self.db.localdataroot,".blobstore")
+            self._blobstore=blobStore(root)
+        return self._blobstore
+
+    def fetchUri(self,uri,direc,**kwargs):
+        """Downloads an uri into a directory when it is new or updated, through the blob store when enabled
+        :param kwargs: additional options for the download (e.g. outfile or segments)
+        :returns: the local UriFile and whether it was updated"""
+        store=self.blobStore()
+        if store is None:
+            return uri.download(direc,check=True,**kwargs)
+        return store.fetch(uri,direc,**kwargs)
     
 
     @abstractmethod
@@ -175,13 +270,144 @@ class DataSet(ABC):
         """Register the downloaded dataset in the database"""
         pass
 
+    def pullStream(self,**kwargs):
+        """Can be implemented to pull data as a stream: a generator of (UriFile,updated) tuples, e.g. from CrawlerBase.streamDownload (see pipeline)"""
+        raise NotImplementedError(f"{self.__class__.__name__} does not support pipelined pulls")
+
+    def registerStream(self,uris,**kwargs):
+        """Can be implemented to register an iterable of (UriFile,updated) tuples while they arrive (see pipeline)"""
+        raise NotImplementedError(f"{self.__class__.__name__} does not support pipelined registration")
+
+    def supportsPipeline(self):
+        cls=self.__class__
+        return cls.pullStream is not DataSet.pullStream and cls.registerStream is not DataSet.registerStream
+
+    def pipeline(self,pullopts=None,regopts=None):
+        """Pull and register at the same time: downloaded files are registered while the next ones are crawled and downloaded
+        Falls back to a pull followed by a register when the dataset does not implement pullStream and registerStream
+        :param pullopts: dictionary with options for the pull
+        :param regopts: dictionary with options for the register"""
+        pullopts=pullopts or {}
+        regopts=regopts or {}
+        if not self.supportsPipeline():
+            slurplogger().info(f"{self.__class__.__name__} does not support pipelining, pulling and registering sequentially")
+            self.pull(**pullopts)
+            self.register(**regopts)
+            return
+        self._pipelining=True
+        try:
+            self.registerStream(self.pipelineQueue(self.pullStream(**pullopts)),**regopts)
+        finally:
+            self._pipelining=False
+
+    def pipelineQueue(self,items,queuesize=None):
+        """Consumes an iterable in a background thread and yields its items through a bounded queue (generator)
+        The producer blocks when the queue is full, which throttles the crawling and downloading to the pace of the registration
+        :param queuesize: maximum number of waiting items (defaults to pipelinequeue)"""
+        if queuesize is None:
+            queuesize=self.pipelinequeue
+        fifo=queue.Queue(maxsize=queuesize)
+        stop=threading.Event()
+        done=object()
+        failure=[]
+        def put(item):
+            #don't block forever when the consumer has stopped
+            while not stop.is_set():
+                try:
+                    fifo.put(item,timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for item in items:
+                    if not put(item):
+                        break
+            except BaseException as exc:
+                failure.append(exc)
+            finally:
+                put(done)
+                if hasattr(items,"close"):
+                    items.close()
+
+        producer=threading.Thread(target=produce,name="pipeline-producer",daemon=True)
+        producer.start()
+        try:
+            while True:
+                item=fifo.get()
+                if item is done:
+                    break
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+        if failure:
+            raise failure[0]
+
+    def fileSignature(self,path,previous=None):
+        """Returns the size, modification time and (optionally) the sha256 hash of a source file"""
+        st=os.stat(path)
+        sig={"size":st.st_size,"mtime":st.st_mtime}
+        if self.manifesthash:
+            if previous and "sha256" in previous and previous["size"] == sig["size"] and previous["mtime"] == sig["mtime"]:
+                #no need to rehash
+                sig["sha256"]=previous["sha256"]
+            else:
+                sig["sha256"]=sha256File(path)
+        return sig
+
+    def manifestChanges(self,paths):
+        """Compares source files with the manifest stored in the inventory
+        :param paths: iterable with paths of the source files
+        :returns: list of new or changed files, list of removed files and the new manifest"""
+        old=self._dbinvent.data.get("manifest",{})
+        manifest={}
+        changed=[]
+        for path in paths:
+            prev=old.get(path)
+            sig=self.fileSignature(path,prev)
+            manifest[path]=sig
+            if prev is None:
+                changed.append(path)
+            elif "sha256" in sig and "sha256" in prev:
+                if sig["sha256"] != prev["sha256"]:
+                    changed.append(path)
+            elif sig["size"] != prev["size"] or sig["mtime"] != prev["mtime"]:
+                changed.append(path)
+
+        removed=[path for path in old if path not in manifest]
+        slurplogger().info(f"Manifest check: {len(changed)} new or changed, {len(removed)} removed, {len(manifest)-len(changed)} unchanged source files")
+        return changed,removed,manifest
+
+    def hasManifest(self):
+        """Returns True when a manifest of the source files and the table are available"""
+        return "manifest" in self._dbinvent.data and self.db.tableExists(f"{self.schema}.{self.name}")
+
+    def updateManifest(self,manifest):
+        """Sets the manifest of the registered source files (stored with the next updateInvent)"""
+        self._dbinvent.data["manifest"]=manifest
+
     def purgedata(self,filter='*'):
         """Deletes the data directory of the dataset,optionally applying a directory/filename filter"""
         rmfilterdir(self.dataDir(),filter)
 
     def purgecache(self,filter='*'):
         """Deletes the cache directory of the dataset, optionally applying a directory/filename filter"""
-        rmfilterdir(self.cacheDir(),filter)
+        cdir=self.cacheDir()
+        rmfilterdir(cdir,filter)
+        if filter == '*':
+            self.conf.cacheManager().forget(cdir)
+
+    def enforceCacheQuota(self):
+        """Evicts least recently used cache entries of other datasets when the cache exceeds its quota"""
+        cachemanager=self.conf.cacheManager()
+        if not cachemanager.enabled():
+            return
+        evicted=cachemanager.enforce(keep=[self.cacheDir()])
+        if evicted > 0:
+            slurplogger().info(f"Evicted {evicted/1024**2:.1f} MB from the cache")
 
     def purgeentry(self):
         """Delete dataset entry in the database"""
@@ -192,82 +418,95 @@ class DataSet(ABC):
 
     def halt(self):
         """can be overridden to properly clean up an aborted operation"""
-        pass
+        if self._checkpoint is not None:
+            #discard the rows which were added after the last committed checkpoint
+            self._ses.rollback()
+            self._ingester=None
+            cp=self._dbinvent.data.get("checkpoint")
+            if cp:
+                slurplogger().warning(f"Register interrupted, a next register will resume after item {cp['offset']} ({cp['lastitem']})")
+            self._checkpoint=None
 
     def uriNeedsUpdate(self, urilikestr,lastmod):
-        """Query for a URI in the table based on a alike string and delete the entry when older than lastmod"""
-        needsupdate=True
-        try:
-            qResults=self._ses.query(self.table).filter(self.table.uri.like('%'+urilikestr+'%'))
-            if qResults.count() == 0:
-                return True
-            needsupdate=False
-            #check if at least one needs updating
-            for qres in qResults:
-                if qres.lastupdate < lastmod:
-                    needsupdate=True
-                    break
-
-            if needsupdate:
-                for qres in qResults:
-                    #delete the entries which need updating
-                    self._ses.delete(qres)
-                    self._ses.commit()
-            else:
-                slurplogger().info("No Update needed, skipping %s"%(urilikestr))
-
-        except Exception as e:
-            # Fine no entries found
-            pass
-        return needsupdate
+        """Query for a URI in the table based on a alike string and delete the entry when older than lastmod
+        (note: use entriesNeedUpdate when many uris need to be checked)"""
+        return self.entryNeedsUpdate(urilikestr,lastmod)
 
     def retainnewUris(self,urilist):
-        """Filters those uris which have table entries which are too old or are not present in the database"""
-        #create a temporary table with uri and lastmodification time entries
-        cols=[Column('id', Integer, primary_key=True),Column('uri',String),Column('lastmod',TIMESTAMP)]
-
-        #setup a seperate session  and transaction in order to work with a temporary table
+        """Filters those uris which have table entries which are too old or are not present in the database (returns a list)"""
+        return [uri for batch in self.iterNewUris(urilist) for uri in batch]
+
+    def iterNewUris(self,urilist,batchsize=None):
+        """Generator which yields batches (lists) of uris which have table entries which are too old or are not present in the database
+        Outdated table entries are deleted.
+        :param urilist: iterable (e.g. generator) of UriFile's
+        :param batchsize: size of the yielded lists (defaults to commitperN)"""
+        if batchsize is None:
+            batchsize=self.commitperN
+        tbl=f"{self.schema}.{self.name}"
+        #make sure the uri lookups are backed by an index
+        if not self.ensureIndex("uri"):
+            #no table yet: all uris are new
+            urilist=iter(urilist)
+            while True:
+                batch=list(islice(urilist,batchsize))
+                if not batch:
+                    return
+                yield batch
+
+        #setup a seperate session and transaction in order to work with a temporary table
         trans,ses=self.db.transsession()
-        
-        tmptable=self.db.createTable('public.tmpuris',cols,temporary=True,bind=ses.get_bind())
-        # tmptable=self.db.createTable('tmpuris',cols,temporary=False,bind=ses.get_bind())
-        # import pdb;pdb.set_trace()
-        #fill the table with the file list and last modification timsstamps
-        count=0
-        for uri in urilist:
-            if self.stripuri:
-                url=self.conf.generalize_path(uri.url)
-            else:
-                url=uri.url
-
-            entry=tmptable(uri=url,lastmod=uri.lastmod)
-            ses.add(entry)
-            count+=1
-            if count > self.commitperN:
-                ses.commit()
-                count=0
-
-        ses.commit()
-        #delete all entries which require updating
-        # first gather all the ids of i entries which are expired 
-        subqry=ses.query(self.table.id).join(tmptable, and_(tmptable.uri == self.table.uri,tmptable.lastmod > self.table.lastupdate)).subquery()
-        # #then delete those entries from the table
-        delqry=self.table.__table__.delete().where(self.table.id.in_(subqry))
-        ses.execute(delqry)
-        ses.commit()
-        #now make a list of new uris
-        qrynew=ses.query(tmptable).outerjoin(self.table,self.table.uri == tmptable.uri).filter(self.table.uri == None)
-
-        #submit transaction
-        trans.commit()
-
-        # import pdb;pdb.set_trace()
-        #return entried which need updating he entries in the original table which need updating
-        return [UriFile(self.conf.get_local_path(x.uri),x.lastmod) for x in qrynew]
-
+        conn=trans.connection
+        try:
+            conn.execute(text("CREATE TEMPORARY TABLE tmpuris (uri text, lastmod timestamp) ON COMMIT PRESERVE ROWS;"))
+            tmptable=Table("tmpuris",MetaData(),Column('uri',String),Column('lastmod',TIMESTAMP))
+            #stream the uris and modification times to the temporary table
+            loader=CopyIngest(tmptable,ses,fmt='text')
+            loader.autocommit=False
+            for uri in urilist:
+                if self.stripuri:
+                    url=self.conf.generalize_path(uri.url)
+                else:
+                    url=uri.url
+                loader.add({"uri":url,"lastmod":uri.lastmod})
+            loader.write()
+            conn.execute(text("CREATE INDEX ON tmpuris (uri);"))
+            conn.execute(text("ANALYZE tmpuris;"))
+
+            #delete all entries which require updating
+            ndel=conn.execute(text(f"DELETE FROM {tbl} t USING tmpuris tmp WHERE t.uri = tmp.uri AND tmp.lastmod > t.lastupdate;")).rowcount
+            #retain only the uris which are not (anymore) in the table
+            conn.execute(text(f"DELETE FROM tmpuris tmp USING {tbl} t WHERE t.uri = tmp.uri;"))
+            ses.close()
+            #submit transaction (the temporary table persists on this connection)
+            trans.commit()
+            slurplogger().info(f"Checked {loader.nrows} uris, removed {ndel} outdated entries")
+
+            #stream the new uris in batches using a server side cursor
+            with conn.begin():
+                res=conn.execution_options(stream_results=True).execute(text("SELECT uri,lastmod FROM tmpuris;"))
+                for part in res.partitions(batchsize):
+                    yield [UriFile(self.conf.get_local_path(x.uri),x.lastmod) for x in part]
+        finally:
+            if trans.is_active:
+                trans.rollback()
+            conn.execute(text("DROP TABLE IF EXISTS tmpuris;"))
+            conn.commit()
+            conn.close()
+
+
+    def ensureIndex(self,col,method="btree",opclass=None,name=None):
+        """Create an index on a column of the table, unless the column is already indexed (e.g. because it is unique)
+        :returns: False when the table does not exist (yet)"""
+        if not self.db.tableExists(f"{self.schema}.{self.name}"):
+            return False
+        if self.db.indexOnColumn(self.name,self.schema,col,opclass=opclass) is None:
+            self.db.createIndex(self.name,self.schema,col,method=method,opclass=opclass,name=name)
+        return True
 
     def entryNeedsUpdate(self,likestr,lastmod,col=None):
-        """Query for a Columns in the table based on a alike string and delete the entry when older than lastmod"""
+        """Query for a Columns in the table based on a alike string and delete the entry when older than lastmod
+        (note: use entriesNeedUpdate when many entries need to be checked)"""
         needsupdate=True
         try:
             if not col:
@@ -295,21 +534,279 @@ class DataSet(ABC):
             pass
         return needsupdate
 
-    def addEntry(self,metadict):
-        if self.stripuri and "uri" in metadict:
-            metadict["uri"]=self.conf.generalize_path(metadict["uri"])
+    def entriesNeedUpdate(self,keylastmod,col=None,exact=True,index=False):
+        """Batch check of which entries in the table need to be (re)registered
+        Table entries which are older than the provided modification time are deleted
+        :param keylastmod: iterable of (key,lastmod) tuples
+        :param col: name of the column (or column) to compare the keys with (defaults to uri)
+        :param exact: match keys exactly (btree index) or as a substring of the column
+        :param index: create a trigram index for substring matching (requires the pg_trgm extension)
+        :returns: a set with the keys which are new or outdated"""
+        if col is None:
+            col="uri"
+        elif not isinstance(col,str):
+            col=col.name
+        tbl=f"{self.schema}.{self.name}"
+        if exact:
+            exists=self.ensureIndex(col)
+            cond=f"t.{col} = k.key"
+        else:
+            if index:
+                exists=self.ensureIndex(col,method="gin",opclass="gin_trgm_ops",name=f"{self.name}_{col}_trgm_idx")
+            else:
+                exists=self.db.tableExists(tbl)
+            cond=f"t.{col} LIKE '%' || k.key || '%'"
+        if not exists:
+            #no table yet: all entries need to be registered
+            return set(key for key,lastmod in keylastmod)
 
-        entry=self.table(**metadict)
+        trans,ses=self.db.transsession()
+        conn=trans.connection
+        try:
+            conn.execute(text("CREATE TEMPORARY TABLE tmpkeys (key text, lastmod timestamp) ON COMMIT DROP;"))
+            tmptable=Table("tmpkeys",MetaData(),Column('key',String),Column('lastmod',TIMESTAMP))
+            loader=CopyIngest(tmptable,ses,fmt='text')
+            loader.autocommit=False
+            for key,lastmod in keylastmod:
+                loader.add({"key":key,"lastmod":lastmod})
+            loader.write()
+            conn.execute(text("CREATE INDEX ON tmpkeys (key);"))
+            conn.execute(text("ANALYZE tmpkeys;"))
+
+            #find the outdated keys, delete the corresponding entries and add the keys which have no entries (single round trip)
+            qry=f"WITH stale AS (SELECT DISTINCT k.key FROM tmpkeys k JOIN {tbl} t ON {cond} WHERE t.lastupdate < k.lastmod), " \
+                    f"deleted AS (DELETE FROM {tbl} t USING stale k WHERE {cond}) " \
+                    f"SELECT key FROM stale UNION SELECT k.key FROM tmpkeys k WHERE NOT EXISTS (SELECT 1 FROM {tbl} t WHERE {cond});"
+            needupdate=set(row.key for row in conn.execute(text(qry)))
+            ses.close()
+            trans.commit()
+        except SQLAlchemyError:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+        slurplogger().info(f"{len(needupdate)} out of {loader.nrows} entries need updating")
+        return needupdate
+
+    def extractParallel(self,uris,extractor,nworkers=None,withuri=False):
+        """Generator which applies an extractor to uris in a pool of worker processes and yields the non-empty results in order
+        The results are meant to be consumed (e.g. by addEntry) in the main process
+        :param uris: iterable of uris
+        :param extractor: picklable function or a method of this dataset which returns a dictionary (or None) from an uri
+        :param nworkers: amount of worker processes (defaults to extractworkers)
+        :param withuri: yield (uri,result) tuples for all uris (result is None when empty or failed)"""
+        global _extractds
+        if nworkers is None:
+            nworkers=self.extractworkers if self.extractworkers else os.cpu_count()
+        if nworkers > 1 and self._pipelining:
+            #forking while the pipeline threads (e.g. curl transfers) hold locks can deadlock the workers
+            slurplogger().info("Extracting metadata in the main process while pipelining")
+            nworkers=1
         
+        if inspect.ismethod(extractor) and extractor.__self__ is self:
+            extractor=extractor.__name__
+        
+        try:
+            total=len(uris)
+        except TypeError:
+            total=None
+        
+        nerr=0
+        with tqdm(total=total,desc="Extracting metadata") as pbar:
+            if nworkers <= 1:
+                #restore the dataset of a possibly existing pool afterwards
+                prevds=_extractds
+                _extractds=self
+                try:
+                    for uri in uris:
+                        pbar.update(1)
+                        try:
+                            meta=_extractWorker(extractor,uri)
+                        except Exception as exc:
+                            nerr+=1
+                            slurplogger().error(f"Failed to extract {uri.url}: {exc}")
+                            meta=None
+                        if withuri:
+                            yield uri,meta
+                        elif meta:
+                            yield meta
+                finally:
+                    _extractds=prevds
+            else:
+                pool=self.extractPool(nworkers)
+                uriiter=iter(uris)
+                inflight=deque()
+                def submit():
+                    try:
+                        uri=next(uriiter)
+                    except StopIteration:
+                        return
+                    inflight.append((uri,pool.submit(_extractWorker,extractor,uri)))
+                
+                #keep a bounded amount of extractions in flight
+                for i in range(nworkers*self.extractqueue):
+                    submit()
+                while inflight:
+                    uri,fut=inflight.popleft()
+                    submit()
+                    pbar.update(1)
+                    try:
+                        meta=fut.result()
+                    except Exception as exc:
+                        nerr+=1
+                        slurplogger().error(f"Failed to extract {uri.url}: {exc}")
+                        meta=None
+                    if withuri:
+                        yield uri,meta
+                    elif meta:
+                        yield meta
+        if nerr > 0:
+            slurplogger().warning(f"Metadata extraction failed for {nerr} files")
+
+    def extractPool(self,nworkers):
+        """Returns the pool of extraction worker processes, which is created once and reused by the batches of a register (see closeExtractPool)"""
+        global _extractds
+        if self._extractpool is not None and self._extractpool._max_workers != nworkers:
+            self.closeExtractPool()
+        if self._extractpool is None:
+            #fork so the workers inherit the dataset
+            _extractds=self
+            self._extractpool=ProcessPoolExecutor(nworkers,mp_context=multiprocessing.get_context("fork"),initializer=_initExtractWorker)
+        return self._extractpool
+
+    def closeExtractPool(self):
+        """Shuts down the pool of extraction workers (e.g. after a register)"""
+        global _extractds
+        if self._extractpool is not None:
+            self._extractpool.shutdown()
+            self._extractpool=None
+        if _extractds is self:
+            _extractds=None
+
+    def registerParallel(self,uris,extractor,nworkers=None,resumable=False):
+        """Extract metadata from uris in parallel and add the results to the table
+        :param resumable: checkpoint the progress so an interrupted register can be resumed
+        Note: the checkpoint is tied to the exact list of uris, so don't combine it with uris filtered by iterNewUris/retainnewUris (which already skip the registered uris)"""
+        if not resumable:
+            for meta in self.extractParallel(uris,extractor,nworkers):
+                self.addEntry(meta)
+            return
+        
+        uris=self.startCheckpoint(uris,key=lambda uri:uri.url)
+        for uri,meta in self.extractParallel(uris,extractor,nworkers,withuri=True):
+            if meta:
+                self.addEntry(meta)
+            self.checkpoint(uri.url)
+        self.clearCheckpoint()
+
+    def sourceHash(self,paths,*extra,manifest=None):
+        """Returns a hash which identifies the state of a set of source files (e.g. to validate a checkpoint)
+        :param manifest: reuse the file signatures of a manifest (see manifestChanges) instead of computing them again"""
+        state=[[path,manifest[path] if manifest and path in manifest else self.fileSignature(path)] for path in paths]+list(extra)
+        return hashlib.sha256(json.dumps(state,default=str).encode('utf-8')).hexdigest()
+
+    def startCheckpoint(self,items,inputhash=None,key=None):
+        """Start a checkpointed run and return the items which still need to be processed
+        :param items: items to process (this is converted to a list when no inputhash is given)
+        :param inputhash: hash which identifies the input set (computed from the keys of the items when not given)
+        :param key: function which returns a string identifier of an item (defaults to str)"""
+        if key is None:
+            key=str
+        if inputhash is None:
+            items=list(items)
+            inputhash=hashlib.sha256("\n".join([key(item) for item in items]).encode('utf-8')).hexdigest()
+        
+        offset=0
+        cp=self._dbinvent.data.get("checkpoint")
+        if cp and cp["inputhash"] == inputhash:
+            offset=cp["offset"]
+            slurplogger().info(f"Resuming register after item {offset} ({cp['lastitem']})")
+        elif cp:
+            slurplogger().info("Input changed since the last checkpoint, not resuming")
+        self._checkpoint={"inputhash":inputhash,"offset":offset,"lastitem":None}
+        self._sincecheckpoint=0
+        #rows are only committed together with a checkpoint
+        if self._ingester is not None:
+            self._ingester.autocommit=False
+        
+        if offset == 0:
+            return items
+        elif type(items) == list:
+            return items[offset:]
+        else:
+            return islice(items,offset,None)
+
+    def resumeOffset(self,inputhash):
+        """Returns the offset of a stored checkpoint which matches the inputhash (or 0)"""
+        cp=self._dbinvent.data.get("checkpoint")
+        if cp and cp["inputhash"] == inputhash:
+            return cp["offset"]
+        return 0
+
+    def checkpoint(self,lastitem=None):
+        """Mark an item as completely processed (rows and checkpoint are committed every checkpointN items)"""
+        self._checkpoint["offset"]+=1
+        if lastitem is None:
+            lastitem=str(self._checkpoint["offset"])
+        self._checkpoint["lastitem"]=lastitem
+        self._sincecheckpoint+=1
+        if self._sincecheckpoint >= self.checkpointN:
+            self.commitCheckpoint()
+
+    def commitCheckpoint(self):
+        """Commit the rows together with the checkpoint in one transaction"""
+        if self._ingester is not None:
+            self._ingester.write()
+        self._dbinvent.data["checkpoint"]=dict(self._checkpoint,time=datetime.now().isoformat())
+        self._ses.commit()
+        self._sincecheckpoint=0
+
+    def clearCheckpoint(self):
+        """Finish a checkpointed run"""
+        if "checkpoint" in self._dbinvent.data:
+            del self._dbinvent.data["checkpoint"]
+        self._checkpoint=None
+        self.flushIngest()
+        self._ses.commit()
 
-        self._ses.add(entry)
+    def resumable(self,items,inputhash=None,key=None):
+        """Generator which yields the items which still need to be processed, while checkpointing the progress
+        An item is considered processed when the next item is requested, so this is suited for serial loops
+        :param items: (iterable) of items
+        :param inputhash: hash which identifies the input set (computed from the keys of the items when not given)
+        :param key: function which returns a string identifier of an item (defaults to str when no inputhash is given)"""
+        for item in self.startCheckpoint(items,inputhash,key):
+            yield item
+            if key is None:
+                self.checkpoint()
+            else:
+                self.checkpoint(key(item))
+        self.clearCheckpoint()
+
+    def ingester(self):
+        """Returns the ingest engine which writes rows to the table of this dataset"""
+        if self._ingester is None:
+            if self.deferindexes and not "deferredindexes" in self._dbinvent.data:
+                self.deferIndexes()
+            self._ingester=ingestEngine(self.ingest,self.table,self._ses,self.commitperN)
+            if self._checkpoint is not None:
+                #rows are only committed together with a checkpoint
+                self._ingester.autocommit=False
+        return self._ingester
+
+    def flushIngest(self):
+        """Write all pending rows of the ingest engine to the database and commit"""
+        if self._ingester is None:
+            return
+        self._ingester.flush()
+        self._ingester.report()
+        self._ingester=None
 
-        if self.commitCounter > self.commitperN:
-            # commit every so many rows
-            self._ses.commit()
-            self.commitCounter=0
-        else:
-            self.commitCounter+=1
+    def addEntry(self,metadict):
+        if self.stripuri and "uri" in metadict:
+            metadict["uri"]=self.conf.generalize_path(metadict["uri"])
+        
+        self.ingester().add(metadict)
     
     def upsertEntry(self,metadict,index_elements):
         if self.stripuri and "uri" in metadict:
@@ -321,7 +818,7 @@ class DataSet(ABC):
 
     def bulkInsert(self,dictlist):
         """Insert a  list of dicts in bulk mode"""
-        self._ses.bulk_insert_mappings(self.table,dictlist)
+        self.ingester().bulk(dictlist)
 
 
     def truncateTable(self):
@@ -333,15 +830,41 @@ class DataSet(ABC):
         if not self.db.schemaexists(self.schema):
             self.db.CreateSchema(self.schema)
         
+        #pending rows belong to the previous table definition
+        self.flushIngest()
+
         if self.table == None:
             if cols == None:
                 raise RuntimeError("Creating a dynamic table requires the specification of columns")
 
+            if self._shadow:
+                name=self.shadowName()
+            else:
+                name=self.name
             
-
-            self.table=Table(self.name, self.db.mdata, *cols, schema=self.schema,extend_existing=True)
+            defer=self._shadow or self.deferindexes
+            gistcols=[]
+            if defer:
+                #postpone the creation of spatial indexes until the table is loaded
+                for col in cols:
+                    if isinstance(col.type,_GISType) and col.type.spatial_index:
+                        col.type.spatial_index=False
+                        gistcols.append(col)
+
+            self.table=Table(name, self.db.mdata, *cols, schema=self.schema,extend_existing=True)
+            if defer:
+                #also postpone the creation of other indexes
+                idxdefs=[str(CreateIndex(idx).compile(dialect=self.db.dbeng.dialect)) for idx in self.table.indexes]
+                self.table.indexes.clear()
+                for col in gistcols:
+                    if isinstance(col.type,Raster):
+                        expr=f"ST_ConvexHull({col.name})"
+                    else:
+                        expr=col.name
+                    idxdefs.append(f"CREATE INDEX idx_{name}_{col.name} ON {self.schema}.{name} USING gist ({expr})")
+                self.addDeferredIndexes(idxdefs)
             self.table.create(bind=self.db.dbeng,checkfirst=True)
-            tableMap=tableMapFactory(self.name,self.table)
+            tableMap=tableMapFactory(name,self.table)
             self.table=tableMap
         else:
             if cols != None:
@@ -354,8 +877,99 @@ class DataSet(ABC):
             session.commit()
 
     def dropTable(self):
+        #discard the ingest engine (pending rows are lost with the table)
+        if self._ingester is not None:
+            self._ses.rollback()
+            self._ingester=None
         self.db.dropTable(self.name,self.schema.lower())
 
+    def shadowName(self):
+        return self.name+"_gsshadow"
+
+    def beginShadowLoad(self):
+        """Start loading into a shadow table, while the live table stays available for readers"""
+        if type(self).table is not None:
+            raise RuntimeError("Shadow loading is only supported for dynamically created tables")
+        #remove remains of an aborted load
+        self.db.dropTable(self.shadowName(),self.schema)
+        self.table=None
+        self._shadow=True
+
+    def finishShadowLoad(self):
+        """Build the postponed indexes of the shadow table, analyze it and swap it with the live table"""
+        self.flushIngest()
+        shadow=self.table.__table__
+        self.buildDeferredIndexes()
+        self.db.execute(f"ANALYZE {self.schema}.{shadow.name};")
+        slurplogger().info(f"Swapping loaded table into {self.schema}.{self.name}")
+        self.db.swapTable(shadow.name,self.name,self.schema)
+        self._shadow=False
+        
+        #map the table on its final name
+        mdata=self.db.mdata
+        if shadow.fullname in mdata.tables:
+            mdata.remove(shadow)
+        if f"{self.schema}.{self.name}" in mdata.tables:
+            mdata.remove(mdata.tables[f"{self.schema}.{self.name}"])
+        self.table=tableMapFactory(self.name,shadow.to_metadata(mdata,name=self.name))
+
+    def addDeferredIndexes(self,idxdefs):
+        """Register index definitions which will be created after the load (kept in the inventory so they survive an aborted load)"""
+        self._dbinvent.data["deferredindexes"]=self._dbinvent.data.get("deferredindexes",[])+idxdefs
+        self._ses.commit()
+
+    def deferIndexes(self):
+        """Drop the indexes (which don't back a constraint) of the table, so they can be rebuilt after a bulk load"""
+        tbl=self.table.__table__.name
+        qry=text("SELECT i.indexname, i.indexdef FROM pg_indexes i WHERE i.schemaname = :schema AND i.tablename = :table " \
+                "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = (quote_ident(i.schemaname)||'.'||quote_ident(i.indexname))::regclass)")
+        with self.db.dbeng.connect() as conn:
+            indexes=conn.execute(qry,{"schema":self.schema.lower(),"table":tbl}).all()
+        self.addDeferredIndexes([idx.indexdef for idx in indexes])
+        for idx in indexes:
+            slurplogger().info(f"Dropping index {idx.indexname} during the load")
+            self.db.execute(f"DROP INDEX IF EXISTS {self.schema}.{idx.indexname};")
+
+    def buildDeferredIndexes(self):
+        """Create the indexes which have been postponed during a load"""
+        if not "deferredindexes" in self._dbinvent.data:
+            return
+        t0=time.perf_counter()
+        for idxdef in self._dbinvent.data["deferredindexes"]:
+            slurplogger().info(f"Building index: {idxdef}")
+            self.db.execute(re.sub(r"^CREATE (UNIQUE )?INDEX ",r"CREATE \1INDEX IF NOT EXISTS ",idxdef))
+        del self._dbinvent.data["deferredindexes"]
+        self._ses.commit()
+        self._maintenancetimings["indexes"]=time.perf_counter()-t0
+
+    def maintenance(self,vacuum=True,cluster=None):
+        """Post-load maintenance of the table: build postponed indexes, optionally CLUSTER and VACUUM ANALYZE
+        :param vacuum: run VACUUM ANALYZE so the query planner has fresh statistics
+        :param cluster: column (e.g. geom or time) whose index is used to physically order the table (defaults to clusteron)"""
+        if not self.db.tableExists(f"{self.schema}.{self.name}"):
+            return
+        self.buildDeferredIndexes()
+        if cluster is None:
+            cluster=self.clusteron
+        if cluster:
+            idxname=self.db.indexOnColumn(self.name,self.schema,cluster)
+            if idxname:
+                slurplogger().info(f"Clustering {self.schema}.{self.name} on {idxname}")
+                t0=time.perf_counter()
+                self.db.execute(f"CLUSTER {self.schema}.{self.name} USING {idxname};")
+                self._maintenancetimings["cluster"]=time.perf_counter()-t0
+            else:
+                slurplogger().warning(f"No index found on column {cluster}, not clustering {self.schema}.{self.name}")
+        if vacuum:
+            slurplogger().info(f"Vacuum analyze {self.schema}.{self.name}")
+            t0=time.perf_counter()
+            self.db.vacuumAnalyze(self.name,self.schema)
+            self._maintenancetimings["vacuumanalyze"]=time.perf_counter()-t0
+        
+        self._dbinvent.data["maintenance"]={"lastrun":datetime.now().isoformat(),"timings":self._maintenancetimings}
+        self._maintenancetimings={}
+        self.updateInvent(False)
+
     def migrate(self,version):
         """Properly migrate a table between software versions
         (note this function is supposed to be overridden in a derived class)"""
@@ -35,6 +35,7 @@ from geoslurp.datapull import findFiles,UriFile
 from geoslurp.config.slurplogger import slurplogger
 from geoslurp.dataset.RasterBase import RasterBase
 import copy
+from concurrent.futures import ThreadPoolExecutor
 from dateutil.parser import parse
 
 class MotuGridsBase(RasterBase):
@@ -49,6 +50,8 @@ class MotuGridsBase(RasterBase):
     authalias=None
     #the variable of interest to retrieve
     variables=None
+    #maximum number of concurrent motu requests
+    maxconn=4
     def __init__(self,dbconn):
         super().__init__(dbconn)
 
@@ -99,21 +102,31 @@ class MotuGridsBase(RasterBase):
             mOptsleft.syncbtdbox(bboxleft)
             mOptsleft.syncfilename(ncoutleft)
 
-            MotuRecleft=MotuRecursive(mOptsleft)
-            urileft,updleft=MotuRecleft.download()
+            MotuRecleft=MotuRecursive(mOptsleft,maxconn=self.maxconn)
 
             ncoutright=os.path.join(self.cacheDir(),name+"_right.nc")
             mOptsright=copy.deepcopy(mOpts)
             mOptsright.syncbtdbox(bboxright)
             mOptsright.syncfilename(ncoutright)
 
-            MotuRecright=MotuRecursive(mOptsright)
-            uriright,updright=MotuRecright.download()
-
-            stackNcFiles(ncout,urileft.url,uriright.url,'longitude')
-            if updleft or updright:
+            MotuRecright=MotuRecursive(mOptsright,maxconn=self.maxconn)
+
+            #download (the tiles of) both halves concurrently, the merging happens in this thread
+            with ThreadPoolExecutor(max_workers=self.maxconn) as executor:
+                MotuRecleft.submit(executor)
+                MotuRecright.submit(executor)
+                try:
+                    urileft,updleft=MotuRecleft.merge()
+                    uriright,updright=MotuRecright.merge()
+                except Exception:
+                    MotuRecleft.cancel()
+                    MotuRecright.cancel()
+                    raise
+
+            if updleft or updright or not os.path.exists(ncout):
                 #change the longitude representation to -180..0 (without reshuffeling the data
-                ncSwapLongitude(urileft.url)
+                if updleft:
+                    ncSwapLongitude(urileft.url)
                 # patch files
                 uri,upd=stackNcFiles(ncout,urileft.url,uriright.url,'longitude')
             else:
@@ -122,7 +135,7 @@ class MotuGridsBase(RasterBase):
         else:
             #we can handle this by a single recursive motu instance
 
-            MotuRec=MotuRecursive(mOpts)
+            MotuRec=MotuRecursive(mOpts,maxconn=self.maxconn)
             uri,upd=MotuRec.download()
 
         if upd:
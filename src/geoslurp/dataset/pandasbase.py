@@ -123,7 +123,10 @@ class PandasBase(DataSet):
     def registerInDatabase(self,df):
         self.setGeoInfo(df)        
         
-        self.dropTable()
+        if self.shadowload:
+            self.beginShadowLoad()
+        else:
+            self.dropTable()
         if self.table == None:
             cols=self.columnsFromDataframe(df)
             self.createTable(cols)
@@ -147,9 +150,20 @@ class PandasBase(DataSet):
         if self.inbulk:
             self.bulkInsert(bulk)
 
+        if self._shadow:
+            self.finishShadowLoad()
+
     def register(self,df=None):
         """Update/populate a database table from a pandas compatible file) 
+        Note: with incremental set, the register is skipped when the file is unchanged, a changed file reloads the complete table
     """
+        if df is None and self.incremental:
+            #skip when the input file did not change since the last register
+            changed,removed,manifest=self.manifestChanges([self.pdfile])
+            if self.hasManifest() and not changed:
+                slurplog.info(f"{self.pdfile} is unchanged, skipping register")
+                return
+
         if df is not None:
             #supplying an existing dataframe takes precedence
             indf=df.copy(deep=False)
@@ -170,6 +184,8 @@ class PandasBase(DataSet):
         
         self.registerInDatabase(indf)
 
+        if df is None and self.incremental:
+            self.updateManifest(manifest)
         #also update entry in the inventory table
         self.updateInvent()
 
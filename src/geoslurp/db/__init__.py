@@ -3,3 +3,5 @@ from .connector import *
 from .tabletools import *
 from .settings import *
 from .geoslurpdb import *
+from .ingest import ingestEngine
+from .runstats import RunRecorder,runStatsReport
@@ -22,7 +22,6 @@ from sqlalchemy.schema import CreateSchema, DropSchema
 from sqlalchemy import Table,func
 from geoslurp.db.tabletools import tableMapFactory
 import re
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from geoslurp.config.slurplogger import  slurplogger, debugging
 import getpass
 from geoslurp.db.connectorbase import GeoslurpConnectorBase
@@ -78,13 +77,26 @@ class GeoslurpConnector(GeoslurpConnectorBase):
         trans=conn.begin()
         return trans,self.Session(bind=conn)
 
-    def vacuumAnalyze(self, tableName, schema):
+    def vacuumAnalyze(self, tablename, schema=None):
         """vacuum and analyze a certain table"""
-        conn = self.dbeng.raw_connection()
-        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
         table=tname(tablename,schema)
-        cursor.execute(text(f'VACUUM ANALYZE {table}";'))
+        #VACUUM cannot run inside a transaction block
+        with self.dbeng.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f'VACUUM ANALYZE {table};'))
+
+    def indexOnColumn(self,tablename,schema,column,opclass=None):
+        """Returns the name of an index which covers a certain column (or None)
+        :param opclass: only consider indexes using this operator class (e.g. gin_trgm_ops)"""
+        qry=text("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = :schema AND tablename = :table ORDER BY indexname")
+        with self.dbeng.connect() as conn:
+            indexes=conn.execute(qry,{"schema":schema.lower(),"table":tablename.lower()}).all()
+        colregex=re.compile(r'\((.*[ (,])?"?%s"?[ ),]'%(column))
+        for idx in indexes:
+            if opclass and opclass not in idx.indexdef:
+                continue
+            if colregex.search(idx.indexdef):
+                return idx.indexname
+        return None
 
     def CreateSchema(self, schema,private=False):
         with self.dbeng.connect() as conn:
@@ -145,6 +157,57 @@ class GeoslurpConnector(GeoslurpConnectorBase):
             conn.execute(text(f'DROP TABLE IF EXISTS {table} CASCADE;'))
             conn.commit()
 
+    def createIndex(self,tablename,schema,columns,method="btree",opclass=None,name=None):
+        """Creates an index on one or more columns of a table (when it does not exist yet)"""
+        if type(columns) == str:
+            columns=[columns]
+        if not name:
+            name="_".join([tablename]+columns+["idx"]).lower()
+        if opclass:
+            if method == "gin" and opclass == "gin_trgm_ops":
+                #trigram indexes require the pg_trgm extension
+                self.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            cols=",".join([f"{col} {opclass}" for col in columns])
+        else:
+            cols=",".join(columns)
+        self.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {tname(tablename,schema)} USING {method} ({cols});")
+        return name
+
+    def dependentViews(self,conn,tablename,schema):
+        """Returns the (materialized) views which depend on a table, ordered such that a view comes after the views it depends on"""
+        qry=text("WITH RECURSIVE deps(oid,depth) AS (" \
+                "SELECT r.ev_class, 1 FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid " \
+                "WHERE d.refobjid = to_regclass(:table) AND r.ev_class <> d.refobjid " \
+                "UNION SELECT r.ev_class, deps.depth+1 FROM deps JOIN pg_depend d ON d.refobjid = deps.oid JOIN pg_rewrite r ON r.oid = d.objid " \
+                "WHERE r.ev_class <> d.refobjid) " \
+                "SELECT n.nspname, c.relname, c.relkind, pg_get_viewdef(c.oid) AS viewdef, max(deps.depth) AS depth " \
+                "FROM deps JOIN pg_class c ON c.oid = deps.oid JOIN pg_namespace n ON n.oid = c.relnamespace " \
+                "GROUP BY c.oid, n.nspname, c.relname, c.relkind ORDER BY depth")
+        return conn.execute(qry,{"table":tname(tablename,schema)}).all()
+
+    def swapTable(self,shadowname,tablename,schema):
+        """Replaces a table by a (fully loaded) shadow table within a single transaction
+        Views which depend on the old table are recreated on top of the new one (the swap is rolled back when that fails)"""
+        with self.dbeng.begin() as conn:
+            views=self.dependentViews(conn,tablename,schema)
+            for view in reversed(views):
+                kind="MATERIALIZED VIEW" if view.relkind == 'm' else "VIEW"
+                conn.execute(text(f"DROP {kind} {tname(view.relname,view.nspname)};"))
+            conn.execute(text(f"DROP TABLE IF EXISTS {tname(tablename,schema)};"))
+            conn.execute(text(f"ALTER TABLE {tname(shadowname,schema)} RENAME TO {tablename.lower()};"))
+            for view in views:
+                kind="MATERIALIZED VIEW" if view.relkind == 'm' else "VIEW"
+                conn.execute(text(f"CREATE {kind} {tname(view.relname,view.nspname)} AS {view.viewdef}"))
+            #rename indexes (and thereby their constraints) and sequences which carry the name of the shadow table
+            qry=text("SELECT c.relname, c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace " \
+                    "WHERE n.nspname = :schema AND c.relkind IN ('i','S') AND c.relname LIKE :pattern")
+            for rel in conn.execute(qry,{"schema":schema.lower(),"pattern":f"%{shadowname.lower()}%"}).all():
+                newname=rel.relname.replace(shadowname.lower(),tablename.lower())
+                if rel.relkind == 'i':
+                    conn.execute(text(f"ALTER INDEX {tname(rel.relname,schema)} RENAME TO {newname};"))
+                else:
+                    conn.execute(text(f"ALTER SEQUENCE {tname(rel.relname,schema)} RENAME TO {newname};"))
+
     def tableExists(self,tablename):
         insp=inspect(self.dbeng)
         sch,tbl=tablename.split(".")
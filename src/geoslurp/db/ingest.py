@@ -0,0 +1,474 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#Ingest engines which write rows (dictionaries of column values) to a database table
+import io
+import json
+import struct
+import time
+from datetime import datetime,date,timezone
+import numpy as np
+from sqlalchemy import Boolean,BigInteger,SmallInteger,Integer,Float,Numeric,DateTime,Date,String,LargeBinary,ARRAY,JSON
+from sqlalchemy.types import TypeDecorator,UserDefinedType
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.dialects.postgresql import JSONB,REAL,DOUBLE_PRECISION
+from geoalchemy2.types import _GISType
+from geoalchemy2.elements import WKBElement,WKTElement
+from geoslurp.config.slurplogger import slurplog
+from geoslurp.config.runcounters import runcounters
+
+
+#PostgreSQL type oids which are needed to write binary arrays
+pgoids={"bool":16,"bytea":17,"int8":20,"int2":21,"int4":23,"text":25,"json":114,"float4":700,"float8":701,
+        "date":1082,"timestamp":1114,"timestamptz":1184,"jsonb":3802}
+
+pgepoch=datetime(2000,1,1)
+pgepochtz=datetime(2000,1,1,tzinfo=timezone.utc)
+
+def toEWKB(wkb,srid=None):
+    """Inserts a srid in a (ISO) WKB geometry so it becomes an extended WKB"""
+    if isinstance(wkb,str):
+        wkb=bytes.fromhex(wkb)
+    else:
+        wkb=bytes(wkb)
+    if not srid:
+        return wkb
+    order='<' if wkb[0] == 1 else '>'
+    gtype,=struct.unpack(order+'I',wkb[1:5])
+    if gtype & 0x20000000:
+        #already contains a srid
+        return wkb
+    return wkb[0:1]+struct.pack(order+'II',gtype|0x20000000,int(srid))+wkb[5:]
+
+def geomToEWKB(value,srid=None):
+    """Converts supported geometry values (WKB/WKT elements, WKB bytes, WKT or hex strings) to extended WKB"""
+    if isinstance(value,WKBElement):
+        if value.srid is not None and value.srid > 0:
+            srid=value.srid
+        return toEWKB(value.data,srid)
+    if isinstance(value,WKTElement):
+        if value.srid is not None and value.srid > 0:
+            srid=value.srid
+        value=value.data
+    if isinstance(value,(bytes,bytearray,memoryview)):
+        return toEWKB(value,srid)
+    if isinstance(value,str):
+        if value[0:2] in ('00','01'):
+            #hex encoded (E)WKB
+            return toEWKB(value,srid)
+        #assume (E)WKT
+        import shapely.wkt
+        if value.upper().startswith("SRID="):
+            sridstr,value=value.split(";",1)
+            srid=int(sridstr[5:])
+        return toEWKB(shapely.wkt.loads(value).wkb,srid)
+    raise TypeError(f"Cannot convert {type(value)} to a geometry")
+
+def pyScalar(value):
+    """Convert numpy scalars to their python equivalent"""
+    if isinstance(value,np.generic):
+        if isinstance(value,np.datetime64):
+            from geoslurp.types.numpy import np_to_datetime
+            return np_to_datetime(value)
+        return value.item()
+    return value
+
+def jsonDefault(value):
+    if isinstance(value,(datetime,date)):
+        return value.isoformat()
+    if isinstance(value,np.generic):
+        return value.item()
+    if isinstance(value,np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+def toJSONstr(value):
+    if isinstance(value,str):
+        #assume this is already serialized
+        return value
+    if hasattr(value,"adapted") and hasattr(value,"dumps"):
+        #psycopg2.extras.Json wrapper
+        return value.dumps(value.adapted)
+    return json.dumps(value,default=jsonDefault)
+
+
+#Text representation as used by COPY ... FROM STDIN
+def copyEscape(txt):
+    return txt.replace('\\','\\\\').replace('\t','\\t').replace('\n','\\n').replace('\r','\\r')
+
+def textValue(value):
+    """Returns the unescaped PostgreSQL text representation of a python value"""
+    value=pyScalar(value)
+    if isinstance(value,bool):
+        return 't' if value else 'f'
+    if isinstance(value,float):
+        if np.isnan(value):
+            return 'NaN'
+        if np.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return repr(value)
+    if isinstance(value,datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value,date):
+        return value.isoformat()
+    if isinstance(value,(bytes,bytearray,memoryview)):
+        return '\\x'+bytes(value).hex()
+    if isinstance(value,dict):
+        return toJSONstr(value)
+    if isinstance(value,(list,tuple,np.ndarray)):
+        return arrayLiteral(value)
+    return str(value)
+
+def arrayLiteral(values):
+    """Create a PostgreSQL array literal from a (nested) sequence"""
+    elems=[]
+    for val in values:
+        val=pyScalar(val)
+        if val is None or (isinstance(val,np.ma.core.MaskedConstant)):
+            elems.append('NULL')
+        elif isinstance(val,(list,tuple,np.ndarray)):
+            elems.append(arrayLiteral(val))
+        elif isinstance(val,(int,float,bool)):
+            elems.append(textValue(val))
+        else:
+            elems.append('"'+textValue(val).replace('\\','\\\\').replace('"','\\"')+'"')
+    return '{'+','.join(elems)+'}'
+
+
+#Binary representation as used by COPY ... FROM STDIN WITH (FORMAT binary)
+def _binTimestamp(value):
+    value=pyScalar(value)
+    if value.tzinfo is None:
+        delta=value-pgepoch
+    else:
+        delta=value-pgepochtz
+    return struct.pack('!q',(delta.days*86400+delta.seconds)*1000000+delta.microseconds)
+
+def _binTimestamptz(value):
+    value=pyScalar(value)
+    if value.tzinfo is None:
+        value=value.replace(tzinfo=timezone.utc)
+    return _binTimestamp(value)
+
+def _binDate(value):
+    value=pyScalar(value)
+    if isinstance(value,datetime):
+        value=value.date()
+    return struct.pack('!i',(value-pgepoch.date()).days)
+
+binEncoders={
+        "bool":lambda v:struct.pack('!?',bool(v)),
+        "int2":lambda v:struct.pack('!h',int(v)),
+        "int4":lambda v:struct.pack('!i',int(v)),
+        "int8":lambda v:struct.pack('!q',int(v)),
+        "float4":lambda v:struct.pack('!f',float(v)),
+        "float8":lambda v:struct.pack('!d',float(v)),
+        "text":lambda v:str(pyScalar(v)).encode('utf-8'),
+        "bytea":lambda v:bytes(v),
+        "json":lambda v:toJSONstr(v).encode('utf-8'),
+        "jsonb":lambda v:b'\x01'+toJSONstr(v).encode('utf-8'),
+        "timestamp":_binTimestamp,
+        "timestamptz":_binTimestamptz,
+        "date":_binDate}
+
+def _arrayShape(values):
+    """Returns the dimensions of a rectangular nested sequence and a flattened list of the values"""
+    if isinstance(values,np.ndarray) and values.dtype != object:
+        return list(values.shape),[None if np.ma.is_masked(v) else v for v in np.ma.ravel(values)]
+    dims=[len(values)]
+    if len(values) > 0 and isinstance(values[0],(list,tuple,np.ndarray)):
+        flat=[]
+        subdims=None
+        for val in values:
+            sdims,sflat=_arrayShape(val)
+            if subdims is not None and sdims != subdims:
+                raise ValueError("PostgreSQL arrays need to be rectangular")
+            subdims=sdims
+            flat.extend(sflat)
+        return dims+subdims,flat
+    return dims,list(values)
+
+def binArray(values,elemtype):
+    """Encode a (nested) sequence as a binary PostgreSQL array"""
+    dims,flat=_arrayShape(values)
+    enc=binEncoders[elemtype]
+    hasnull=any(v is None for v in flat)
+    out=[struct.pack('!iii',len(dims),int(hasnull),pgoids[elemtype])]
+    for dim in dims:
+        out.append(struct.pack('!ii',dim,1))
+    for val in flat:
+        if val is None:
+            out.append(struct.pack('!i',-1))
+        else:
+            bval=enc(val)
+            out.append(struct.pack('!i',len(bval)))
+            out.append(bval)
+    return b''.join(out)
+
+def pgBinaryType(coltype):
+    """Map a sqlalchemy column type on the name of the PostgreSQL binary encoder"""
+    if isinstance(coltype,TypeDecorator):
+        coltype=coltype.impl_instance
+    if isinstance(coltype,UserDefinedType):
+        spec=coltype.get_col_spec().lower()
+        if spec in binEncoders:
+            return spec
+    elif isinstance(coltype,_GISType):
+        return "ewkb"
+    elif isinstance(coltype,ARRAY):
+        return ("array",pgBinaryType(coltype.item_type))
+    elif isinstance(coltype,Boolean):
+        return "bool"
+    elif isinstance(coltype,BigInteger):
+        return "int8"
+    elif isinstance(coltype,SmallInteger):
+        return "int2"
+    elif isinstance(coltype,Integer):
+        return "int4"
+    elif isinstance(coltype,REAL):
+        return "float4"
+    elif isinstance(coltype,(Float,DOUBLE_PRECISION)):
+        return "float8"
+    elif isinstance(coltype,DateTime):
+        return "timestamptz" if coltype.timezone else "timestamp"
+    elif isinstance(coltype,Date):
+        return "date"
+    elif isinstance(coltype,JSONB):
+        return "jsonb"
+    elif isinstance(coltype,JSON):
+        return "json"
+    elif isinstance(coltype,String):
+        return "text"
+    elif isinstance(coltype,LargeBinary):
+        return "bytea"
+    raise TypeError(f"Binary COPY is not supported for column type {coltype}, use the text format instead")
+
+
+class IngestBase:
+    """Base class for engines which write rows (dictionaries of column values) to a database table"""
+    engine=None
+    def __init__(self,table,ses,commitperN=500):
+        self.table=table
+        self._ses=ses
+        self.commitperN=commitperN
+        #when False, the caller is responsible for committing (e.g. to align commits with checkpoints)
+        self.autocommit=True
+        self.nrows=0
+        self.pending=0
+        self.elapsed=0.0
+
+    def add(self,metadict):
+        """Add a single row"""
+        t0=time.perf_counter()
+        self._add(metadict)
+        self.nrows+=1
+        runcounters.addRows(1)
+        self.pending+=1
+        if self.autocommit and self.pending >= self.commitInterval():
+            self._commit()
+        self.elapsed+=time.perf_counter()-t0
+
+    def commitInterval(self):
+        """Amount of added rows after which an autocommit takes place"""
+        return self.commitperN
+
+    def bulk(self,dictlist):
+        """Add a list of rows"""
+        for metadict in dictlist:
+            self.add(metadict)
+
+    def write(self):
+        """Write outstanding rows to the database without committing"""
+        t0=time.perf_counter()
+        self._write()
+        self.elapsed+=time.perf_counter()-t0
+
+    def flush(self):
+        """Write outstanding rows and commit the transaction"""
+        t0=time.perf_counter()
+        self._commit()
+        self.elapsed+=time.perf_counter()-t0
+
+    def _add(self,metadict):
+        raise NotImplementedError(f"_add is not implemented for {self.__class__.__name__}")
+
+    def _write(self):
+        self._ses.flush()
+
+    def _commit(self):
+        self._write()
+        self._ses.commit()
+        self.pending=0
+
+    def rate(self):
+        """Returns the amount of rows written per second"""
+        if self.elapsed > 0:
+            return self.nrows/self.elapsed
+        return 0.0
+
+    def report(self):
+        if self.nrows == 0:
+            return
+        slurplog.info(f"Ingested {self.nrows} rows with the {self.engine} engine in {self.elapsed:.1f} s ({self.rate():.0f} rows/s)")
+
+
+class OrmIngest(IngestBase):
+    """Ingest rows by creating ORM objects and adding them to the session"""
+    engine="orm"
+    def _add(self,metadict):
+        self._ses.add(self.table(**metadict))
+
+    def bulk(self,dictlist):
+        t0=time.perf_counter()
+        self._ses.bulk_insert_mappings(self.table,dictlist)
+        self.nrows+=len(dictlist)
+        runcounters.addRows(len(dictlist))
+        self.pending+=len(dictlist)
+        self.elapsed+=time.perf_counter()-t0
+
+
+class CopyIngest(IngestBase):
+    """Ingest rows by streaming them to PostgreSQL with COPY ... FROM STDIN (text or binary format)"""
+    copyperN=10000
+    def __init__(self,table,ses,commitperN=500,fmt='text'):
+        super().__init__(table,ses,commitperN)
+        if fmt not in ('text','binary'):
+            raise ValueError(f"Unknown COPY format {fmt}")
+        self.fmt=fmt
+        self.engine="copy"+fmt
+        if hasattr(table,"__table__"):
+            self._tbl=table.__table__
+        else:
+            self._tbl=table
+        self._dialect=ses.get_bind().dialect
+        self._columns={col.name:col for col in self._tbl.columns}
+        self._conv={}
+        self._keys=None
+        self._rows=[]
+
+    def commitInterval(self):
+        #don't let commits break up the COPY batches
+        return max(self.commitperN,self.copyperN)
+
+    def _converter(self,name):
+        """Returns a function which converts a python value to its COPY representation for this column"""
+        if name in self._conv:
+            return self._conv[name]
+        try:
+            coltype=self._columns[name].type
+        except KeyError:
+            raise KeyError(f"{name} is not a column of {self._tbl.fullname}")
+
+        isjson=isinstance(coltype,(JSON,JSONB)) or (isinstance(coltype,UserDefinedType) and coltype.get_col_spec().lower() in ("json","jsonb"))
+        if isinstance(coltype,_GISType):
+            srid=coltype.srid if coltype.srid and int(coltype.srid) > 0 else None
+            prep=lambda v,srid=srid:geomToEWKB(v,srid)
+        elif isjson:
+            #serialize with jsonDefault (e.g. datetimes and numpy scalars) instead of the plain json.dumps of the dialect
+            prep=lambda v:v
+        else:
+            proc=coltype.dialect_impl(self._dialect).bind_processor(self._dialect)
+            if proc is None:
+                prep=lambda v:v
+            else:
+                prep=proc
+
+        if self.fmt == 'text':
+            if isinstance(coltype,_GISType):
+                conv=lambda v:prep(v).hex()
+            elif isjson:
+                conv=lambda v:copyEscape(toJSONstr(v))
+            else:
+                conv=lambda v:copyEscape(textValue(prep(v)))
+        else:
+            btype=pgBinaryType(coltype)
+            if btype == "ewkb":
+                conv=prep
+            elif type(btype) == tuple:
+                elemtype=btype[1]
+                conv=lambda v:binArray(prep(v),elemtype)
+            else:
+                enc=binEncoders[btype]
+                conv=lambda v:enc(prep(v))
+        self._conv[name]=conv
+        return conv
+
+    def _encode(self,name,value):
+        if value is None:
+            return None
+        if isinstance(value,ClauseElement):
+            raise TypeError(f"The COPY ingest engine cannot write SQL expressions (column {name}), use the orm engine for this dataset")
+        return self._converter(name)(value)
+
+    def _add(self,metadict):
+        keys=tuple(metadict.keys())
+        if keys != self._keys:
+            #a different set of columns requires a new COPY statement
+            self._copy()
+            self._keys=keys
+        self._rows.append([self._encode(ky,metadict[ky]) for ky in keys])
+        if len(self._rows) >= self.copyperN:
+            self._copy()
+
+    def _write(self):
+        self._copy()
+
+    def _copy(self):
+        """Stream the buffered rows to the database"""
+        if not self._rows:
+            return
+        prep=self._dialect.identifier_preparer
+        cols=",".join([prep.quote(ky) for ky in self._keys])
+        if self.fmt == 'text':
+            buf=io.StringIO()
+            for row in self._rows:
+                buf.write("\t".join(['\\N' if val is None else val for val in row]))
+                buf.write("\n")
+            sql=f"COPY {prep.format_table(self._tbl)} ({cols}) FROM STDIN"
+        else:
+            buf=io.BytesIO()
+            buf.write(b'PGCOPY\n\xff\r\n\x00'+struct.pack('!ii',0,0))
+            for row in self._rows:
+                buf.write(struct.pack('!h',len(row)))
+                for val in row:
+                    if val is None:
+                        buf.write(struct.pack('!i',-1))
+                    else:
+                        buf.write(struct.pack('!i',len(val)))
+                        buf.write(val)
+            buf.write(struct.pack('!h',-1))
+            sql=f"COPY {prep.format_table(self._tbl)} ({cols}) FROM STDIN WITH (FORMAT binary)"
+        buf.seek(0)
+        #use the connection of the session so the COPY is part of the same transaction
+        dbapicon=self._ses.connection().connection
+        with dbapicon.cursor() as cur:
+            cur.copy_expert(sql,buf)
+        self._rows=[]
+
+
+def ingestEngine(engine,table,ses,commitperN=500):
+    """Factory which returns an ingest engine
+    :param engine: 'orm' (default session based), 'copy' (COPY text format) or 'copybinary' (COPY binary format)
+    """
+    if engine == "orm":
+        return OrmIngest(table,ses,commitperN)
+    elif engine == "copy":
+        return CopyIngest(table,ses,commitperN,fmt='text')
+    elif engine == "copybinary":
+        return CopyIngest(table,ses,commitperN,fmt='binary')
+    else:
+        raise ValueError(f"Unknown ingest engine {engine}")
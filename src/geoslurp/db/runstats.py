@@ -0,0 +1,141 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+#contains a table and a recorder to keep track of performance metrics of pull/register runs
+from sqlalchemy import Column,Integer,BigInteger,String,Float,DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import MetaData
+from geoslurp.config.slurplogger import slurplog
+from geoslurp.config.runcounters import runcounters,peakRSS,ErrorCountHandler
+from datetime import datetime
+import socket
+import time
+
+schema="admin"
+#note: a separate base so the table is created (with the right privileges) by createRunStats only
+GSRunBase=declarative_base(metadata=MetaData(schema='admin'))
+
+class RunStatsTable(GSRunBase):
+    """Defines the GEOSLURP POSTGRESQL table with performance metrics of runs"""
+    __tablename__='runstats'
+    id=Column(Integer, primary_key=True)
+    scheme=Column(String)
+    item=Column(String,index=True)
+    kind=Column(String) #dataset, view or function
+    phase=Column(String) #e.g. pull, register, maintenance
+    status=Column(String) #ok, interrupted or failed
+    owner=Column(String)
+    host=Column(String)
+    tstart=Column(DateTime,index=True)
+    duration=Column(Float)
+    rows=Column(BigInteger)
+    bytes=Column(BigInteger)
+    peakrss=Column(BigInteger)
+    errors=Column(Integer)
+    data=Column(JSONB)
+
+
+def createRunStats(dbconn):
+    """Creates the runstats table if it doesn't exist"""
+    if not dbconn.tableExists(f"{schema}.{RunStatsTable.__tablename__}"):
+        RunStatsTable.__table__.create(dbconn.dbeng,checkfirst=True)
+        dbconn.execute('GRANT ALL PRIVILEGES ON admin.runstats to geoslurp;')
+        dbconn.execute('GRANT USAGE ON SEQUENCE admin.runstats_id_seq to geoslurp;')
+        dbconn.execute('GRANT SELECT ON admin.runstats to geobrowse;')
+
+
+class RunRecorder:
+    """Context manager which records the duration, written rows, downloaded bytes, peak memory and errors of a run"""
+    def __init__(self,dbconn,scheme,item,kind,phase):
+        self.db=dbconn
+        self.scheme=scheme
+        self.item=item
+        self.kind=kind
+        self.phase=phase
+        #additional information which may be set during the run
+        self.data={}
+
+    def __enter__(self):
+        self._tstart=datetime.now()
+        self._t0=time.perf_counter()
+        self._counters=runcounters.snapshot()
+        self._errors=ErrorCountHandler()
+        slurplog.addHandler(self._errors)
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        slurplog.removeHandler(self._errors)
+        if exc_type is None:
+            status="ok"
+        elif issubclass(exc_type,KeyboardInterrupt):
+            status="interrupted"
+        else:
+            status="failed"
+        counters=runcounters.snapshot()
+        errors=self._errors.count
+        if status == "failed":
+            errors+=1
+        entry=RunStatsTable(scheme=self.scheme,item=self.item,kind=self.kind,phase=self.phase,status=status,
+                owner=self.db.user,host=socket.gethostname(),tstart=self._tstart,duration=time.perf_counter()-self._t0,
+                rows=counters["rows"]-self._counters["rows"],bytes=counters["bytes"]-self._counters["bytes"],
+                peakrss=peakRSS(),errors=errors,data=self.data)
+        #failing to store the statistics should not break a run
+        try:
+            createRunStats(self.db)
+            ses=self.db.Session()
+            ses.add(entry)
+            ses.commit()
+            ses.close()
+        except Exception as exc:
+            slurplog.warning(f"Could not store run statistics: {exc}")
+        #don't suppress exceptions
+        return False
+
+
+def runStatsReport(dbconn,item=None,last=10):
+    """Returns lines with a report of the last runs (and the throughput trend) per item
+    :param item: restrict to a certain schema.item
+    :param last: amount of runs to show per item and phase"""
+    createRunStats(dbconn)
+    ses=dbconn.Session()
+    qry=ses.query(RunStatsTable)
+    if item:
+        scheme,name=item.split(".")
+        qry=qry.filter(RunStatsTable.scheme == scheme).filter(RunStatsTable.item == name)
+    runs={}
+    for run in qry.order_by(RunStatsTable.tstart):
+        runs.setdefault((run.scheme,run.item,run.phase),[]).append(run)
+    ses.close()
+
+    lines=[]
+    for (scheme,name,phase),entries in sorted(runs.items()):
+        lines.append(f"{scheme}.{name} {phase}:")
+        lines.append("\t%-19s %-11s %9s %10s %9s %9s %9s %8s %6s"%("start","status","duration","rows","rows/s","MB","MB/s","RSS(MB)","errors"))
+        for run in entries[-last:]:
+            dur=max(run.duration,1e-6)
+            mbytes=(run.bytes or 0)/1e6
+            lines.append("\t%-19s %-11s %8.1fs %10d %9.1f %9.1f %9.2f %8.0f %6d"%(run.tstart.strftime("%Y-%m-%d %H:%M:%S"),run.status,
+                run.duration,run.rows or 0,(run.rows or 0)/dur,mbytes,mbytes/dur,(run.peakrss or 0)/1e6,run.errors or 0))
+        #compare the duration of the last succesful run with the median of the previous ones
+        ok=[run.duration for run in entries if run.status == "ok"]
+        if len(ok) > 2:
+            previous=sorted(ok[:-1])
+            median=previous[len(previous)//2]
+            if median > 0:
+                lines.append(f"\ttrend: last run took {100*ok[-1]/median:.0f}% of the median duration of {len(previous)} previous runs")
+    return lines
@@ -26,6 +26,7 @@ import json
 import os
 from collections import namedtuple
 from geoslurp.config.slurplogger import slurplogger
+from geoslurp.config.cachemanager import CacheManager
 import sys
 import getpass
 
@@ -95,6 +96,7 @@ class Settings():
     """Read and write default and user specific settings to and from the database"""
     table=SettingsTable
     pgmount=None
+    _cachemanager=None
     def __init__(self,dbconn):
         self.db=dbconn
         self.ses=self.db.Session()
@@ -345,3 +347,9 @@ class Settings():
         #NOTE: this posssibly applies a mapping of the root part of the directory 
         return getCreateDir(ddir)
 
+    def cacheManager(self):
+        """Returns the manager which tracks the usage of the cache directory and enforces the 'CacheQuota' setting"""
+        if self._cachemanager is None:
+            self._cachemanager=CacheManager.fromSettings(self,self.db.cache)
+        return self._cachemanager
+
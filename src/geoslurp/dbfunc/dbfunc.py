@@ -18,7 +18,7 @@
 from abc import ABC, abstractmethod
 import os
 from geoslurp.config.slurplogger import slurplogger
-from geoslurp.db import Inventory,Settings
+from geoslurp.db import Inventory,Settings,RunRecorder
 import re
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy import text
@@ -76,6 +76,10 @@ class DBFunc(ABC):
     def info(self):
         return self._dbinvent
 
+    def recordRun(self,phase):
+        """Returns a context manager which records performance metrics of a run in admin.runstats"""
+        return RunRecorder(self.db,self.schema,self.name,"function",phase)
+
     def purgeentry(self):
         """Delete pgfunction entry in the database"""
         self._ses.delete(self._dbinvent)
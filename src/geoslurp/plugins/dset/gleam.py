@@ -59,12 +59,9 @@ class Gleam42aDailyBase(DataSet):
         auth=self.conf.authCred("gleam42",qryfields=["user","passw","url"])
         # note url should be of the form  sftp://server:port
         yrs=np.arange(1980,2024)        
-        crwl=crawler(url=auth.url+"/data/v4.2a/daily",auth=auth)
-        for yr in yrs:
-            downdir=os.path.join(self.cacheDir(),str(yr))
-            for uri in crwl.uris(subdirs=str(yr)):
-                if uri.rpath.split("_")[0] == self.var:
-                    uri.download(downdir,check=True)
+        #crawl the yearly subdirectories and download the files in parallel over a pool of sftp sessions
+        crwl=crawler(url=auth.url+"/data/v4.2a/daily",auth=auth,pattern=f"^{self.var}_",followpattern="^("+"|".join(str(yr) for yr in yrs)+")$",nsessions=4)
+        crwl.parallelDownload(self.cacheDir(),check=True)
     
         #convert to zarr storage
         self.convert2zarr()
@@ -32,10 +32,9 @@ from sqlalchemy import Column,Integer,String, Boolean,Float
 from sqlalchemy.dialects.postgresql import JSONB,TIMESTAMP
 from shapely.geometry import Point
 import gzip
-from datetime import datetime,timedelta
+from datetime import datetime
 
 from geoslurp.datapull.http import Uri as http
-from geoslurp.datapull.uri import setFtime
 
 import requests
 import pandas as pd
@@ -55,10 +54,8 @@ class grdc_stations(DataSet):
     def pull(self):
         """Retrieve the station catalogue as json"""
         url="https://portal.grdc.bafg.de/grdc/grdc_sample_records.json"
-        uri,updated=http(url,lastmod=datetime.now()).download(self.cacheDir(),check=True,gzip=True)
-        #set modification time (one day in the future to prevent spurious downloads
-        if updated:
-            setFtime(uri.url,datetime.now()+timedelta(days=1))
+        #the remote modification time is unknown: download conditionally on the stored ETag/Last-Modified
+        uri,updated=http(url).download(self.cacheDir(),check=True,gzip=True,validators=self.validatorStore())
     
     def register(self):
         file=self.cacheDir("grdc_sample_records.json.gz")
@@ -30,6 +30,7 @@ class HydroshedBase(OGRBase):
     schema=schema
     hytype=''
     filename=''
+    incremental=True
     def __init__(self,dbconn):
         super().__init__(dbconn)
         self.setCacheDir(self.conf.getCacheDir(self.schema,subdirs=self.hytype))
@@ -42,7 +43,7 @@ class HydroshedBase(OGRBase):
         downloaddir=self.cacheDir()
         httpserv=http(url,lastmod=datetime(2021,2,8))
         #Newest version which is supported by this plugin
-        uri,upd=httpserv.download(downloaddir,check=True)
+        uri,upd=self.fetchUri(httpserv,downloaddir)
         if upd:
             #unzip all the goodies
             zipd=os.path.join(downloaddir,'extract')
@@ -94,7 +94,7 @@ class ArcticDemRasterBase(RasterBase):
         # download the entire mosaic domain in one tif
         if self.res in ['1km','500m','100m']:
             rasteruri=http("http://data.pgc.umn.edu/elev/dem/setsm/ArcticDEM/mosaic/v3.0/"+self.res+"/"+self.rasterfile,lastmod=datetime(2018,9,26))
-            rasterfileuri,upd=rasteruri.download(self.srcdir,check=False)
+            rasterfileuri,upd=rasteruri.download(self.srcdir,check=False,segments=4)
 
         #download only those tiles which are needed
 
@@ -30,6 +30,7 @@ from netCDF4 import Dataset as ncDset
 from osgeo import ogr
 from datetime import datetime,timedelta
 from queue import Queue
+from itertools import islice
 import gzip as gz
 from geoslurp.config.slurplogger import slurplogger
 from geoslurp.config.catalogue import geoslurpCatalogue
@@ -179,20 +180,25 @@ class Argo2(DataSet):
         self._killUpdate=False
         self.thrd=None
 
-    def pull(self,center=None,mirror=0):
-        """ Pulls the combined \*_prof.nc files from the ftp server
-        :param center (string): only pull data from a specific datacenter
-        :param mirror (0 or 1): use ifremer (0) or usgodae (1) mirror
-        """
+    def crawler(self,center=None,mirror=0):
         ftpmirrors=["ftp://ftp.ifremer.fr/ifremer/argo/","ftp://usgodae.org/pub/outgoing/argo/"]
 
         #since crawling thought the ftp directories takes relatively much time we're going to speed this up using the dedicated ArgoftpCrawler
         if center:
-            ftpcrwl=ArgoftpCrawler(ftpmirrors[mirror],center)
+            return ArgoftpCrawler(ftpmirrors[mirror],center)
         else:
-            ftpcrwl=ArgoftpCrawler(ftpmirrors[mirror])
-        self.updated=ftpcrwl.parallelDownload(self.dataDir(),check=True,maxconn=10,continueonError=True)
+            return ArgoftpCrawler(ftpmirrors[mirror])
 
+    def pull(self,center=None,mirror=0):
+        """ Pulls the combined \*_prof.nc files from the ftp server
+        :param center (string): only pull data from a specific datacenter
+        :param mirror (0 or 1): use ifremer (0) or usgodae (1) mirror
+        """
+        self.updated=self.crawler(center,mirror).parallelDownload(self.dataDir(),check=True,maxconn=10,continueonError=True,backend="curlmulti")
+
+    def pullStream(self,center=None,mirror=0):
+        """Pulls the prof files while yielding (file,updated) as the downloads complete (used in a pipelined run)"""
+        return self.crawler(center,mirror).streamDownload(self.dataDir(),check=True,maxconn=10,continueonError=True,backend="curlmulti")
 
     def register(self,center=None):
         """register downloaded commbined prof files"""
@@ -207,22 +213,39 @@ class Argo2(DataSet):
             slurplogger().info("Argo: No new files found since last update")
             return
 
-        filesnew=self.retainnewUris(files)
-        if len(filesnew) == 0:
+        if self.registerFiles(files,center) == 0:
             slurplogger().info("Argo: No database update needed")
             return
-        #loop over files
-        for uri in filesnew:
-            if center and not re.search(center,uri.url):
-                continue
-            meta=argoMetaExtractor(uri)
-            if meta:
-                self.addEntry(meta)
 
+        self.updateInvent()
+
+    def registerStream(self,downloads,center=None):
+        """Registers the prof files while they are being downloaded (used in a pipelined run)"""
+        #note: files which failed to download are skipped
+        files=(uri for uri,upd in downloads if os.path.exists(uri.url))
+        nnew=0
+        #check the database in chunks, so registration can start before the download is complete
+        for chunk in iter(lambda:list(islice(files,self.commitperN)),[]):
+            nnew+=self.registerFiles(chunk,center)
 
+        if nnew == 0:
+            slurplogger().info("Argo: No database update needed")
+            return
 
         self.updateInvent()
 
+    def registerFiles(self,files,center=None):
+        """Registers files which are new or outdated and returns the amount of those"""
+        #loop over batches of new files
+        nnew=0
+        for filesnew in self.iterNewUris(files):
+            nnew+=len(filesnew)
+            if center:
+                filesnew=[uri for uri in filesnew if re.search(center,uri.url)]
+            #note: committed entries are skipped by iterNewUris, so an interrupted register resumes without a checkpoint
+            self.registerParallel(filesnew,argoMetaExtractor)
+        return nnew
+
 
     # def halt(self):
         # slurplogger().error("Stopping update")
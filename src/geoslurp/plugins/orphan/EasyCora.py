@@ -167,9 +167,9 @@ class EasyCora(DataSet):
         
         #get  cmems authentication details from database
         cred=self.conf.authCred("cmems")
-        ftpcr=ftpCrawler(ftproot,auth=cred, pattern=pattern)
+        ftpcr=ftpCrawler(ftproot,auth=cred, pattern=pattern,nsessions=4)
         
-        updated=ftpcr.parallelDownload(self.cacheDir(),check=True,maxconn=10,continueonError=True)
+        updated=ftpcr.parallelDownload(self.cacheDir(),check=True,maxconn=10,continueonError=True,backend="curlmulti")
         
         #unpack the downloaded files in the data directory
         datadir=self.dataDir()
@@ -194,14 +194,9 @@ class EasyCora(DataSet):
         :param pattern (string) file pattern to look for (defaults to all files ending with .nc)
         """
         #create a list of files which need to be (re)registered
+        #note: committed entries are skipped by retainnewUris, so an interrupted register resumes without a checkpoint
         newfiles=self.retainnewUris([UriFile(file) for file in findFiles(self.dataDir(),pattern)])
-        for uri in newfiles:
-            meta=coraMetaExtractor(uri)
-            if not meta:
-                #don't register empty entries
-                continue
-
-            self.addEntry(meta)
+        self.registerParallel(newfiles,coraMetaExtractor)
         self._dbinvent.data["Description"]="EasyCora output data table"
         self._dbinvent.data["CORAversion"] = "5.2"
         self.updateInvent()
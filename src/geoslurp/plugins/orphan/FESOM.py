@@ -276,13 +276,7 @@ class FESOMRunBase(DataSet):
 
         newfiles=self.retainnewUris([UriFile(file) for file in findFiles(rundir,pattern)])
 
-        for uri in newfiles:
-            meta=FESOMMetaExtractor(uri)
-            if not meta:
-                #don't register empty entries
-                continue
-
-            self.addEntry(meta)
+        self.registerParallel(newfiles,FESOMMetaExtractor)
 
 
 
@@ -51,7 +51,7 @@ class GSHHGBase(OGRBase):
         url='ftp://ftp.soest.hawaii.edu/gshhg/gshhg-shp-%d.%d.%d.zip'%self.gshhgversion
         geturi=ftp(url,lastmod=datetime(2017,6,15))
 
-        furi,upd=geturi.download(self.cache,True)
+        furi,upd=self.fetchUri(geturi,self.cache,segments=4)
         if upd:
             with ZipFile(furi.url,'r') as zp:
                 zp.extractall(self.cache)
@@ -100,7 +100,9 @@ class orasVerticesBase(DataSet):
 
     def register(self, datadir=None):
         meta=orasVerticesMetaExtract(datadir,self.datafile)
-        for i,meta_entry in enumerate(meta):
+        #checkpoint the progress so an interrupted register can be resumed
+        inputhash=self.sourceHash([os.path.join(datadir,self.datafile)])
+        for i,meta_entry in enumerate(self.resumable(meta,inputhash=inputhash)):
             self.addEntry(meta_entry)
         self._dbinvent.data["Description"]="ORAS5 mesh grid 0.25deg"
         self.setDataDir(os.path.abspath(datadir))
@@ -191,13 +193,7 @@ class orasRunBase(DataSet):
 
         newfiles=self.retainnewUris([UriFile(file) for file in findFiles(rundir,pattern)])
 
-        for uri in newfiles:
-            meta=orasMetaExtractor(uri)
-            if not meta:
-                #don't register empty entries
-                continue
-
-            self.addEntry(meta)
+        self.registerParallel(newfiles,orasMetaExtractor)
 
 
 
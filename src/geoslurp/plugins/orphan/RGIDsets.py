@@ -42,14 +42,18 @@ def csvLookup():
         lookup[str(elev)]=Float
     return lookup
 
-def pullRGI(downloaddir,comparewithversion):
+def pullRGI(downloaddir,comparewithversion,store=None):
         httpserv=http('http://www.glims.org/RGI/rgi60_files/00_rgi60.zip',lastmod=datetime(2018,1,1))
         #Newest version which is supported by this plugin
         newestver=(6,0)
         upd=False
         #now determine whether to retrieve the file
         if newestver > comparewithversion:
-            uri,upd=httpserv.download(downloaddir,check=True)
+            if store:
+                #the archive is shared by all RGI datasets
+                uri,upd=store.fetch(httpserv,downloaddir)
+            else:
+                uri,upd=httpserv.download(downloaddir,check=True)
             if not os.path.exists(os.path.join(downloaddir,'extract')):
                 #unzip all the goodies
                 zipd=os.path.join(downloaddir,'zipfiles')
@@ -84,6 +88,7 @@ class RGIBase(OGRBase):
     """
     scheme='cryo'
     filename=''
+    incremental=True
     def __init__(self,dbconn):
         super().__init__(dbconn)
         self.setCacheDir(self.conf.getCacheDir(self.scheme,subdirs='RGI'))
@@ -96,7 +101,7 @@ class RGIBase(OGRBase):
 
     def pull(self):
         """Pulls the entire RGI archive from the web and stores it in a cache"""
-        version,updated=pullRGI(self.cacheDir(),self._dbinvent.data['RGIversion'])
+        version,updated=pullRGI(self.cacheDir(),self._dbinvent.data['RGIversion'],self.blobStore())
         
         self._dbinvent.data["RGIversion"] = version
         self.updateInvent(False)
@@ -120,7 +125,7 @@ class RGICSVBase(CSVBase):
 
     def pull(self):
         """Pulls the entire RGI archive from the web and stores it in a cache"""
-        version,updated=pullRGI(self.cacheDir(),self._dbinvent.data['RGIversion'])
+        version,updated=pullRGI(self.cacheDir(),self._dbinvent.data['RGIversion'],self.blobStore())
         self._dbinvent.data["RGIversion"] = version
         self.updateInvent(False)
 
@@ -77,17 +77,20 @@ class UNRfinal(DataSet):
 
     def pull(self):
         crwl=UnrCrawler(catalogfile=os.path.join(self.dataDir(),'DataHoldings.txt'))
-        self.updated=crwl.parallelDownload(self.dataDir(),check=True,gzip=True,maxconn=10)
+        self.updated=crwl.parallelDownload(self.dataDir(),check=True,gzip=True,maxconn=10,backend="curlmulti")
 
 
     def register(self):
         #create a list of files which need to be (re)registered
 
         crwl=UnrCrawler(catalogfile=os.path.join(self.dataDir(),'DataHoldings.txt'))
+        uris=list(crwl.uris(refresh=False))
+        #check all stations in one go
+        needupdate=self.entriesNeedUpdate([(uri["statname"],uri["lastupdate"]) for uri in uris],col="statname")
 
-        for uri in crwl.uris(refresh=False):
+        for uri in uris:
 
-            if not self.uriNeedsUpdate(uri["statname"],uri["lastupdate"]):
+            if not uri["statname"] in needupdate:
                 continue
 
             localfile=os.path.join(self.dataDir(),os.path.basename(uri["uri"]+".gz"))
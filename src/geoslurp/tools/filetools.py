@@ -0,0 +1,26 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with geoslurp; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+import hashlib
+
+def sha256File(path,blocksize=1024*1024):
+    """Computes the sha256 hex digest of a file by reading it in blocks"""
+    hsh=hashlib.sha256()
+    with open(path,'rb') as fid:
+        for block in iter(lambda:fid.read(blocksize),b''):
+            hsh.update(block)
+    return hsh.hexdigest()
@@ -15,6 +15,7 @@
 
 # Author Roelof Rietbroek (roelof@geod.uni-bonn.de), 2018
 import copy
+import os
 from datetime import datetime
 import sys
 from netCDF4 import Dataset as ncDset
@@ -58,82 +59,109 @@ def ncSwapLongitude(ncinout,longitudevar='longitude'):
 def stackNcFiles(ncout,ncA,ncB,dimension):
     """Append netcdf file B after file A along the dimension specified"""
     slurplogger().info("Patching files %s %s",ncA,ncB)
-    #open the three netcdf files
-    outid=ncDset(ncout,'w',clobber=True)
-    aid=ncDset(ncA,'r')
-    bid=ncDset(ncB,'r')
-    
-    #copy arrays in parts when larger than the choplimit
-    choplimit=1024*1024*1024
-
-    # #copy global attributes
-    nccopyAtt(aid,outid)
-
-    # dimension to be excluded from dimension copy
-    dexcl=[dimension]
-
-    # make a list of variables which need to be appended  and cannot be copied straight away
-    vapp=[ var for var in aid.variables.keys() if dimension in aid.variables[var].dimensions ]
-
-    #copy dimensions (excluding the specified one)
-    for nm,dim in aid.dimensions.items():
-        if nm in dexcl:
-            continue
-        if dim.isunlimited():
-            outid.createDimension(nm,None)
-        else:
-            outid.createDimension(nm,len(dim))
-
-    # copy all variables  and attributes which don't require appending
-    for nm, var in aid.variables.items():
-        if nm in vapp:
-            continue
-        outid.createVariable(nm, var.datatype, var.dimensions)
-        outid[nm].set_auto_mask(False)
-        outid[nm][:] = aid[nm][:]
-        nccopyAtt(aid[nm],outid[nm],['_FillValue'])
-
-    #create new dimension
-    outid.createDimension(dimension,aid.dimensions[dimension].size+bid.dimensions[dimension].size)
-
-    #create new appended variables
-    for var in vapp:
-        outid.createVariable(var,aid[var].datatype,bid[var].dimensions)
-        outid[var].set_auto_mask(False)
-        nccopyAtt(aid[var],outid[var],['_FillValue'])
-   
-        #find out which axis is the to be appended dimension
-        dimax=aid[var].dimensions.index(dimension)
-    
-        idxA=[]
-        for dim in outid[var].dimensions:
-            idxA.append(slice(0,outid.dimensions[dim].size))
-
-        idxA[dimax]=slice(0,aid.dimensions[dimension].size)
-        
-        if aid[var][:].nbytes < choplimit:
-            outid[var][idxA]=aid[var][:]
-        else:
-            #loop over the first dimension (matrix is too big)
-            ia=0
-            for i in range(idxA[0].start,idxA[0].stop):
-                # import pdb;pdb.set_trace()
-                outid[var][[i]+ idxA[1:]]=aid[var][[ia,slice(None),slice(None)]]
-                ia+=1
-        
-        idxB=idxA.copy()
-        idxB[dimax]=slice(aid.dimensions[dimension].size,outid.dimensions[dimension].size)
-        if bid[var][:].nbytes < choplimit:
-            outid[var][idxB]=bid[var][:]
-        else:
-            #loop over the first dimension (matrix is too big)
-            ib=0
-            for i in range(idxB[0].start,idxB[0].stop):
-                outid[var][[i]+ idxB[1:]]=bid[var][[ib,slice(None),slice(None)]]
-                ib+=1
-        
-
-    outid.setncattr('History',outid.getncattr('History')+'\n Modified at %s by Geoslurp: Merge two netcdf files along dimension %s'%(datetime.now(),dimension))
+    return concatNcFiles(ncout,[ncA,ncB],dimension)
+
+def ncCopyBlocks(varin,varout,dimax=0,skip=0,offset=0,choplimit=256*1024*1024):
+    """Copy a netcdf variable in blocks along an axis, so variables larger than memory can be copied
+    :param dimax: axis to copy along
+    :param skip: amount of leading entries along the axis to skip
+    :param offset: position along the axis in the output variable"""
+    shape=varin.shape
+    n=shape[dimax]
+    recbytes=max(1,np.dtype(varin.dtype).itemsize)
+    for i,sz in enumerate(shape):
+        if i != dimax:
+            recbytes*=sz
+    step=max(1,choplimit//max(1,recbytes))
+    idxin=[slice(0,sz) for sz in shape]
+    idxout=idxin.copy()
+    for i0 in range(skip,n,step):
+        i1=min(n,i0+step)
+        idxin[dimax]=slice(i0,i1)
+        idxout[dimax]=slice(offset+i0-skip,offset+i1-skip)
+        varout[tuple(idxout)]=varin[tuple(idxin)]
+
+def concatNcFiles(ncout,ncins,dimension,remove=False,dedupe=False):
+    """Concatenate netcdf files along a dimension, while copying the data in blocks
+    The output is written while the input is consumed, so parts can be merged while others are still being downloaded
+    :param ncout: output file (the dimension keeps a fixed size when ncins is a list without dedupe, otherwise it becomes unlimited)
+    :param ncins: iterable with the input files in the order of concatenation
+    :param dimension: name of the dimension to concatenate along
+    :param remove: remove the input files after the merge succeeded
+    :param dedupe: skip leading entries of a file with coordinate values which don't exceed the last merged one (e.g. the shared boundary of split requests)"""
+    size=None
+    if isinstance(ncins,(list,tuple)) and not dedupe:
+        size=0
+        for ncin in ncins:
+            with ncDset(ncin,'r') as inid:
+                size+=inid.dimensions[dimension].size
+    outid=None
+    inid=None
+    offset=0
+    last=None
+    merged=[]
+    try:
+        for ncin in ncins:
+            inid=ncDset(ncin,'r')
+            inid.set_auto_maskandscale(False)
+            if outid is None:
+                slurplogger().info("Merging netcdf files into %s",ncout)
+                outid=ncDset(ncout,'w',clobber=True)
+                outid.set_auto_maskandscale(False)
+                nccopyAtt(inid,outid)
+                for nm,dim in inid.dimensions.items():
+                    if nm == dimension:
+                        outid.createDimension(nm,size)
+                    else:
+                        outid.createDimension(nm,None if dim.isunlimited() else len(dim))
+                # make a list of variables which need to be appended and cannot be copied straight away
+                vapp=[nm for nm,var in inid.variables.items() if dimension in var.dimensions]
+                for nm,var in inid.variables.items():
+                    outid.createVariable(nm,var.datatype,var.dimensions,fill_value=getattr(var,'_FillValue',None))
+                    nccopyAtt(var,outid[nm],['_FillValue'])
+                    if nm in vapp:
+                        continue
+                    if var.ndim == 0:
+                        outid[nm].assignValue(var.getValue())
+                    else:
+                        ncCopyBlocks(var,outid[nm])
+
+            skip=0
+            if dedupe and last is not None and dimension in inid.variables:
+                coord=inid[dimension][:]
+                if np.all(np.diff(coord) > 0):
+                    skip=int(np.searchsorted(coord,last,side='right'))
+                if skip == len(coord) and skip > 0:
+                    raise RuntimeError("%s does not extend the %s coordinates of the previous files"%(ncin,dimension))
+                if skip > 0:
+                    slurplogger().info("Skipping %d leading %s entries of %s which are already merged",skip,dimension,ncin)
+            n=inid.dimensions[dimension].size-skip
+
+            for nm in vapp:
+                ncCopyBlocks(inid[nm],outid[nm],inid[nm].dimensions.index(dimension),skip,offset)
+            offset+=n
+            if n > 0 and dimension in inid.variables:
+                last=inid[dimension][-1]
+            inid.close()
+            inid=None
+            merged.append(ncin)
+
+        if outid is None:
+            raise RuntimeError("No netcdf files to merge into %s"%(ncout))
+        history=outid.getncattr('History')+'\n' if 'History' in outid.ncattrs() else ''
+        outid.setncattr('History',history+' Modified at %s by Geoslurp: Merge netcdf files along dimension %s'%(datetime.now(),dimension))
+        outid.close()
+        outid=None
+    except:
+        #don't leave a partially merged file behind
+        if inid is not None:
+            inid.close()
+        if outid is not None:
+            outid.close()
+        if os.path.exists(ncout):
+            os.remove(ncout)
+        raise
+    if remove:
+        for ncin in merged:
+            os.remove(ncin)
     return UriFile(ncout),True
-
-
@@ -16,7 +16,7 @@
 # Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2020
 
 from geoslurp.config.slurplogger import slurplogger
-from geoslurp.db import Inventory,Settings
+from geoslurp.db import Inventory,Settings,RunRecorder
 from sqlalchemy.orm.exc import NoResultFound
 from datetime import datetime
 
@@ -64,6 +64,10 @@ class TView:
     def info(self):
         return self._dbinvent
 
+    def recordRun(self,phase):
+        """Returns a context manager which records performance metrics of a run in admin.runstats"""
+        return RunRecorder(self.db,self.schema,self.name,"view",phase)
+
     def register(self):
         """Register the view in the database"""
         slurplogger().info("Creating view %s "%(self.name))
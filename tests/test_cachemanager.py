@@ -0,0 +1,95 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with Frommle; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+import unittest
+import os
+import time
+import tempfile
+from geoslurp.config.cachemanager import CacheManager,parseBytes
+
+
+class TestCacheManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir=tempfile.TemporaryDirectory()
+        self.root=self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def addEntry(self,relpath,size,age):
+        """Creates a cache file of size bytes which was last used age seconds ago"""
+        path=os.path.join(self.root,relpath)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,'wb') as fid:
+            fid.write(b"x"*size)
+        tused=time.time()-age
+        os.utime(path,(tused,tused))
+        return path
+
+    def test_parsebytes(self):
+        self.assertEqual(parseBytes("200M"),200*1024**2)
+        self.assertEqual(parseBytes("1.5k"),1536)
+        self.assertEqual(parseBytes(1000),1000)
+        self.assertIsNone(parseBytes(None))
+        with self.assertRaises(ValueError):
+            parseBytes("lots")
+
+    def test_lru(self):
+        old=self.addEntry("schema1/dset/old.nc",100,300)
+        mid=self.addEntry("schema1/dset/mid.nc",100,200)
+        new=self.addEntry("schema2/dset/new.nc",100,100)
+        cache=CacheManager(self.root,quota=250)
+        self.assertEqual(cache.enforce(),100)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(mid))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(tuple(cache.usage()),(2,200))
+
+    def test_touch(self):
+        old=self.addEntry("schema1/dset/old.nc",100,300)
+        mid=self.addEntry("schema1/dset/mid.nc",100,200)
+        cache=CacheManager(self.root,quota=150)
+        cache.scan()
+        #using an entry makes it the most recent one
+        cache.touch(old)
+        cache.enforce()
+        self.assertTrue(os.path.exists(old))
+        self.assertFalse(os.path.exists(mid))
+
+    def test_keep(self):
+        old=self.addEntry("schema1/dset/old.nc",100,300)
+        mid=self.addEntry("schema1/dset/mid.nc",100,200)
+        cache=CacheManager(self.root,quota=150)
+        cache.enforce(keep=[os.path.dirname(old)])
+        #entries in use are not evicted, even when the quota is exceeded
+        self.assertTrue(os.path.exists(old))
+        self.assertTrue(os.path.exists(mid))
+
+    def test_schemaquota(self):
+        old=self.addEntry("schema1/dset/old.nc",100,300)
+        mid=self.addEntry("schema1/dset/mid.nc",100,200)
+        other=self.addEntry("schema2/dset/other.nc",100,400)
+        cache=CacheManager(self.root,schemaquota={"schema1":150})
+        cache.enforce()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(mid))
+        #other schemas are not restricted
+        self.assertTrue(os.path.exists(other))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with Frommle; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+import unittest
+import json
+from datetime import datetime
+from unittest import mock
+import numpy as np
+from sqlalchemy import MetaData,Table,Column,Integer
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
+from geoslurp.db.ingest import CopyIngest
+
+
+class TestCopyIngest(unittest.TestCase):
+    def setUp(self):
+        self.table=Table("testcopy",MetaData(),Column("id",Integer),Column("data",JSONB))
+        self.ses=mock.Mock()
+        self.ses.get_bind.return_value.dialect=postgresql.psycopg2.dialect()
+
+    def test_jsonb_text(self):
+        ingest=CopyIngest(self.table,self.ses,fmt='text')
+        value={"time":datetime(2024,1,2,3,4,5),"n":np.int64(3)}
+        encoded=ingest._encode("data",value)
+        self.assertEqual(json.loads(encoded),{"time":"2024-01-02T03:04:05","n":3})
+
+    def test_jsonb_binary(self):
+        ingest=CopyIngest(self.table,self.ses,fmt='binary')
+        encoded=ingest._encode("data",{"time":datetime(2024,1,2)})
+        #jsonb binary format: version byte followed by the json text
+        self.assertEqual(encoded[:1],b'\x01')
+        self.assertEqual(json.loads(encoded[1:]),{"time":"2024-01-02T00:00:00"})
+
+    def test_commitinterval(self):
+        ingest=CopyIngest(self.table,self.ses,commitperN=10)
+        self.assertEqual(ingest.commitInterval(),CopyIngest.copyperN)
+
+
+if __name__ == '__main__':
+    unittest.main()
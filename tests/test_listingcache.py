@@ -0,0 +1,115 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with Frommle; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+import unittest
+import os
+import tempfile
+from datetime import datetime
+from urllib.parse import urlparse
+from geoslurp.datapull.listingcache import ListingCache,listingCache
+from geoslurp.datapull.ftp import Crawler as FtpCrawler
+
+
+class TestListingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir=tempfile.TemporaryDirectory()
+        self.cache=ListingCache(os.path.join(self.tmpdir.name,"listings.sqlite"))
+        self.url="https://example.com/data/"
+
+    def tearDown(self):
+        self.cache.db.close()
+        self.tmpdir.cleanup()
+
+    def test_ttl(self):
+        self.cache.put("http",self.url,b"listing")
+        self.assertEqual(self.cache.get("http",self.url),b"listing")
+        #an expired listing is not returned
+        self.assertIsNone(self.cache.get("http",self.url,ttl=0))
+        self.cache.ttl=0
+        self.assertIsNone(self.cache.get("http",self.url))
+        self.assertIsNone(self.cache.get("http","https://example.com/other/"))
+
+    def test_dirmtime(self):
+        self.cache.put("ftp",self.url,b"listing",dirmtime="2024-01-01 00:00:00")
+        #by default the ttl also applies to unchanged directories
+        self.cache.ttl=0
+        self.assertIsNone(self.cache.get("ftp",self.url,dirmtime="2024-01-01 00:00:00"))
+        #an unchanged directory is reused up to maxage, even when the ttl has expired
+        self.cache.maxage=3600
+        self.assertEqual(self.cache.get("ftp",self.url,dirmtime="2024-01-01 00:00:00"),b"listing")
+        #a modified directory invalidates the listing
+        self.assertIsNone(self.cache.get("ftp",self.url,dirmtime="2024-02-01 00:00:00"))
+
+    def test_maxage(self):
+        self.cache.put("ftp",self.url,b"listing",dirmtime="2024-01-01 00:00:00")
+        self.cache.maxage=0
+        self.assertIsNone(self.cache.get("ftp",self.url,dirmtime="2024-01-01 00:00:00"))
+
+    def test_json(self):
+        self.cache.putJson("webdav",self.url,[["/data/a.nc",False,None]])
+        self.assertEqual(self.cache.getJson("webdav",self.url),[["/data/a.nc",False,None]])
+        self.cache.discard("webdav",self.url)
+        self.assertIsNone(self.cache.getJson("webdav",self.url))
+
+
+class TreeCrawler(FtpCrawler):
+    """Ftp crawler which lists a directory tree from a dictionary instead of a server"""
+    def __init__(self,tree,nsessions=1):
+        super().__init__("ftp://example.com/data/",nsessions=nsessions)
+        self.tree=tree
+        self.nlisted=0
+
+    def lsremote(self,url):
+        self.nlisted+=1
+        yield from self.tree[urlparse(url).path]
+
+
+class TestNestedListing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir=tempfile.TemporaryDirectory()
+        #expired listings are only reused when the (live) modification time of their directory is unchanged
+        self.cache=listingCache(os.path.join(self.tmpdir.name,"listings.sqlite"),ttl=0)
+        self.cache.maxage=3600
+        t0=datetime(2024,1,1)
+        self.tree={"/data/":[("a/",t0)],"/data/a/":[("b/",t0)],"/data/a/b/":[("file1.nc",t0)]}
+
+    def tearDown(self):
+        self.cache.db.close()
+        self.tmpdir.cleanup()
+
+    def walk(self,nsessions):
+        crawler=TreeCrawler(self.tree,nsessions)
+        crawler.pattern=r"\.nc$"
+        return sorted(os.path.basename(uri.url) for uri in crawler.uris()),crawler.nlisted
+
+    def test_grandchild(self):
+        for nsessions in [1,2]:
+            with self.subTest(nsessions=nsessions):
+                self.tree["/data/a/b/"]=[("file1.nc",datetime(2024,1,1))]
+                self.tree["/data/a/"]=[("b/",datetime(2024,1,1))]
+                self.assertEqual(self.walk(nsessions)[0],["file1.nc"])
+                #adding a file to the grandchild only changes the modification time of that directory
+                self.tree["/data/a/b/"].append(("file2.nc",datetime(2024,2,1)))
+                self.tree["/data/a/"]=[("b/",datetime(2024,2,1))]
+                files,nlisted=self.walk(nsessions)
+                self.assertEqual(files,["file1.nc","file2.nc"])
+                #the unchanged child is reused from the cache
+                self.assertEqual(nlisted,2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with Frommle; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+import unittest
+from unittest import mock
+from geoslurp.datapull.scheduler import HostScheduler,HostPolicy,TokenBucket,CircuitOpen,TransientHTTPError
+
+
+class TestHostScheduler(unittest.TestCase):
+    url="https://example.com/data/file.nc"
+
+    def test_backoff(self):
+        policy=HostPolicy(backoff=2.0,maxbackoff=10)
+        for attempt,dt in [(0,2.0),(1,4.0),(2,8.0),(5,10)]:
+            for i in range(20):
+                delay=policy.delay(attempt)
+                self.assertGreaterEqual(delay,dt/2)
+                self.assertLessEqual(delay,dt)
+
+    def test_circuit(self):
+        sched=HostScheduler(HostPolicy(failthreshold=3,cooldown=300))
+        sched.failure(self.url)
+        sched.failure(self.url)
+        #below the threshold the host is still used
+        sched.release(sched.acquire(self.url))
+        sched.failure(self.url)
+        with self.assertRaises(CircuitOpen):
+            sched.acquire(self.url)
+        #other hosts are not affected
+        sched.release(sched.acquire("https://example.org/file.nc"))
+
+    def test_success_resets(self):
+        sched=HostScheduler(HostPolicy(failthreshold=2))
+        sched.failure(self.url)
+        sched.success(self.url)
+        sched.failure(self.url)
+        sched.release(sched.acquire(self.url))
+
+    def test_retry(self):
+        sched=HostScheduler(HostPolicy(retries=2,backoff=0))
+        calls=[]
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise TransientHTTPError(self.url,503)
+            return "done"
+        self.assertEqual(sched.run(self.url,flaky),"done")
+        self.assertEqual(len(calls),3)
+
+        #give up after the retries
+        calls.clear()
+        def failing():
+            calls.append(1)
+            raise TransientHTTPError(self.url,503)
+        with self.assertRaises(TransientHTTPError):
+            sched.run(self.url,failing)
+        self.assertEqual(len(calls),3)
+
+    def test_no_retry(self):
+        sched=HostScheduler(HostPolicy(retries=2,backoff=0))
+        calls=[]
+        def broken():
+            calls.append(1)
+            raise ValueError("not transient")
+        with self.assertRaises(ValueError):
+            sched.run(self.url,broken)
+        self.assertEqual(len(calls),1)
+
+    def test_configure(self):
+        sched=HostScheduler()
+        sched.fromSettings({"HostLimits":{"default":{"maxconn":3},"example.com":{"maxconn":1,"maxrate":"1M"}}})
+        self.assertEqual(sched.policy(self.url).maxconn,1)
+        self.assertEqual(sched.policy(self.url).maxrate,1024**2)
+        self.assertEqual(sched.policy("https://example.org/").maxconn,3)
+        #a single slot: a second non blocking acquire fails
+        state=sched.acquire(self.url)
+        self.assertIsNone(sched.acquire(self.url,blocking=False))
+        sched.release(state)
+
+    def test_requestconcurrency(self):
+        sched=HostScheduler(HostPolicy(maxconn=6))
+        with mock.patch("geoslurp.datapull.scheduler.slurplog") as log:
+            self.assertEqual(sched.requestConcurrency(self.url,4),4)
+            log.info.assert_not_called()
+            self.assertEqual(sched.requestConcurrency(self.url,8),6)
+            self.assertEqual(sched.requestConcurrency(self.url,8),6)
+            #the cap is reported once per host
+            log.info.assert_called_once()
+            #unless the host limits are raised
+            sched.configure("example.com",maxconn=8)
+            self.assertEqual(sched.requestConcurrency(self.url,8),8)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume(self):
+        bucket=TokenBucket(1000)
+        with mock.patch("geoslurp.datapull.scheduler.time.sleep") as sleep:
+            #the bucket starts full
+            bucket.consume(1000)
+            sleep.assert_not_called()
+            #exceeding the rate requires waiting for the missing tokens
+            bucket.consume(500)
+            sleep.assert_called_once()
+            self.assertAlmostEqual(sleep.call_args[0][0],0.5,delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# This file is part of geoslurp.
+# geoslurp is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+
+# geoslurp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with Frommle; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+# Author Roelof Rietbroek (r.rietbroek@utwente.nl), 2024
+
+import unittest
+from geoslurp.datapull.webdav import MultiStatusParser
+
+multistatus=b"""<?xml version="1.0" encoding="utf-8"?>
+<d:multistatus xmlns:d="DAV:">
+  <d:response>
+    <d:href>/data/</d:href>
+    <d:propstat><d:prop><d:resourcetype><d:collection/></d:resourcetype></d:prop></d:propstat>
+  </d:response>
+  <d:response>
+    <d:href>/data/file1.nc</d:href>
+    <d:propstat><d:prop><d:resourcetype/><d:getlastmodified>Mon, 01 Jan 2024 00:00:00 GMT</d:getlastmodified></d:prop></d:propstat>
+  </d:response>
+</d:multistatus>
+"""
+
+
+class TestMultiStatusParser(unittest.TestCase):
+    def test_chunks(self):
+        parser=MultiStatusParser()
+        #feed the document in small pieces as curl would
+        for i in range(0,len(multistatus),7):
+            parser.write(multistatus[i:i+7])
+        entries=parser.close()
+        self.assertFalse(parser.refused())
+        self.assertEqual(entries,[("/data/",True,None),("/data/file1.nc",False,"Mon, 01 Jan 2024 00:00:00 GMT")])
+
+    def test_errordocument(self):
+        #e.g. a server which does not allow infinite depth
+        parser=MultiStatusParser()
+        parser.write(b'<?xml version="1.0"?><d:error xmlns:d="DAV:"><d:propfind-finite-depth/></d:error>')
+        self.assertEqual(parser.close(),[])
+        self.assertTrue(parser.refused())
+
+    def test_html(self):
+        parser=MultiStatusParser()
+        parser.write(b"<html><body><h1>403 Forbidden</h1></body></html")
+        parser.write(b"> <p>not allowed</p>&nbsp;<<")
+        parser.close()
+        self.assertTrue(parser.refused())
+
+    def test_truncated(self):
+        parser=MultiStatusParser()
+        parser.write(multistatus[:len(multistatus)//2])
+        parser.close()
+        self.assertTrue(parser.refused())
+
+
+if __name__ == '__main__':
+    unittest.main()